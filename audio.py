@@ -0,0 +1,491 @@
+# audio.py
+"""
+Audio processing, independent of the sound device.
+
+SilenceSuppressor sits on the microphone path: a VoiceActivityDetector
+(energy and zero-crossing rate against an adaptive noise floor, with
+hangover) decides per block whether the user is speaking. During silence only
+a sparse comfort-noise packet goes out: a one-byte payload holding the
+background noise level in -dBov, as in RFC 3389.
+
+JitterBuffer turns a stream of sequence-numbered PCM packets from one remote
+participant into a continuous sample stream that the output device pulls at
+its own pace (the playout clock). It reorders packets, adapts its target depth
+to the measured network jitter, conceals lost packets and trims itself back
+down when latency builds up. Between talk spurts it plays comfort noise at the
+level the sender last reported.
+
+AudioMixer sums the jitter buffers of all remote participants into the one
+sample stream that feeds the output device, applying per-participant gain and
+mute and a peak limiter, so playout costs one device stream however many
+people are in the room.
+
+ConferenceMixer is the server side of the optional mixing mode (MCU): one
+jitter buffer per speaker aligns their packets by sequence number, and each
+frame interval produces one mix for listeners who are not speaking plus an
+N-1 mix (own voice removed) for each active speaker.
+
+ActiveSpeakers is the server's running order of who spoke most recently,
+fed with the level each speech packet carries (audio_level); the relay uses
+it to forward video of the last N speakers only.
+"""
+import math
+import threading
+import time
+
+import numpy as np
+
+from constants import *
+
+FRAME_MS = BLOCK_SIZE * 1000 / SAMPLE_RATE
+MAX_CONCEALED = 4  # consecutive concealed frames before falling silent
+LIMIT = 32767
+LIMITER_RELEASE = 0.05  # fraction of the way back to unity gain per mixed block
+SPEAKER_IDLE = 0.5  # seconds without packets before a speaker leaves the mix
+
+# Voice activity detection
+VAD_THRESHOLD_DB = 9.0     # speech: this far above the noise floor
+VAD_MIN_SPEECH_DB = -55.0  # nothing quieter than this is speech
+VAD_ZCR_UNVOICED = 0.25    # fricatives: weaker but with many zero crossings
+VAD_HANGOVER = 8           # blocks (~340 ms) kept open after speech ends
+COMFORT_NOISE_INTERVAL = 12  # blocks (~0.5 s) between comfort-noise packets in silence
+COMFORT_NOISE_SIZE = 1       # payload bytes of a comfort-noise packet
+
+# Active speaker order
+SPEAKER_SMOOTHING = 0.3   # weight of each packet's level in the smoothed level
+SPEAKER_LEVEL_DB = -50.0  # smoothed level above this is talking
+SPEAKER_SWITCH = 0.5      # seconds of talking, and since the last change, before taking the front
+SPEAKER_MARGIN_DB = 6.0   # how much louder than a front speaker who is still talking
+
+
+def level_dbfs(samples: np.ndarray) -> float:
+    """RMS level of int16 samples in dB relative to full scale"""
+    if not len(samples):
+        return -127.0
+    power = np.mean(np.square(samples, dtype=np.float64))
+    return max(-127.0, 10 * math.log10(power / 32768 ** 2)) if power else -127.0
+
+
+def audio_level(pcm) -> int:
+    """Level of an int16 PCM block for the packet header, in -dBov"""
+    return min(127, max(0, round(-level_dbfs(np.frombuffer(pcm, np.int16)))))
+
+
+def is_comfort_noise(payload) -> bool:
+    return payload is not None and len(payload) == COMFORT_NOISE_SIZE
+
+
+def comfort_noise_payload(level_db: float) -> bytes:
+    return bytes([min(127, max(0, round(-level_db)))])
+
+
+def comfort_noise(payload, n: int) -> np.ndarray:
+    """n samples of white noise at the level carried by a comfort-noise payload"""
+    rms = 32768 * 10 ** (-payload[0] / 20)
+    return np.random.normal(0, rms, n).clip(-32768, 32767).astype(np.int16)
+
+
+class VoiceActivityDetector:
+    def __init__(self, threshold_db: float = VAD_THRESHOLD_DB, hangover: int = VAD_HANGOVER):
+        self.threshold_db = threshold_db
+        self.hangover_blocks = hangover
+        self.hangover = 0
+        self.noise_floor = None  # dBFS
+        self.speaking = False
+
+    def process(self, pcm) -> bool:
+        """Classify one block of int16 PCM; returns (and sets) self.speaking"""
+        samples = np.frombuffer(pcm, np.int16)
+        level = level_dbfs(samples)
+        signs = np.signbit(samples)
+        zcr = np.count_nonzero(signs[1:] != signs[:-1]) / max(1, len(samples) - 1)
+        if self.noise_floor is None:
+            self.noise_floor = level
+
+        above = level - self.noise_floor
+        voice = level > VAD_MIN_SPEECH_DB and (
+            above > self.threshold_db or
+            (above > self.threshold_db / 2 and zcr > VAD_ZCR_UNVOICED)
+        )
+        # Noise floor: follow drops quickly, rises slowly, and barely moves during speech
+        if level < self.noise_floor:
+            self.noise_floor += (level - self.noise_floor) * 0.5
+        else:
+            self.noise_floor += (level - self.noise_floor) * (0.002 if voice else 0.05)
+
+        if voice:
+            self.hangover = self.hangover_blocks
+        elif self.hangover:
+            self.hangover -= 1
+        self.speaking = voice or self.hangover > 0
+        return self.speaking
+
+
+class SilenceSuppressor:
+    """Microphone blocks in, packets to send out: speech, sparse comfort noise, or nothing"""
+
+    def __init__(self, interval: int = COMFORT_NOISE_INTERVAL):
+        self.vad = VoiceActivityDetector()
+        self.interval = interval
+        self.silent_blocks = 0
+
+    @property
+    def speaking(self) -> bool:
+        return self.vad.speaking
+
+    def filter(self, pcm):
+        if self.vad.process(pcm):
+            self.silent_blocks = 0
+            return pcm
+        # First silent block right away so receivers switch to comfort noise, then sparse keepalives
+        send = self.silent_blocks % self.interval == 0
+        self.silent_blocks += 1
+        return comfort_noise_payload(self.vad.noise_floor) if send else None
+
+
+class JitterBuffer:
+    def __init__(self, frame_samples: int = BLOCK_SIZE, min_depth: int = 1, max_depth: int = 8):
+        self.frame_samples = frame_samples
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.frames: dict[int, np.ndarray] = {}
+            self.next_seq = None
+            self.last_seq = None         # for senders without sequence numbers
+            self.buffering = True        # prebuffering until target depth is reached
+            self.pending = np.zeros(0, np.int16)  # samples of the frame being played out
+            self.last_frame = None
+            self.concealed_run = 0
+            self.noise = None            # comfort-noise payload while the sender is silent
+            self.target_depth = self.min_depth + 1
+            self.jitter = 0.0            # ms, RFC 3550 style
+            self.prev_arrival = None
+            self.prev_seq = None
+            # counters
+            self.played = 0
+            self.concealed = 0
+            self.underruns = 0
+            self.late = 0
+            self.trimmed = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self.frames)
+
+    def push(self, pcm, seq: int = None, arrival: float = None):
+        """Add one received packet of int16 PCM or comfort noise"""
+        noise = is_comfort_noise(pcm)
+        frame = comfort_noise(pcm, self.frame_samples) if noise else np.frombuffer(pcm, np.int16)
+        if arrival is None:
+            arrival = time.monotonic()
+        with self.lock:
+            if seq is None:
+                seq = 0 if self.last_seq is None else self.last_seq + 1
+            self.last_seq = seq
+
+            if self.next_seq is not None and seq < self.next_seq:
+                self.late += 1
+                return
+            self.noise = pcm if noise else None
+            self.frames[seq] = frame
+            if noise:
+                self.prev_arrival = None  # sparse keepalives say nothing about network jitter
+            else:
+                self._update_jitter(seq, arrival, len(frame) * 1000 / SAMPLE_RATE)
+
+    def _update_jitter(self, seq: int, arrival: float, frame_ms: float):
+        # frame_ms comes from the packet, so senders may change their frame size mid-call
+        if self.prev_arrival is not None and seq > self.prev_seq:
+            spacing = (arrival - self.prev_arrival) * 1000
+            d = abs(spacing - (seq - self.prev_seq) * frame_ms)
+            self.jitter += (d - self.jitter) / 16
+            # Enough depth to ride out about three jitter deviations
+            depth = 1 + math.ceil(3 * self.jitter / frame_ms)
+            self.target_depth = max(self.min_depth, min(self.max_depth, depth))
+        if self.prev_seq is None or seq > self.prev_seq:
+            self.prev_arrival, self.prev_seq = arrival, seq
+
+    def _conceal(self, counted: bool = True) -> np.ndarray:
+        """Repeat the last frame, fading by half per consecutive loss, then silence"""
+        if counted:
+            self.concealed += 1
+        self.concealed_run += 1
+        if self.last_frame is None or self.concealed_run > MAX_CONCEALED:
+            return self._silence()
+        start = 0.5 ** (self.concealed_run - 1)
+        ramp = np.linspace(start, start / 2, len(self.last_frame), dtype=np.float32)
+        return (self.last_frame * ramp).astype(np.int16)
+
+    def _silence(self) -> np.ndarray:
+        if self.noise is not None:
+            return comfort_noise(self.noise, self.frame_samples)
+        return np.zeros(self.frame_samples, np.int16)
+
+    def _next_frame(self) -> np.ndarray:
+        if self.buffering:
+            if self.depth < self.target_depth:
+                return self._conceal(counted=False)
+            self.buffering = False
+            self.next_seq = min(self.frames)
+
+        if not self.frames:
+            if self.noise is not None:
+                # Sender is silent: nothing is late, just fill with comfort noise
+                self.buffering = True
+                return self._silence()
+            # Underrun: conceal and wait for the buffer to refill
+            self.underruns += 1
+            self.buffering = True
+            return self._conceal()
+
+        # Latency control: drop the oldest frames if the buffer has grown well past target
+        if self.depth > self.target_depth + 2:
+            while self.depth > self.target_depth:
+                self.frames.pop(min(self.frames))
+                self.trimmed += 1
+            self.next_seq = min(self.frames)
+        first = min(self.frames)
+        if first - self.next_seq > MAX_CONCEALED:
+            self.next_seq = first  # long gap (e.g. muted sender): resync instead of concealing
+
+        frame = self.frames.pop(self.next_seq, None)
+        self.next_seq += 1
+        if frame is None:
+            return self._conceal()  # lost or still in flight; a late arrival is discarded
+        self.played += 1
+        self.concealed_run = 0
+        self.last_frame = frame
+        return frame
+
+    def read(self, n: int) -> np.ndarray:
+        """Pull exactly n samples for the output device"""
+        with self.lock:
+            chunks = [self.pending]
+            available = len(self.pending)
+            while available < n:
+                frame = self._next_frame()
+                chunks.append(frame)
+                available += len(frame)
+            samples = np.concatenate(chunks) if len(chunks) > 1 else self.pending
+            self.pending = samples[n:]
+            return samples[:n]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "depth": self.depth,
+                "target_depth": self.target_depth,
+                "jitter_ms": self.jitter,
+                "played": self.played,
+                "concealed": self.concealed,
+                "underruns": self.underruns,
+                "late": self.late,
+                "trimmed": self.trimmed,
+            }
+
+
+class AudioMixer:
+    """Mixes many JitterBuffers into one int16 stream; read() is the device callback's source"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sources: dict[str, JitterBuffer] = {}
+        self.gains: dict[str, float] = {}
+        self.muted: set[str] = set()
+        self.limiter_gain = 1.0
+        self.limited = 0  # blocks where the limiter had to pull the level down
+
+    def add(self, name: str, buffer: JitterBuffer, gain: float = 1.0):
+        with self.lock:
+            self.sources[name] = buffer
+            self.gains[name] = gain
+
+    def remove(self, name: str):
+        with self.lock:
+            self.sources.pop(name, None)
+            self.gains.pop(name, None)
+            self.muted.discard(name)
+
+    def set_gain(self, name: str, gain: float):
+        with self.lock:
+            if name in self.sources:
+                self.gains[name] = max(0.0, gain)
+
+    def get_gain(self, name: str) -> float:
+        with self.lock:
+            return self.gains.get(name, 1.0)
+
+    def set_muted(self, name: str, muted: bool):
+        with self.lock:
+            if name not in self.sources:
+                return
+            if muted:
+                self.muted.add(name)
+            else:
+                self.muted.discard(name)
+
+    def is_muted(self, name: str) -> bool:
+        with self.lock:
+            return name in self.muted
+
+    def read(self, n: int) -> np.ndarray:
+        """Pull n mixed samples"""
+        with self.lock:
+            sources = [(name, buffer, self.gains[name]) for name, buffer in self.sources.items()]
+            muted = set(self.muted)
+        mix = np.zeros(n, np.float32)
+        for name, buffer, gain in sources:
+            # Muted participants are still drained so their buffers keep pace with the device
+            pcm = buffer.read(n)
+            if name in muted or gain == 0.0:
+                continue
+            if gain == 1.0:
+                mix += pcm
+            else:
+                mix += pcm * np.float32(gain)
+
+        # Peak limiter: instant attack, gradual release back to unity
+        peak = float(np.abs(mix).max()) if n else 0.0
+        ceiling = min(1.0, LIMIT / peak) if peak else 1.0
+        if ceiling < self.limiter_gain:
+            self.limiter_gain = ceiling
+            self.limited += 1
+        else:
+            gain = self.limiter_gain + (1.0 - self.limiter_gain) * LIMITER_RELEASE
+            self.limiter_gain = 1.0 if gain > 0.999 else min(gain, ceiling)
+        if self.limiter_gain != 1.0:
+            mix *= np.float32(self.limiter_gain)
+        return np.clip(mix, -LIMIT - 1, LIMIT).astype(np.int16)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "sources": len(self.sources),
+                "muted": len(self.muted),
+                "limiter_gain": self.limiter_gain,
+                "limited": self.limited,
+            }
+
+
+class ConferenceMixer:
+    """Server-side N-1 mixing of every active speaker, one frame interval per mix() call"""
+
+    def __init__(self, frame_samples: int = BLOCK_SIZE):
+        self.frame_samples = frame_samples
+        self.lock = threading.Lock()
+        self.speakers: dict[int, JitterBuffer] = {}
+        self.last_heard: dict[int, float] = {}
+
+    def push(self, speaker: int, pcm, seq: int = None, arrival: float = None):
+        if arrival is None:
+            arrival = time.monotonic()
+        with self.lock:
+            buffer = self.speakers.get(speaker)
+            if buffer is None:
+                buffer = self.speakers[speaker] = JitterBuffer(self.frame_samples)
+            self.last_heard[speaker] = arrival
+        buffer.push(pcm, seq, arrival)
+
+    def remove(self, speaker: int):
+        with self.lock:
+            self.speakers.pop(speaker, None)
+            self.last_heard.pop(speaker, None)
+
+    def active(self, now: float = None) -> list[int]:
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            return [s for s, heard in self.last_heard.items() if now - heard < SPEAKER_IDLE]
+
+    def mix(self, now: float = None) -> tuple[np.ndarray, dict[int, np.ndarray]]:
+        """
+        Returns (mix of all active speakers, {speaker: mix without that speaker}),
+        or (None, {}) when nobody is speaking.
+        """
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            for speaker, heard in tuple(self.last_heard.items()):
+                if now - heard >= SPEAKER_IDLE:
+                    # Gone quiet: drop the stale buffer so the next talk spurt prebuffers afresh
+                    self.speakers[speaker].reset()
+                    self.last_heard.pop(speaker)
+            active = [(s, self.speakers[s]) for s in self.last_heard]
+        if not active:
+            return None, {}
+
+        frames = {speaker: buffer.read(self.frame_samples) for speaker, buffer in active}
+        total = np.zeros(self.frame_samples, np.int32)
+        for pcm in frames.values():
+            total += pcm
+        everyone = np.clip(total, -LIMIT - 1, LIMIT).astype(np.int16)
+        own = {speaker: np.clip(total - pcm, -LIMIT - 1, LIMIT).astype(np.int16)
+               for speaker, pcm in frames.items()}
+        return everyone, own
+
+
+class ActiveSpeakers:
+    """
+    Participants ordered by how recently they spoke, from the level of their
+    audio packets. Levels are smoothed, and moving to the front takes
+    SPEAKER_SWITCH of talking and, while the front speaker is still talking, a
+    voice SPEAKER_MARGIN_DB louder, so coughs and cross-talk do not reshuffle
+    the order. Participants who never spoke stay at the back in join order.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.order: list[str] = []  # most recent speaker first
+        self.rank: dict[str, int] = {}  # name -> index in order; replaced on change, read without the lock
+        self.levels: dict[str, float] = {}  # smoothed, dBFS
+        self.talking_since: dict[str, float] = {}
+        self.front_since = 0.0
+
+    def add(self, name: str):
+        with self.lock:
+            if name not in self.rank:
+                self.order.append(name)
+                self._reindex()
+
+    def remove(self, name: str):
+        with self.lock:
+            if name in self.rank:
+                self.order.remove(name)
+                self.levels.pop(name, None)
+                self.talking_since.pop(name, None)
+                self._reindex()
+
+    def update(self, name: str, level_db: float = None, now: float = None) -> bool:
+        """Feed one audio packet's level in dBFS, None for silence; True when the order changed"""
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            if name not in self.rank:
+                return False
+            if level_db is None:
+                level = -127.0
+            else:
+                level = self.levels.get(name, -127.0)
+                level += (level_db - level) * SPEAKER_SMOOTHING
+            self.levels[name] = level
+            if level < SPEAKER_LEVEL_DB:
+                self.talking_since.pop(name, None)
+                return False
+            since = self.talking_since.setdefault(name, now)
+            front = self.order[0]
+            if front == name or now - since < SPEAKER_SWITCH or now - self.front_since < SPEAKER_SWITCH:
+                return False
+            if front in self.talking_since and level < self.levels[front] + SPEAKER_MARGIN_DB:
+                return False
+            self.order.remove(name)
+            self.order.insert(0, name)
+            self.front_since = now
+            self._reindex()
+            return True
+
+    def _reindex(self):
+        self.rank = {name: i for i, name in enumerate(self.order)}
@@ -0,0 +1,291 @@
+# audio_codecs.py
+"""
+Audio codecs for the microphone stream, pure NumPy and standard library.
+
+  pcm      : 48 kHz int16 as captured (no codec, msg.codec is None)  768 kbit/s
+  ulaw     : G.711 mu-law, 8 bits per sample                          384 kbit/s
+  adpcm    : IMA ADPCM, 4 bits per sample                             192 kbit/s
+  adpcm16k : low-pass and decimate to 16 kHz, then IMA ADPCM           64 kbit/s
+  ulaw16k  : low-pass and decimate to 16 kHz, then mu-law             128 kbit/s
+
+The codec is agreed per session at login and every coded packet names its
+codec in the header, so receivers can decode any sender. Each ADPCM packet
+starts with the predictor state, so a lost packet does not desynchronize the
+next one. Comfort-noise packets (see audio.py) are never coded.
+
+Everything but the ADPCM encoder is vectorised. That one is a per-sample
+loop, since every code depends on the predictor the previous codes left, so
+the server codes the mixes it sends in mixing mode as ulaw16k (see
+choose_mix_codec) and leaves ADPCM encoding to the clients, one stream each.
+"""
+import struct
+
+import numpy as np
+
+from constants import *
+
+# Preference order when negotiating
+SUPPORTED = (ADPCM_16K, ADPCM, ULAW, ULAW_16K)
+
+# --- mu-law (G.711) ---
+ULAW_BIAS = 0x84
+ULAW_CLIP = 32635
+
+
+def _ulaw_decode_table() -> np.ndarray:
+    codes = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (codes >> 4) & 0x07
+    mantissa = codes & 0x0F
+    magnitude = (((mantissa << 3) + ULAW_BIAS) << exponent) - ULAW_BIAS
+    return np.where(codes & 0x80, -magnitude, magnitude).astype(np.int16)
+
+
+def _ulaw_encode_table() -> np.ndarray:
+    x = np.arange(-32768, 32768, dtype=np.int32)
+    sign = np.where(x < 0, 0x80, 0)
+    magnitude = np.minimum(np.abs(x), ULAW_CLIP) + ULAW_BIAS
+    exponent = np.floor(np.log2(magnitude)).astype(np.int32) - 7
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8)
+
+
+ULAW_DECODE = _ulaw_decode_table()
+ULAW_ENCODE = _ulaw_encode_table()  # indexed by sample + 32768
+
+
+def ulaw_encode(samples: np.ndarray) -> bytes:
+    return ULAW_ENCODE[samples.astype(np.int32) + 32768].tobytes()
+
+
+def ulaw_decode(data) -> np.ndarray:
+    return ULAW_DECODE[np.frombuffer(data, np.uint8)]
+
+
+# --- IMA ADPCM ---
+ADPCM_STEPS = (
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767,
+)
+ADPCM_INDEX_SHIFT = (-1, -1, -1, -1, 2, 4, 6, 8)
+# predictor and step index (the decoder state at the start of the packet),
+# and whether the last nibble is padding
+ADPCM_HEADER = struct.Struct('>hBB')
+
+# Per (step index, code): predictor change and next step index, so the
+# sample loops below are table lookups on plain ints
+ADPCM_DELTA = []
+ADPCM_NEXT = []
+for _index, _step in enumerate(ADPCM_STEPS):
+    deltas, nexts = [], []
+    for _code in range(16):
+        delta = _step >> 3
+        if _code & 4:
+            delta += _step
+        if _code & 2:
+            delta += _step >> 1
+        if _code & 1:
+            delta += _step >> 2
+        deltas.append(-delta if _code & 8 else delta)
+        nexts.append(min(88, max(0, _index + ADPCM_INDEX_SHIFT[_code & 7])))
+    ADPCM_DELTA.append(deltas)
+    ADPCM_NEXT.append(nexts)
+# The same as arrays for the vectorised decoder
+ADPCM_DELTA_TABLE = np.array(ADPCM_DELTA, np.int32)
+ADPCM_SHIFT_TABLE = np.array(ADPCM_INDEX_SHIFT * 2, np.int32)
+
+
+class AdpcmState:
+    def __init__(self):
+        self.predictor = 0
+        self.index = 0
+
+
+def adpcm_encode(samples: np.ndarray, state: AdpcmState) -> bytes:
+    header = ADPCM_HEADER.pack(state.predictor, state.index, len(samples) % 2)
+    predictor, index = state.predictor, state.index
+    codes = []
+    for sample in samples.tolist():
+        step = ADPCM_STEPS[index]
+        diff = sample - predictor
+        code = 0
+        if diff < 0:
+            code = 8
+            diff = -diff
+        if diff >= step:
+            code |= 4
+            diff -= step
+        if diff >= step >> 1:
+            code |= 2
+            diff -= step >> 1
+        if diff >= step >> 2:
+            code |= 1
+        predictor += ADPCM_DELTA[index][code]
+        if predictor > 32767:
+            predictor = 32767
+        elif predictor < -32768:
+            predictor = -32768
+        index = ADPCM_NEXT[index][code]
+        codes.append(code)
+    state.predictor, state.index = predictor, index
+    if len(codes) % 2:
+        codes.append(0)
+    nibbles = np.array(codes, np.uint8)
+    return header + (nibbles[0::2] << 4 | nibbles[1::2]).tobytes()
+
+
+def clamped_cumsum(start: int, steps: np.ndarray, low: int, high: int) -> np.ndarray:
+    """
+    Running sum of steps from start, clamped to [low, high] after every step.
+    A sum that only ever hits one bound has a closed form (the running sum
+    lifted by its worst overshoot so far); one that hits both takes the loop.
+    """
+    sums = start + np.cumsum(steps, dtype=np.int32)
+    if not len(sums):
+        return sums
+    if sums.min() >= low and sums.max() <= high:
+        return sums
+    lifted = sums + np.maximum(np.maximum.accumulate(low - sums), 0)
+    if lifted.max() <= high:
+        return lifted
+    lowered = sums - np.maximum(np.maximum.accumulate(sums - high), 0)
+    if lowered.min() >= low:
+        return lowered
+    out = np.empty(len(sums), np.int32)
+    value = start
+    for i, step in enumerate(steps.tolist()):
+        value = min(max(value + step, low), high)
+        out[i] = value
+    return out
+
+
+def adpcm_decode(data) -> np.ndarray:
+    predictor, index, padded = ADPCM_HEADER.unpack_from(data)
+    packed = np.frombuffer(data, np.uint8, offset=ADPCM_HEADER.size)
+    codes = np.empty(len(packed) * 2, np.uint8)
+    codes[0::2] = packed >> 4
+    codes[1::2] = packed & 0x0F
+    codes = codes[:len(codes) - padded]
+    # The step index follows from the codes alone; the predictor from both
+    indexes = np.empty(len(codes), np.int32)
+    indexes[:1] = index
+    indexes[1:] = clamped_cumsum(index, ADPCM_SHIFT_TABLE[codes[:-1]], 0, 88)
+    return clamped_cumsum(predictor, ADPCM_DELTA_TABLE[indexes, codes], -32768, 32767).astype(np.int16)
+
+
+# --- 48 kHz <-> 16 kHz ---
+DECIMATION = 3
+RESAMPLE_TAPS = 48
+
+
+def _lowpass(taps: int, cutoff: float) -> np.ndarray:
+    """Windowed-sinc low-pass; cutoff as a fraction of the sample rate"""
+    n = np.arange(taps) - (taps - 1) / 2
+    h = np.sinc(2 * cutoff * n) * np.hamming(taps)
+    return (h / h.sum()).astype(np.float32)
+
+
+RESAMPLE_FILTER = _lowpass(RESAMPLE_TAPS, 0.45 / DECIMATION)
+# Input samples before a block that still reach its first output when interpolating
+UP_HISTORY = -(-RESAMPLE_TAPS // DECIMATION) - 1
+UP_FILTER = np.stack([RESAMPLE_FILTER[phase::DECIMATION][::-1] for phase in range(DECIMATION)], axis=1)
+
+
+def _windows(x: np.ndarray, width: int, hop: int = 1, start: int = 0) -> np.ndarray:
+    """Rows of width samples of contiguous x, hop apart from start on; a view, far cheaper to make than sliding_window_view"""
+    count = max((len(x) - start - width) // hop + 1, 0)
+    return np.ndarray((count, width), x.dtype, x, start * x.itemsize, (hop * x.itemsize, x.itemsize))
+
+
+class Resampler:
+    """
+    Streaming FIR decimation/interpolation by DECIMATION; keeps filter history
+    between blocks. Polyphase: only the outputs kept are computed, and only the
+    taps that meet a real sample when interpolating.
+    """
+
+    def __init__(self):
+        self.history = np.zeros(RESAMPLE_TAPS - 1, np.float32)
+        self.phase = 0
+        self.up_history = np.zeros(UP_HISTORY, np.float32)
+
+    def down(self, samples: np.ndarray) -> np.ndarray:
+        padded = np.concatenate((self.history, samples.astype(np.float32)))
+        self.history = padded[len(padded) - (RESAMPLE_TAPS - 1):]
+        windows = _windows(padded, RESAMPLE_TAPS, DECIMATION, self.phase)
+        self.phase = (self.phase - (len(padded) - RESAMPLE_TAPS + 1)) % DECIMATION
+        return np.round(windows @ RESAMPLE_FILTER[::-1]).clip(-32768, 32767).astype(np.int16)
+
+    def up(self, samples: np.ndarray) -> np.ndarray:
+        padded = np.concatenate((self.up_history, samples.astype(np.float32)))
+        self.up_history = padded[len(padded) - UP_HISTORY:]
+        out = _windows(padded, UP_HISTORY + 1) @ UP_FILTER  # one column per output phase
+        return np.round(out.ravel() * DECIMATION).clip(-32768, 32767).astype(np.int16)
+
+
+class AudioEncoder:
+    """Codes one outgoing stream; keeps ADPCM and resampler state between blocks"""
+
+    def __init__(self, codec: str = None):
+        self.codec = codec
+        self.adpcm = AdpcmState()
+        self.resampler = Resampler()
+
+    def encode(self, pcm) -> bytes:
+        samples = np.frombuffer(pcm, np.int16)
+        if self.codec == ULAW:
+            return ulaw_encode(samples)
+        if self.codec == ADPCM:
+            return adpcm_encode(samples, self.adpcm)
+        if self.codec == ADPCM_16K:
+            return adpcm_encode(self.resampler.down(samples), self.adpcm)
+        if self.codec == ULAW_16K:
+            return ulaw_encode(self.resampler.down(samples))
+        return bytes(pcm)
+
+
+class AudioDecoder:
+    """Decodes one incoming stream (any codec, as named per packet) to int16 PCM"""
+
+    def __init__(self):
+        self.resampler = Resampler()
+
+    def decode(self, codec: str, payload) -> np.ndarray:
+        if codec == ULAW:
+            return ulaw_decode(payload)
+        if codec == ADPCM:
+            return adpcm_decode(payload)
+        if codec == ADPCM_16K:
+            return self.resampler.up(adpcm_decode(payload))
+        if codec == ULAW_16K:
+            return self.resampler.up(ulaw_decode(payload))
+        if codec is None:
+            return np.frombuffer(payload, np.int16)
+        raise ValueError(f"Unknown audio codec {codec}")
+
+
+def choose_codec(offered: str, preferred: str = ADPCM_16K) -> str:
+    """
+    Pick the session codec from a client's comma-separated list.
+    None means raw PCM, which is also what preferred=None asks for.
+    """
+    if preferred is None:
+        return None
+    codecs = [c for c in offered.split(',') if c in SUPPORTED]
+    if preferred in codecs:
+        return preferred
+    return codecs[0] if codecs else None
+
+
+def choose_mix_codec(codec: str, offered: str) -> str:
+    """
+    Codec of the mixes the server sends a client in mixing mode: ulaw16k,
+    which is as cheap to code as to decode, if the client decodes it.
+    """
+    if codec is None:
+        return None
+    return ULAW_16K if ULAW_16K in offered.split(',') else codec
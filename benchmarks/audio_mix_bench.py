@@ -0,0 +1,102 @@
+# benchmarks/audio_mix_bench.py
+"""
+Server audio egress, relay vs mixing mode (--audio mix), with every participant speaking.
+
+  relay : each speaker's packet is forwarded to the other N-1 participants
+  mix   : speakers feed the ConferenceMixer; each listener gets one N-1 mix per frame interval
+
+Every client offers the codecs a client does and gets the server's default
+(adpcm16k), so speakers send coded packets; the mixer decodes them and codes
+every mix it sends out (as ulaw16k, see audio_codecs.choose_mix_codec).
+Sockets are replaced by a sink that counts what would have gone out, so the
+figures are egress per frame interval and pure server CPU.
+Run from the repository root: python benchmarks/audio_mix_bench.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server
+import protocol
+from audio import FRAME_MS
+from audio_codecs import AudioEncoder, SUPPORTED
+from constants import *
+
+SPEAKERS = (10, 50, 100)
+WARMUP = 10     # frame intervals to fill the mixer's jitter buffers
+INTERVALS = 50
+
+
+class Sink:
+    def __init__(self):
+        self.packets = 0
+        self.bytes = 0
+
+    def sendto(self, data, addr):
+        self.packets += 1
+        self.bytes += len(data)
+
+
+def make_room(n: int) -> list[tuple]:
+    """Register n binary clients with the default codec; returns (packet source address, session id) per speaker"""
+    server.clients.clear()
+    server.sessions.clear()
+    server.media_peers[AUDIO].clear()
+    server.audio_mixer = server.ConferenceMixer()
+    speakers = []
+    for i in range(n):
+        client = server.register_client(f"user{i}", None, {'wire': protocol.WIRE_BINARY, 'codecs': ','.join(SUPPORTED)}, "127.0.0.1")
+        addr = ("127.0.0.1", 20000 + i)
+        client.media_addrs[AUDIO] = addr
+        server.media_peers[AUDIO][addr] = client.session_id
+        speakers.append((addr, client.session_id))
+    return speakers
+
+
+def speech_blocks(i: int, n: int) -> list[bytes]:
+    """n consecutive frame intervals of one speaker, coded as the client would send them"""
+    encoder = AudioEncoder(server.AUDIO_CODEC)
+    t = np.arange(BLOCK_SIZE * n) / SAMPLE_RATE
+    pcm = (np.sin(2 * np.pi * (150 + 7 * i) * t) * 3000).astype(np.int16)
+    return [encoder.encode(block.tobytes()) for block in np.split(pcm, n)]
+
+
+def run(n: int, mix: bool) -> tuple[float, float, float]:
+    """Returns (packets, bytes, CPU ms) per frame interval"""
+    server.AUDIO_MIX = mix
+    speakers = make_room(n)
+    blocks = [speech_blocks(i, WARMUP + INTERVALS) for i in range(n)]
+    sink = server.media_conns[AUDIO] = Sink()
+    cpu = 0.0
+    for tick in range(WARMUP + INTERVALS):
+        if tick == WARMUP:
+            sink.packets = sink.bytes = 0
+            cpu = 0.0
+        start = time.process_time()
+        for (addr, session_id), coded in zip(speakers, blocks):
+            packet = protocol.encode(Message('', POST, AUDIO, coded[tick], sender_id=session_id, seq=tick,
+                                             timestamp=tick * int(FRAME_MS), codec=server.AUDIO_CODEC))
+            server.handle_media_packet(AUDIO, packet, addr)
+        if mix:
+            server.send_audio_mix()
+        cpu += time.process_time() - start
+    return sink.packets / INTERVALS, sink.bytes / INTERVALS, cpu / INTERVALS * 1000
+
+
+def main():
+    print(f"{BLOCK_SIZE}-sample frames ({FRAME_MS:.1f} ms) coded {server.AUDIO_CODEC}, "
+          f"all participants speaking, per frame interval")
+    print(f"{'speakers':>8} {'mode':>6} {'packets':>9} {'egress Mbit/s':>14} {'CPU ms':>8}")
+    for n in SPEAKERS:
+        for mix in (False, True):
+            packets, sent, cpu = run(n, mix)
+            mbps = sent * 8 / (FRAME_MS / 1000) / 1e6
+            print(f"{n:>8} {'mix' if mix else 'relay':>6} {packets:>9.0f} {mbps:>14.1f} {cpu:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
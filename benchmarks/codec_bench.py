@@ -0,0 +1,76 @@
+# benchmarks/codec_bench.py
+"""
+Audio codec cost and bitrate per mode.
+
+Codes a speech track block by block with every codec in audio_codecs and
+reports encode/decode CPU per block, bytes per packet (header included),
+bitrate and signal-to-noise ratio of the decoded audio. Uses the synthetic
+meeting track from vad_bench.py, or a 16-bit WAV file given as an argument.
+Run from the repository root: python benchmarks/codec_bench.py [speech.wav]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import protocol
+from audio import FRAME_MS
+from audio_codecs import AudioDecoder, AudioEncoder, RESAMPLE_TAPS
+from constants import *
+from vad_bench import load_wav, synthetic_meeting
+
+CODECS = (None, ULAW, ADPCM, ADPCM_16K, ULAW_16K)
+SECONDS = 30
+
+
+def snr_db(reference: np.ndarray, decoded: np.ndarray) -> float:
+    """SNR after aligning for the resampler's group delay"""
+    best = None
+    for delay in range(RESAMPLE_TAPS + 1):
+        n = min(len(reference), len(decoded) - delay)
+        error = decoded[delay:delay + n] - reference[:n]
+        power = np.mean(np.square(error))
+        if best is None or power < best[0]:
+            best = (power, n)
+    power, n = best
+    signal = np.mean(np.square(reference[:n]))
+    return float('inf') if power == 0 else 10 * np.log10(signal / power)
+
+
+def main():
+    if len(sys.argv) > 1:
+        samples, source = load_wav(sys.argv[1]), sys.argv[1]
+    else:
+        samples, _ = synthetic_meeting(SECONDS)
+        source = f"synthetic meeting, {SECONDS} s"
+    blocks = [samples[i:i + BLOCK_SIZE].tobytes() for i in range(0, len(samples) - BLOCK_SIZE + 1, BLOCK_SIZE)]
+    reference = np.frombuffer(b''.join(blocks), np.int16).astype(np.float64)
+
+    print(f"{source}: {len(blocks)} blocks of {BLOCK_SIZE} samples ({FRAME_MS:.1f} ms)")
+    print(f"{'codec':>9} {'encode ms':>10} {'decode ms':>10} {'bytes':>7} {'kbit/s':>8} {'SNR dB':>7}")
+    for codec in CODECS:
+        encoder, decoder = AudioEncoder(codec), AudioDecoder()
+        encode_time = decode_time = 0.0
+        packet_bytes = 0
+        decoded = []
+        for seq, block in enumerate(blocks):
+            start = time.perf_counter()
+            payload = encoder.encode(block)
+            encode_time += time.perf_counter() - start
+            packet_bytes += len(protocol.encode(Message('', POST, AUDIO, payload, sender_id=1, seq=seq,
+                                                        timestamp=0, codec=codec)))
+            start = time.perf_counter()
+            decoded.append(decoder.decode(codec, payload))
+            decode_time += time.perf_counter() - start
+        decoded = np.concatenate(decoded).astype(np.float64)
+        n = len(blocks)
+        kbps = packet_bytes * 8 / (n * FRAME_MS / 1000) / 1000
+        print(f"{codec or 'pcm':>9} {encode_time / n * 1000:>10.3f} {decode_time / n * 1000:>10.3f} "
+              f"{packet_bytes / n:>7.0f} {kbps:>8.1f} {snr_db(reference, decoded):>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# benchmarks/last_n_bench.py
+"""
+Server video egress with and without last-N forwarding (server.py --last-n).
+
+A 50-person meeting is played through server.handle_media_packet: one
+audio packet per frame interval from whoever is talking (a few regulars take
+most turns, with the odd interjection), comfort noise from everyone else,
+and every camera sending fragmented layer-0 frames. Without last-N every
+receiver gets every camera; with it, full video of the N most recent speakers
+plus one pinned participant, and a thumbnail every THUMBNAIL_INTERVAL of the rest.
+
+Sockets are replaced by a sink that counts what would have gone out, and the
+relay runs on a simulated clock, so the figures are egress per second of
+meeting and pure server CPU.
+Run from the repository root: python benchmarks/last_n_bench.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import audio
+import server
+import protocol
+from audio import FRAME_MS, comfort_noise_payload
+from constants import *
+
+PARTICIPANTS = 50
+LAST_N = (None, 9, 4)
+SECONDS = 30
+VIDEO_FPS = 15
+FRAME_BYTES = 6000  # 240p JPEG
+REGULARS = 6        # participants who take most of the turns
+
+
+class Sink:
+    def __init__(self):
+        self.packets = 0
+        self.bytes = 0
+
+    def sendto(self, data, addr):
+        self.packets += 1
+        self.bytes += len(data)
+
+
+class SimulatedClock:
+    """Stands in for the time module of the relay, so pacing follows meeting time"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+def conversation(seed: int = 1) -> list[set]:
+    """Who is talking in each frame interval"""
+    rng = random.Random(seed)
+    ticks = int(SECONDS * 1000 / FRAME_MS)
+    talking = [set() for _ in range(ticks)]
+    t = 0
+    while t < ticks:
+        speaker = rng.randrange(REGULARS) if rng.random() < 0.8 else rng.randrange(PARTICIPANTS)
+        turn = int(rng.uniform(2, 6) * 1000 / FRAME_MS)
+        for i in range(t, min(ticks, t + turn)):
+            talking[i].add(speaker)
+        if rng.random() < 0.3:
+            # Someone chimes in for a second
+            start = t + rng.randrange(turn)
+            other = rng.randrange(PARTICIPANTS)
+            for i in range(start, min(ticks, start + int(1000 / FRAME_MS))):
+                talking[i].add(other)
+        t += turn + int(rng.uniform(0.2, 1) * 1000 / FRAME_MS)
+    return talking
+
+
+def make_room() -> list:
+    server.clients.clear()
+    server.sessions.clear()
+    server.speakers = audio.ActiveSpeakers()
+    room = []
+    for i in range(PARTICIPANTS):
+        client = server.register_client(f"user{i}", None, {'wire': protocol.WIRE_BINARY}, "127.0.0.1")
+        addrs = {media: ("127.0.0.1", port + i) for media, port in ((VIDEO, 20000), (AUDIO, 30000))}
+        for media, addr in addrs.items():
+            client.media_addrs[media] = addr
+            server.media_peers[media][addr] = client.session_id
+        room.append((client, addrs))
+    # Everyone keeps the first regular's camera in full view, as for a host
+    for client, _ in room[1:]:
+        client.pinned.add(room[0][0].name)
+    server.update_last_n()
+    return room
+
+
+def run(last_n: int, talking: list[set]) -> dict:
+    server.VIDEO_LAST_N = last_n
+    clock = server.time = audio.time = SimulatedClock()
+    sinks = server.media_conns = {VIDEO: Sink(), AUDIO: Sink()}
+    room = make_room()
+    frame = os.urandom(FRAME_BYTES)
+    fragments = protocol.split_fragments(frame)
+    seq = {client.name: {VIDEO: 0, AUDIO: 0} for client, _ in room}
+    frame_id = 0
+    next_frame = 0.0
+    silence = comfort_noise_payload(-60)
+    cpu = 0.0
+    for tick, speaking in enumerate(talking):
+        clock.now = tick * FRAME_MS / 1000
+        packets = []
+        for i, (client, addrs) in enumerate(room):
+            if i in speaking:
+                msg = Message('', POST, AUDIO, b'\0' * 160, sender_id=client.session_id, codec=ADPCM,
+                              level=25 + (tick + i) % 7)
+            elif tick % audio.COMFORT_NOISE_INTERVAL == i % audio.COMFORT_NOISE_INTERVAL:
+                msg = Message('', POST, AUDIO, silence, sender_id=client.session_id)
+            else:
+                continue
+            msg.seq, msg.timestamp = seq[client.name][AUDIO], 0
+            seq[client.name][AUDIO] += 1
+            packets.append((AUDIO, protocol.encode(msg), addrs[AUDIO]))
+        while next_frame <= clock.now:
+            frame_id += 1
+            for client, addrs in room:
+                for index, fragment in enumerate(fragments):
+                    msg = Message('', POST, VIDEO, fragment, sender_id=client.session_id,
+                                  seq=seq[client.name][VIDEO], timestamp=0, layer=0)
+                    msg.frame_id, msg.fragment, msg.fragments = frame_id, index, len(fragments)
+                    seq[client.name][VIDEO] += 1
+                    packets.append((VIDEO, protocol.encode(msg), addrs[VIDEO]))
+            next_frame += 1 / VIDEO_FPS
+        start = time.process_time()
+        for media, packet, addr in packets:
+            server.handle_media_packet(media, packet, addr)
+        cpu += time.process_time() - start
+    seconds = len(talking) * FRAME_MS / 1000
+    full = sum(len(room) - 1 - len(client.unwatched | client.thumbnailed) for client, _ in room)
+    return {
+        "video Mbit/s": sinks[VIDEO].bytes * 8 / seconds / 1e6,
+        "video pkt/s": sinks[VIDEO].packets / seconds,
+        "full streams": full,
+        "audio Mbit/s": sinks[AUDIO].bytes * 8 / seconds / 1e6,
+        "control msgs": sum(client.queue_depth for client, _ in room),
+        "CPU ms/s": cpu / seconds * 1000,
+    }
+
+
+def main():
+    talking = conversation()
+    print(f"{PARTICIPANTS} participants, {SECONDS} s meeting, {VIDEO_FPS} fps cameras, "
+          f"{FRAME_BYTES} B frames, thumbnails every {server.THUMBNAIL_INTERVAL:g} s")
+    print(f"{'last-N':>7} {'video Mbit/s':>13} {'video pkt/s':>12} {'full streams':>13} "
+          f"{'audio Mbit/s':>13} {'control msgs':>13} {'CPU ms/s':>9}")
+    baseline = None
+    for last_n in LAST_N:
+        result = run(last_n, talking)
+        baseline = baseline or result["video Mbit/s"]
+        print(f"{'off' if last_n is None else last_n:>7} {result['video Mbit/s']:>13.1f} "
+              f"{result['video pkt/s']:>12.0f} {result['full streams']:>13} {result['audio Mbit/s']:>13.2f} "
+              f"{result['control msgs']:>13} {result['CPU ms/s']:>9.1f}"
+              + ("" if last_n is None else f"   video -{1 - result['video Mbit/s'] / baseline:.0%}"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# benchmarks/relay_bench.py
+"""
+Relay CPU per incoming video packet against room size.
+
+  per-recipient : unpickle, then Client.send_msg for every receiver (one pickle.dumps each)
+  pickle-once   : server.handle_media_packet (one unpickle, same bytes to every receiver)
+  binary        : server.handle_media_packet on the binary wire format (header parse only)
+
+Sockets are replaced by a sink, so the numbers are pure relay CPU.
+Run from the repository root: python benchmarks/relay_bench.py
+"""
+import os
+import sys
+import time
+import pickle
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server
+import protocol
+from constants import *
+
+ROOM_SIZES = (2, 5, 10, 25, 50, 100)
+FRAME_BYTES = 40 * 1024
+PACKETS = 200
+
+
+class Sink:
+    def __init__(self):
+        self.sent = 0
+
+    def sendto(self, data, addr):
+        self.sent += len(data)
+
+
+def make_room(n: int, wire: str):
+    server.clients.clear()
+    server.sessions.clear()
+    server.media_peers[VIDEO].clear()
+    for i in range(n):
+        client = server.register_client(f"user{i}", None, {'wire': wire}, "127.0.0.1")
+        addr = ("127.0.0.1", 10000 + i)
+        client.media_addrs[VIDEO] = addr
+        server.media_peers[VIDEO][addr] = client.session_id
+
+
+def per_recipient(msg_bytes: bytes):
+    msg = pickle.loads(msg_bytes)
+    for client in tuple(server.clients.values()):
+        if client.name == msg.from_name:
+            continue
+        client.send_msg(msg.from_name, msg.request, msg.data_type, msg.data)
+
+
+def relay(msg_bytes: bytes):
+    server.handle_media_packet(VIDEO, msg_bytes, ("127.0.0.1", 10000))
+
+
+def run(relay, msg_bytes: bytes) -> float:
+    start = time.process_time()
+    for _ in range(PACKETS):
+        relay(msg_bytes)
+    return (time.process_time() - start) / PACKETS * 1e6
+
+
+def main():
+    server.media_conns[VIDEO] = Sink()
+    frame = os.urandom(FRAME_BYTES)
+    pickled = protocol.encode(Message("user0", POST, VIDEO, frame), protocol.WIRE_PICKLE)
+    print(f"{FRAME_BYTES // 1024} KB frames, {PACKETS} packets per room size, CPU us per incoming packet")
+    print(f"{'room':>6} {'per-recipient':>14} {'pickle-once':>12} {'binary':>8}")
+    for n in ROOM_SIZES:
+        make_room(n, protocol.WIRE_PICKLE)
+        old = run(per_recipient, pickled)
+        once = run(relay, pickled)
+        make_room(n, protocol.WIRE_BINARY)
+        sender_id = server.clients["user0"].session_id
+        binary = protocol.encode(Message("", POST, VIDEO, frame, sender_id=sender_id), protocol.WIRE_BINARY)
+        new = run(relay, binary)
+        print(f"{n:>6} {old:>14.1f} {once:>12.1f} {new:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# benchmarks/screen_codec_bench.py
+"""
+Screen share bandwidth and presenter CPU: a full JPEG every frame (what the
+client sent before) against screen.ScreenEncoder's tiled deltas.
+
+A 1920x1080 presentation is synthesized and captured at 5 fps, the rate of
+the client's screen timer: a slide sitting still with a blinking cursor, code
+being typed, a page scrolling, a change of slide, and a video playing full
+screen (which puts the encoder in video mode). Each phase runs through
+both encoders; the delta stream is also decoded with screen.ScreenDecoder and
+compared with the source, so the savings are not bought with a wrong picture.
+Run from the repository root: python benchmarks/screen_codec_bench.py
+"""
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from screen import ScreenDecoder, ScreenEncoder, encode_jpeg
+
+WIDTH, HEIGHT = 1920, 1080
+FPS = 5
+PHASE_SECONDS = 12
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+WORDS = "def relay_screen client encoded payload for other in clients if delta return None".split()
+
+
+def slide(index: int) -> np.ndarray:
+    """A title, bullet points and a chart"""
+    rng = np.random.default_rng(index)
+    image = np.full((HEIGHT, WIDTH, 3), (250, 248, 245), np.uint8)
+    cv2.rectangle(image, (0, 0), (WIDTH, 140), (120, 60, 30), -1)
+    cv2.putText(image, f"Slide {index}: quarterly screen share review", (60, 95), FONT, 2, (255, 255, 255), 3)
+    for line in range(8):
+        text = " ".join(rng.choice(WORDS, 6))
+        cv2.putText(image, "- " + text, (80, 230 + line * 70), FONT, 1.2, (40, 40, 40), 2)
+    bars = rng.integers(80, 420, 6)
+    for i, bar in enumerate(bars):
+        x = 1300 + i * 90
+        cv2.rectangle(image, (x, 900 - int(bar)), (x + 60, 900), (60 + 30 * i, 140, 220 - 30 * i), -1)
+    return image
+
+
+def editor(lines: list[str], top: int = 0) -> np.ndarray:
+    """A code editor showing lines from top on"""
+    image = np.full((HEIGHT, WIDTH, 3), (40, 34, 30), np.uint8)
+    cv2.rectangle(image, (0, 0), (300, HEIGHT), (55, 48, 43), -1)
+    for row, text in enumerate(lines[top:top + 38]):
+        y = 40 + row * 27
+        cv2.putText(image, f"{top + row + 1:4}", (310, y), FONT, 0.7, (120, 120, 120), 1)
+        cv2.putText(image, text, (380, y), FONT, 0.7, (210, 220, 200), 1)
+    return image
+
+
+def cursor(image: np.ndarray, x: int, y: int, visible: bool) -> np.ndarray:
+    if visible:
+        image = image.copy()
+        cv2.rectangle(image, (x, y - 22), (x + 3, y + 4), (255, 255, 255), -1)
+    return image
+
+
+def footage(n: int, seed: int = 3) -> list:
+    """Camera-like frames: smooth colour fields drifting across the screen, with sensor noise"""
+    rng = np.random.default_rng(seed)
+    scene = cv2.resize(rng.integers(0, 255, (18, 48, 3), dtype=np.uint8), (WIDTH * 3, HEIGHT * 2),
+                       interpolation=cv2.INTER_CUBIC)
+    frames = []
+    for i in range(n):
+        x, y = i * 24, int(HEIGHT / 2 * (1 + np.sin(i / 10)) / 2)
+        noise = rng.normal(0, 3, (HEIGHT, WIDTH, 3))
+        frames.append(np.clip(scene[y:y + HEIGHT, x:x + WIDTH] + noise, 0, 255).astype(np.uint8))
+    return frames
+
+
+def presentation() -> dict:
+    """Frames of each phase, as the screen would be captured"""
+    n = PHASE_SECONDS * FPS
+    rng = np.random.default_rng(7)
+    code = [" ".join(rng.choice(WORDS, int(rng.integers(2, 9)))) for _ in range(400)]
+    phases = {}
+
+    still = slide(1)
+    phases["static slide"] = [cursor(still, 600, 300, (i // 3) % 2 == 0) for i in range(n)]
+
+    typed = code[:20] + [""]
+    frames = []
+    for i in range(n):
+        line = code[20][:i % 40]
+        typed[-1] = line
+        frames.append(cursor(editor(typed), 380 + len(line) * 12, 40 + 20 * 27, True))
+    phases["typing"] = frames
+
+    phases["scrolling"] = [editor(code, top=i * 2) for i in range(n)]
+
+    slides = [slide(2 + i // (2 * FPS)) for i in range(n)]  # a new slide every 2 s
+    phases["slide changes"] = slides
+
+    phases["video"] = footage(n)
+    return phases
+
+
+def psnr(a: np.ndarray, b: np.ndarray) -> float:
+    mse = np.mean((a.astype(np.float32) - b.astype(np.float32)) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def run_full(frames: list) -> dict:
+    sent = 0
+    start = time.process_time()
+    for frame in frames:
+        sent += len(encode_jpeg(frame))
+    cpu = time.process_time() - start
+    return {"bytes": sent, "cpu": cpu, "psnr": None}
+
+
+def run_delta(frames: list) -> dict:
+    encoder, decoder = ScreenEncoder(), ScreenDecoder()
+    sent = 0
+    cpu = 0.0
+    quality = []
+    video = 0
+    for i, frame in enumerate(frames):
+        start = time.process_time()
+        result = encoder.encode(frame, now=i / FPS)
+        cpu += time.process_time() - start
+        video += encoder.video_mode
+        if result is not None:
+            payload, seq = result
+            sent += len(payload)
+            decoder.decode(payload, seq)
+        canvas = decoder.canvas
+        if canvas.shape != frame.shape:
+            canvas = cv2.resize(canvas, (frame.shape[1], frame.shape[0]))  # video mode: compared as displayed
+        quality.append(psnr(canvas, frame))
+    return {"bytes": sent, "cpu": cpu, "psnr": min(quality), "median psnr": float(np.median(quality)),
+            "frames": f"{encoder.keyframes}k/{encoder.deltas}d/{encoder.unchanged}-/{video}v"}
+
+
+def main():
+    phases = presentation()
+    seconds = PHASE_SECONDS
+    print(f"{WIDTH}x{HEIGHT} at {FPS} fps, {seconds} s per phase; "
+          f"frames sent as keyframes k / deltas d / nothing -, and encoded in video mode v")
+    print(f"{'phase':>14} {'full kbit/s':>12} {'delta kbit/s':>13} {'saved':>6} "
+          f"{'full ms/frame':>14} {'delta ms/frame':>15} {'min PSNR dB':>12} {'median PSNR':>12} {'frames':>16}")
+    totals = {"full": 0, "delta": 0, "full cpu": 0.0, "delta cpu": 0.0}
+    for name, frames in phases.items():
+        full, delta = run_full(frames), run_delta(frames)
+        totals["full"] += full["bytes"]
+        totals["delta"] += delta["bytes"]
+        totals["full cpu"] += full["cpu"]
+        totals["delta cpu"] += delta["cpu"]
+        print(f"{name:>14} {full['bytes'] * 8 / seconds / 1000:>12.0f} {delta['bytes'] * 8 / seconds / 1000:>13.0f} "
+              f"{1 - delta['bytes'] / full['bytes']:>6.0%} {full['cpu'] / len(frames) * 1000:>14.1f} "
+              f"{delta['cpu'] / len(frames) * 1000:>15.1f} {delta['psnr']:>12.1f} {delta['median psnr']:>12.1f} {delta['frames']:>16}")
+    n = sum(len(frames) for frames in phases.values())
+    print(f"{'all':>14} {totals['full'] * 8 / seconds / len(phases) / 1000:>12.0f} "
+          f"{totals['delta'] * 8 / seconds / len(phases) / 1000:>13.0f} {1 - totals['delta'] / totals['full']:>6.0%} "
+          f"{totals['full cpu'] / n * 1000:>14.1f} {totals['delta cpu'] / n * 1000:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# benchmarks/screen_content_bench.py
+"""
+Screen share codecs on a corpus of screenshots: one whole frame as a JPEG at
+q80 (what every tile used to be), as a lossless PNG, and content-aware as
+screen.ScreenEncoder codes it (each tile classified, text tiles lossless as a
+palette image or PNG, photographic tiles JPEG).
+
+Reported per screenshot: bytes per frame, encode time, and PSNR against the
+original, overall and over the tiles classified as text (inf = exact). Give
+a directory of screenshots (PNG or JPEG) to use real ones; without it a
+synthetic corpus of a slide, a code editor, a spreadsheet, a photo and a
+slide with a photo on it is used.
+Run from the repository root: python benchmarks/screen_content_bench.py [screenshots/]
+"""
+import glob
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from screen import ScreenDecoder, ScreenEncoder, TILE, encode_jpeg, encode_png, text_tiles
+from screen_codec_bench import HEIGHT, WIDTH, WORDS, editor, footage, psnr, slide
+
+REPEAT = 3  # encodes per screenshot and codec; the fastest counts
+
+
+def spreadsheet() -> np.ndarray:
+    rng = np.random.default_rng(5)
+    image = np.full((HEIGHT, WIDTH, 3), 255, np.uint8)
+    cv2.rectangle(image, (0, 0), (WIDTH, 60), (70, 140, 60), -1)
+    for row in range(1, 40):
+        y = 60 + row * 25
+        cv2.line(image, (0, y), (WIDTH, y), (210, 210, 210), 1)
+        for col in range(12):
+            x = col * 160
+            value = f"{rng.normal(5000, 2000):,.2f}" if col else f"Row {row}"
+            color = (0, 0, 200) if value.startswith("-") else (30, 30, 30)
+            cv2.putText(image, value, (x + 8, y - 7), cv2.FONT_HERSHEY_SIMPLEX, 0.55, color, 1)
+    for col in range(1, 12):
+        cv2.line(image, (col * 160, 60), (col * 160, HEIGHT), (210, 210, 210), 1)
+    return image
+
+
+def corpus(directory: str = None) -> dict:
+    if directory:
+        paths = sorted(glob.glob(os.path.join(directory, "*.png")) + glob.glob(os.path.join(directory, "*.jp*g")))
+        samples = {os.path.basename(path): cv2.imread(path, cv2.IMREAD_COLOR) for path in paths}
+        return {name: image for name, image in samples.items() if image is not None}
+    rng = np.random.default_rng(9)
+    photo = footage(1)[0]
+    mixed = slide(4)
+    mixed[300:780, 1100:1820] = cv2.resize(photo, (720, 480), interpolation=cv2.INTER_AREA)
+    return {
+        "slide": slide(3),
+        "code": editor([" ".join(rng.choice(WORDS, int(rng.integers(2, 9)))) for _ in range(40)]),
+        "spreadsheet": spreadsheet(),
+        "photo": photo,
+        "slide + photo": mixed,
+    }
+
+
+def content_aware(frame: np.ndarray) -> bytes:
+    """The whole frame as a delta of every tile, as a receiver gets it after the keyframe"""
+    h, w = frame.shape[:2]
+    grid = np.ones((-(-h // TILE), -(-w // TILE)), bool)
+    return ScreenEncoder().encode_delta(frame, grid, text_tiles(frame))
+
+
+def decode_delta(payload: bytes, shape: tuple) -> np.ndarray:
+    decoder = ScreenDecoder()
+    decoder.canvas = np.zeros(shape, np.uint8)
+    decoder.apply_delta(payload)
+    return decoder.canvas
+
+
+def timed(encode, frame: np.ndarray) -> tuple:
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        payload = encode(frame)
+        best = min(best, time.perf_counter() - start)
+    return payload, best
+
+
+def main():
+    samples = corpus(sys.argv[1] if len(sys.argv) > 1 else None)
+    if not samples:
+        print("No screenshots found")
+        return
+    codecs = {
+        "JPEG q80": (encode_jpeg, lambda data, shape: cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)),
+        "PNG": (encode_png, lambda data, shape: cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)),
+        "content-aware": (content_aware, decode_delta),
+    }
+    print(f"{'screenshot':>16} {'text tiles':>11} {'codec':>14} {'KB/frame':>9} {'encode ms':>10} "
+          f"{'PSNR dB':>8} {'text PSNR':>10}")
+    totals = {name: [0, 0.0] for name in codecs}
+    for name, frame in samples.items():
+        text = text_tiles(frame)
+        mask = np.kron(text, np.ones((TILE, TILE), bool))[:frame.shape[0], :frame.shape[1]]
+        for codec, (encode, decode) in codecs.items():
+            payload, seconds = timed(encode, frame)
+            picture = decode(payload, frame.shape)
+            text_psnr = psnr(picture[mask], frame[mask]) if mask.any() else float('nan')
+            totals[codec][0] += len(payload)
+            totals[codec][1] += seconds
+            print(f"{name:>16} {text.mean():>11.0%} {codec:>14} {len(payload) / 1000:>9.1f} {seconds * 1000:>10.1f} "
+                  f"{psnr(picture, frame):>8.1f} {text_psnr:>10.1f}")
+    print()
+    for codec, (size, seconds) in totals.items():
+        print(f"{'mean':>16} {'':>11} {codec:>14} {size / len(samples) / 1000:>9.1f} "
+              f"{seconds / len(samples) * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
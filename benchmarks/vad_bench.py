@@ -0,0 +1,109 @@
+# benchmarks/vad_bench.py
+"""
+Microphone-path bandwidth with and without silence suppression.
+
+Feeds a speech recording block by block through SilenceSuppressor and counts
+the audio packets and bytes one sender would put on the wire, against sending
+every block. Pass a 16-bit WAV file to use a real recording:
+
+    python benchmarks/vad_bench.py meeting.wav
+
+Without one, a synthetic meeting track is generated: voiced syllables and
+fricatives in talk spurts separated by pauses, over low background noise.
+Since the synthetic track's talk spurts are known, the report also shows how
+many speech blocks were transmitted.
+Run from the repository root: python benchmarks/vad_bench.py
+"""
+import os
+import sys
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import protocol
+from audio import FRAME_MS, SilenceSuppressor, is_comfort_noise
+from constants import *
+
+DURATION = 120  # seconds of synthetic audio
+TALK_SHARE = 0.3  # rough share of time spent talking
+
+
+def load_wav(path: str) -> np.ndarray:
+    with wave.open(path, "rb") as f:
+        if f.getsampwidth() != 2:
+            raise SystemExit("Only 16-bit PCM WAV files are supported")
+        rate, channels = f.getframerate(), f.getnchannels()
+        samples = np.frombuffer(f.readframes(f.getnframes()), np.int16)[::channels]
+    if rate != SAMPLE_RATE:
+        t = np.arange(len(samples) * SAMPLE_RATE // rate) * rate / SAMPLE_RATE
+        samples = np.interp(t, np.arange(len(samples)), samples).astype(np.int16)
+    return samples
+
+
+def synthetic_meeting(seconds: int = DURATION, seed: int = 1) -> tuple[np.ndarray, np.ndarray]:
+    """Returns (samples, per-sample talk mask)"""
+    rng = np.random.default_rng(seed)
+    n = seconds * SAMPLE_RATE
+    samples = rng.normal(0, 30, n)  # room noise, about -60 dBFS
+    talk = np.zeros(n, bool)
+    t = 0
+    while t < n:
+        pause = int(rng.uniform(1.0, 2.0 / TALK_SHARE) * SAMPLE_RATE)
+        spurt = int(rng.uniform(0.8, 4.0) * SAMPLE_RATE)
+        start, end = min(n, t + pause), min(n, t + pause + spurt)
+        talk[start:end] = True
+        pos = start
+        while pos < end:
+            length = min(end - pos, int(rng.uniform(0.12, 0.3) * SAMPLE_RATE))
+            k = np.arange(length)
+            envelope = np.sin(np.pi * k / length) ** 2
+            if rng.random() < 0.2:
+                # Fricative: broadband noise
+                syllable = rng.normal(0, 1500, length)
+            else:
+                f0 = rng.uniform(100, 220)
+                syllable = sum(np.sin(2 * np.pi * f0 * h * k / SAMPLE_RATE) / h for h in range(1, 8)) * 4000
+            samples[pos:pos + length] += syllable * envelope
+            pos += length
+        t = end
+    return samples.clip(-32768, 32767).astype(np.int16), talk
+
+
+def main():
+    if len(sys.argv) > 1:
+        samples, talk = load_wav(sys.argv[1]), None
+        source = sys.argv[1]
+    else:
+        samples, talk = synthetic_meeting()
+        source = f"synthetic meeting, {DURATION} s, {talk.mean():.0%} talk"
+
+    suppressor = SilenceSuppressor()
+    blocks = len(samples) // BLOCK_SIZE
+    full_bytes = sent_packets = sent_bytes = speech_blocks = speech_sent = comfort = 0
+    for i in range(blocks):
+        block = samples[i * BLOCK_SIZE:(i + 1) * BLOCK_SIZE].tobytes()
+        full_bytes += len(protocol.encode(Message('', POST, AUDIO, block, sender_id=1, seq=i, timestamp=0)))
+        payload = suppressor.filter(block)
+        if payload is not None:
+            sent_packets += 1
+            sent_bytes += len(protocol.encode(Message('', POST, AUDIO, payload, sender_id=1, seq=i, timestamp=0)))
+            comfort += is_comfort_noise(payload)
+        if talk is not None and talk[i * BLOCK_SIZE:(i + 1) * BLOCK_SIZE].mean() > 0.5:
+            speech_blocks += 1
+            speech_sent += payload is not None and not is_comfort_noise(payload)
+
+    seconds = blocks * FRAME_MS / 1000
+    print(f"{source}: {blocks} blocks of {BLOCK_SIZE} samples")
+    print(f"{'':>18} {'packets':>8} {'kbit/s':>8}")
+    print(f"{'every block':>18} {blocks:>8} {full_bytes * 8 / seconds / 1000:>8.1f}")
+    print(f"{'VAD':>18} {sent_packets:>8} {sent_bytes * 8 / seconds / 1000:>8.1f}"
+          f"   ({comfort} comfort noise)")
+    print(f"packets -{1 - sent_packets / blocks:.0%}, bytes -{1 - sent_bytes / full_bytes:.0%}")
+    if speech_blocks:
+        print(f"speech blocks transmitted: {speech_sent}/{speech_blocks} ({speech_sent / speech_blocks:.1%})")
+
+
+if __name__ == "__main__":
+    main()
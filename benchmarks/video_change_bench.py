@@ -0,0 +1,130 @@
+# benchmarks/video_change_bench.py
+"""
+Webcam CPU and bandwidth with static-frame suppression (video.ChangeDetector).
+
+Runs a webcam recording through the capture path twice: JPEG-encoding every
+frame as before, and with the change detector skipping the encode and send
+of frames that have not changed (plus a refresh frame every 2 s). Pass any
+video file OpenCV can read to use a real recording:
+
+    python benchmarks/video_change_bench.py webcam.mp4
+
+Without one, a synthetic 40 s webcam track is generated: sitting still and
+talking, gesturing, sitting still listening, then a covered lens, all with
+sensor noise.
+Run from the repository root: python benchmarks/video_change_bench.py
+"""
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from video import ChangeDetector
+
+FPS = 30
+SIZE = (352, 240)  # CAMERA_RES '240p'
+QUALITY = 40
+SCENES = (("still, talking", 10), ("gesturing", 10), ("still, listening", 10), ("covered lens", 10))
+
+
+def load_video(path: str, size: tuple = SIZE) -> list[np.ndarray]:
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while True:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frames.append(cv2.resize(frame, size, interpolation=cv2.INTER_AREA))
+    cap.release()
+    if not frames:
+        raise SystemExit(f"No frames read from {path}")
+    return frames
+
+
+def synthetic_frames(size: tuple = SIZE, seed: int = 1):
+    """Yields (frame, scene) for every frame of the synthetic webcam track"""
+    rng = np.random.default_rng(seed)
+    w, h = size
+    scale = h / SIZE[1]
+    room = cv2.GaussianBlur(rng.integers(60, 200, (h, w, 3), dtype=np.uint8), (31, 31), 0)
+    for scene, seconds in SCENES:
+        for i in range(seconds * FPS):
+            t = i / FPS
+            if scene == "covered lens":
+                frame = np.full((h, w, 3), 8, np.uint8)
+            else:
+                frame = room.copy()
+                x, y = w // 2, h // 2
+                if scene == "gesturing":
+                    x += int(40 * scale * np.sin(2 * np.pi * 0.5 * t))
+                    hand = (x + int(scale * (80 + 30 * np.sin(2 * np.pi * 1.3 * t))),
+                            y + int(scale * (60 - 40 * abs(np.sin(2 * np.pi * 0.7 * t)))))
+                    cv2.circle(frame, hand, int(18 * scale), (150, 180, 220), -1)
+                cv2.ellipse(frame, (x, y), (int(45 * scale), int(60 * scale)), 0, 0, 360, (140, 170, 210), -1)
+                cv2.rectangle(frame, (x - int(70 * scale), y + int(55 * scale)), (x + int(70 * scale), h),
+                              (90, 60, 40), -1)
+                if scene == "still, talking":
+                    mouth = 2 + int(5 * abs(np.sin(2 * np.pi * 3 * t)))
+                    cv2.ellipse(frame, (x, y + int(30 * scale)), (int(12 * scale), int(mouth * scale)),
+                                0, 0, 360, (60, 40, 120), -1)
+            noise = rng.integers(-3, 4, frame.shape, dtype=np.int16)
+            yield np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8), scene
+
+
+def synthetic_webcam(seed: int = 1) -> tuple[list[np.ndarray], list[str]]:
+    frames, labels = [], []
+    for frame, scene in synthetic_frames(SIZE, seed):
+        frames.append(frame)
+        labels.append(scene)
+    return frames, labels
+
+
+def run(frames: list[np.ndarray], detector: ChangeDetector = None):
+    """Returns (CPU seconds, bytes sent, per-frame sent flags)"""
+    cpu = 0.0
+    sent_bytes = 0
+    sent = []
+    for i, frame in enumerate(frames):
+        start = time.process_time()
+        send = detector is None or detector.changed(frame, now=i / FPS)
+        if send:
+            _, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, QUALITY])
+            sent_bytes += len(encoded)
+        cpu += time.process_time() - start
+        sent.append(send)
+    return cpu, sent_bytes, sent
+
+
+def main():
+    if len(sys.argv) > 1:
+        frames = load_video(sys.argv[1])
+        labels = ["recording"] * len(frames)
+        source = sys.argv[1]
+    else:
+        frames, labels = synthetic_webcam()
+        source = "synthetic webcam"
+    seconds = len(frames) / FPS
+
+    base_cpu, base_bytes, _ = run(frames)
+    cpu, sent_bytes, sent = run(frames, ChangeDetector())
+
+    print(f"{source}: {len(frames)} frames at {SIZE[0]}x{SIZE[1]}, {FPS} fps, JPEG quality {QUALITY}")
+    print(f"{'':>22} {'frames':>7} {'CPU ms/frame':>13} {'kbit/s':>8}")
+    print(f"{'every frame':>22} {len(frames):>7} {base_cpu / len(frames) * 1000:>13.3f} "
+          f"{base_bytes * 8 / seconds / 1000:>8.1f}")
+    print(f"{'change detection':>22} {sum(sent):>7} {cpu / len(frames) * 1000:>13.3f} "
+          f"{sent_bytes * 8 / seconds / 1000:>8.1f}")
+    print(f"CPU -{1 - cpu / base_cpu:.0%}, bandwidth -{1 - sent_bytes / base_bytes:.0%}")
+    if len(set(labels)) > 1:
+        print("frames sent per scene:")
+        for scene, _ in SCENES:
+            flags = [s for s, label in zip(sent, labels) if label == scene]
+            print(f"  {scene:>18}: {sum(flags)}/{len(flags)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# benchmarks/video_rate_bench.py
+"""
+Webcam rate control (video.RateController) on a simulated network.
+
+Plays the synthetic webcam track from video_change_bench.py at camera
+resolution (1280x720) through video.encode_frame, second by second, while the
+network changes underneath it:
+
+    0-10 s   budget 8000 kbit/s, uncongested
+   10-20 s   link limited to 1000 kbit/s: whatever is sent above it is lost
+   20-30 s   uncongested again
+   30-40 s   budget lowered to 500 kbit/s
+
+Each second a receiver report carries the loss and one-way delay of that
+second back to the controller; a link sent over its capacity queues, adding
+QUEUE_DELAY to the BASE_DELAY. Every frame is encoded (no change detection),
+so the sent rate is the worst case. Prints per second the settings most frames
+were encoded at, how many different settings were used, and the sent rate, and
+checks that no frame exceeded the largest frame that can be fragmented.
+Run from the repository root: python benchmarks/video_rate_bench.py
+"""
+import os
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from video import MAX_FRAME, RateController, encode_frame
+from video_change_bench import FPS, synthetic_frames
+
+CAMERA = (1280, 720)
+LADDER = ((352, 240), (480, 360), (640, 480), (800, 560), (1080, 720))  # frame_size '240p' ... '720p'
+FPS_STEPS = (10, 15, 24, 30)
+# (until second, budget kbit/s, link capacity kbit/s or None)
+PHASES = ((10, 8000, None), (20, 8000, 1000), (30, 8000, None), (40, 500, None))
+BASE_DELAY = 20    # ms
+QUEUE_DELAY = 300  # ms
+
+
+def phase(second: int):
+    return next(p for p in PHASES if second < p[0])
+
+
+def main():
+    rate = RateController(LADDER, PHASES[0][1], FPS_STEPS)
+    source = synthetic_frames(CAMERA)
+    index, frame = -1, None
+    t = 0.0
+    largest = oversize = 0
+
+    print(f"synthetic webcam at {CAMERA[0]}x{CAMERA[1]}, frame limit {MAX_FRAME} bytes")
+    print(f"{'s':>3} {'budget':>7} {'link':>6} {'size':>9} {'quality':>8} {'fps':>4} {'settings':>8} "
+          f"{'sent kbit/s':>12} {'loss':>6} {'delay':>6} {'max bytes':>10}")
+    for second in range(PHASES[-1][0]):
+        _, budget, link = phase(second)
+        rate.set_budget(budget)
+        sent = 0
+        second_max = 0
+        used = Counter()  # settings -> frames encoded at them this second
+        while t < second + 1:
+            while index < int(t * FPS):
+                frame, _ = next(source)
+                index += 1
+            used[rate.size, rate.quality, rate.fps] += 1
+            packet = encode_frame(frame, rate, now=t)
+            if packet is not None:
+                sent += len(packet)
+                second_max = max(second_max, len(packet))
+                oversize += not rate.fits(len(packet))
+            t += 1 / rate.fps
+        kbps = sent * 8 / 1000
+        loss = max(0.0, 1 - link / kbps) if link and kbps else 0.0
+        delay = BASE_DELAY + (QUEUE_DELAY if loss else 0)
+        rate.on_report("receiver", loss, delay, now=t)
+        largest = max(largest, second_max)
+        (w, h), quality, fps = used.most_common(1)[0][0]
+        print(f"{second:>3} {budget:>7} {link or '-':>6} {f'{w}x{h}':>9} {quality:>8} {fps:>4} {len(used):>8} "
+              f"{kbps:>12.0f} {loss:>6.0%} {delay:>6} {second_max:>10}")
+    print(f"largest frame {largest} bytes, {oversize} over the limit")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# capture.py
+"""
+Capture scheduling, independent of the devices.
+
+FrameClock paces video capture at a fixed rate. Each wait() sleeps until
+the next deadline, so time spent capturing, encoding and sending comes out of
+the frame interval instead of adding to it. When a frame takes longer than
+its interval, the missed deadlines are skipped rather than caught up in a
+burst. The rate can be changed at any time.
+
+CaptureThread is the only reader of a device such as the camera. It runs on a
+FrameClock and publishes each capture once, as a VideoFrame holding both the
+raw image and the encoded packets, into a LatestFrame slot that the preview
+and the network sender read independently.
+"""
+import threading
+import time
+from dataclasses import dataclass
+
+
+class FrameClock:
+    def __init__(self, fps: float):
+        self.lock = threading.Lock()
+        self.deadline = None
+        self.skipped = 0  # ticks dropped because the sender fell behind
+        self.set_fps(fps)
+
+    def set_fps(self, fps: float):
+        if fps <= 0:
+            raise ValueError(f"Frame rate must be positive, got {fps}")
+        with self.lock:
+            self.fps = fps
+            self.interval = 1 / fps
+
+    def wait(self) -> int:
+        """Block until the next tick; returns how many ticks were skipped to get there"""
+        with self.lock:
+            interval = self.interval
+            now = time.monotonic()
+            skipped = 0
+            if self.deadline is None:
+                self.deadline = now
+            elif now >= self.deadline:
+                # Behind schedule: run now and drop the ticks that already passed
+                skipped = int((now - self.deadline) // interval)
+                self.deadline += skipped * interval
+                self.skipped += skipped
+            delay = self.deadline - now
+            self.deadline += interval
+        if delay > 0:
+            time.sleep(delay)
+        return skipped
+
+
+@dataclass
+class VideoFrame:
+    """One camera read, published once for both consumers"""
+    image: any        # RGB array for the local preview
+    packets: dict     # encoded frame for the network per simulcast layer; None if unchanged
+    captured_at: int  # media_stats.media_clock() at capture
+
+
+class LatestFrame:
+    """
+    Single-slot mailbox: the producer replaces the slot with one reference swap
+    and readers take whatever is newest. Neither side takes a lock to publish
+    or read; the condition only wakes readers that chose to wait.
+    """
+
+    def __init__(self):
+        self.item = None  # (sequence number, frame)
+        self.wakeup = threading.Condition()
+
+    def publish(self, frame):
+        seq = self.item[0] + 1 if self.item else 1
+        self.item = (seq, frame)
+        with self.wakeup:
+            self.wakeup.notify_all()
+
+    def latest(self):
+        return self.item
+
+    def wait_newer(self, seq: int, timeout: float = None):
+        """The newest (seq, frame) after seq, waiting up to timeout; None if nothing newer arrived"""
+        item = self.item
+        if item is None or item[0] <= seq:
+            with self.wakeup:
+                self.wakeup.wait_for(lambda: self.item is not None and self.item[0] > seq, timeout)
+            item = self.item
+        return item if item is not None and item[0] > seq else None
+
+
+class CaptureThread(threading.Thread):
+    """Owns a capture device: calls capture() once per clock tick and publishes the result"""
+
+    def __init__(self, capture, clock: FrameClock, active=lambda: True):
+        super().__init__(daemon=True)
+        self.capture = capture
+        self.clock = clock
+        self.active = active  # e.g. camera enabled; no reads while this is False
+        self.slot = LatestFrame()
+        self.running = True
+
+    def run(self):
+        while self.running:
+            self.clock.wait()
+            if not self.active():
+                continue
+            try:
+                frame = self.capture()
+            except Exception as e:
+                print(f"[ERROR] Capture failed: {e}")
+                continue
+            if frame is not None:
+                self.slot.publish(frame)
+
+    def stop(self):
+        self.running = False
@@ -8,9 +8,17 @@ from collections import defaultdict
 
 from PyQt6.QtCore import QThreadPool, QRunnable, QThread, pyqtSignal, pyqtSlot
 from PyQt6.QtWidgets import QApplication, QMessageBox
-from qt_gui import MainWindow, Camera, Microphone, Worker, ScreenCapturer
+from qt_gui import MainWindow, Camera, Microphone, Worker, ScreenCapturer, mixer, VIDEO_FPS, SCREEN_FPS
 
 from constants import *
+import protocol
+from protocol import WIRE_BINARY, WIRE_PICKLE
+from media_stats import MediaStats, SEQ_MOD, media_clock, stream_key
+from audio import JitterBuffer, SilenceSuppressor, audio_level, is_comfort_noise
+from audio_codecs import AudioDecoder, AudioEncoder, SUPPORTED as AUDIO_CODECS
+from capture import FrameClock, CaptureThread
+from video import MAX_PACKET, REPORT_INTERVAL
+from screen import ScreenEncoder, ScreenPacer, VIDEO_MODE_FPS
 
 # IP will be set from login dialog
 IP = None
@@ -25,54 +33,103 @@ class Client:
 
         self.video_frame = None
         self.audio_data = None
-        self.screen_image = None
 
         if self.current_device:
             self.camera = Camera()
             self.microphone = Microphone()
             self.screen_capturer = ScreenCapturer()
+            self.screen_encoder = ScreenEncoder()
         else:
             self.camera = None
             self.microphone = None
             self.screen_capturer = None
+            self.screen_encoder = None
+        # Received audio waits here until the output device pulls it
+        self.jitter_buffer = None if current_device else JitterBuffer()
+        self.audio_decoder = None if current_device else AudioDecoder()
+        # Own microphone: only speech and sparse comfort noise are sent
+        self.silence_suppressor = SilenceSuppressor() if current_device else None
+        self.speaking = False
+        self.spoke_at = float('-inf')  # last speech heard from this participant, time.monotonic()
         
         self.camera_enabled = True
         self.microphone_enabled = True
         self.screen_sharing = False
 
+        # One thread reads and encodes the camera; preview and sender share its frames.
+        # Screen share: captured on its own thread, encoded and sent by the screen broadcast loop.
+        # Both run only during a session (start_capture / stop_capture).
+        self.video_clock = None
+        self.camera_thread = None
+        self.screen_clock = None
+        self.screen_thread = None
+        if self.current_device:
+            self.video_clock = FrameClock(VIDEO_FPS)  # retuned by the camera's rate controllers
+            self.camera.clock = self.video_clock
+            self.screen_clock = FrameClock(SCREEN_FPS)  # retuned to the encode time by a ScreenPacer
+
+    def start_capture(self):
+        """Start the camera and screen capture threads when a session begins"""
+        if not self.current_device or self.camera_thread is not None:
+            return
+        self.camera_thread = CaptureThread(self.camera.capture, self.video_clock,
+                                           active=lambda: self.camera_enabled)
+        self.camera_thread.start()
+        self.screen_thread = CaptureThread(self.screen_capturer.capture, self.screen_clock,
+                                           active=lambda: self.screen_sharing)
+        self.screen_thread.start()
+
+    def stop_capture(self):
+        """Stop the capture threads when the session ends; each finishes its current tick"""
+        for thread in (self.camera_thread, self.screen_thread):
+            if thread is not None:
+                thread.stop()
+        self.camera_thread = self.screen_thread = None
+
+    def latest_camera_frame(self):
+        thread = self.camera_thread  # None outside a session
+        if not self.camera_enabled or thread is None:
+            return None
+        latest = thread.slot.latest()
+        return latest[1] if latest else None
+
     def get_video(self):
+        """Encoded frame: the last one received, or the camera's latest for this device"""
         if not self.camera_enabled:
             self.video_frame = None
             return None
 
-        if self.camera is not None:
-            try:
-                self.video_frame = self.camera.get_frame()
-                pass  # Video frame captured
-            except Exception as e:
-                print(f"[ERROR] Failed to get video frame: {e}")
+        if self.current_device:
+            frame = self.latest_camera_frame()
+            if frame is None:
                 self.video_frame = None
+            elif frame.packets is not None:
+                self.video_frame = frame.packets[max(frame.packets)]  # unchanged frames keep the last packet
 
         return self.video_frame
+
+    def get_preview(self):
+        """Frame to display: the raw camera image for this device, so the preview never decodes"""
+        if self.current_device:
+            frame = self.latest_camera_frame()
+            return frame.image if frame else None
+        return self.get_video()
     
     def get_audio(self):
         if not self.microphone_enabled:
             self.audio_data = None
+            self.speaking = False
+            if self.microphone is not None:
+                self.microphone.flush()
             return None
 
         if self.microphone is not None:
-            self.audio_data = self.microphone.get_data()
-            pass  # Audio captured
+            data = self.microphone.get_data()
+            self.audio_data = None if data is None else self.silence_suppressor.filter(data)
+            self.speaking = data is not None and self.silence_suppressor.speaking
 
         return self.audio_data
 
-    def get_screen(self):
-        if not self.screen_sharing or self.screen_capturer is None:
-            self.screen_image = None
-            return None
-        self.screen_image = self.screen_capturer.capture()
-        return self.screen_image
-
 
 class ServerConnection(QThread):
     add_client_signal = pyqtSignal(Client)
@@ -80,7 +137,7 @@ class ServerConnection(QThread):
     add_msg_signal = pyqtSignal(str, str)
     screen_share_start_signal = pyqtSignal(str)
     screen_share_stop_signal = pyqtSignal()
-    screen_update_signal = pyqtSignal(bytes)
+    screen_update_signal = pyqtSignal(bytes, object)
     screen_share_reject_signal = pyqtSignal()
 
     # New signals to communicate file-related info to UI
@@ -104,9 +161,28 @@ class ServerConnection(QThread):
 
         self.main_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.video_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.video_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, MEDIA_RECV_BUFFER)
         self.audio_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.screen_socket = None  # screen share connection, if the server offers one
 
         self.connected = False
+        self.wire = WIRE_PICKLE  # upgraded to binary if the server accepts it at login
+        self.session_id = None  # assigned by the server at login (binary wire only)
+        self.session_names = {}  # session id -> name of other participants
+        self.media_seq = {VIDEO: 0, AUDIO: 0}  # per stream_key: each simulcast layer counts separately
+        self.video_layers = {}  # sender -> simulcast layer last asked of the server
+        self.video_watched = {}  # sender -> whether the server was told we render its video
+        self.pinned_video = set()  # senders pinned to full video under the server's last-N
+        self.thumbnailed = set()  # senders the server sends us only thumbnails of (last-N)
+        self.frame_id = 0  # last fragmented video frame sent
+        self.frames = protocol.Reassembler()  # incoming video fragments, per sender
+        # Per-sender loss/jitter/latency of received media, read by stats views and tests
+        self.stream_stats = MediaStats()
+        self.reported = {}  # (sender, stream) -> (expected, received) video packets at the last report
+        # Server-mixed audio (server run with --audio mix): one stream from SERVER for the whole room
+        self.mixed_audio = JitterBuffer()
+        self.mixed_decoder = AudioDecoder()
+        self.audio_encoder = AudioEncoder()  # raw PCM until the server names a codec at login
         self.recieving_filename = None
         self.screen_broadcast_thread = None
         self.window = None  # Reference to main window
@@ -116,6 +192,9 @@ class ServerConnection(QThread):
         if not self.connected:
             return
         self.threadpool = QThreadPool()
+        # Up to seven session-long loops below, plus room for file uploads
+        self.threadpool.setMaxThreadCount(max(self.threadpool.maxThreadCount(), 8))
+        client.start_capture()
         self.start_conn_threads()
         self.start_broadcast_threads()
 
@@ -138,8 +217,8 @@ class ServerConnection(QThread):
                 
             self.main_socket.connect((IP, MAIN_PORT))
 
-            self.main_socket.send_bytes(self.name.encode())
-            conn_status = self.main_socket.recv_bytes().decode()
+            self.main_socket.send_bytes(protocol.hello(self.name, codecs=AUDIO_CODECS))
+            conn_status, options = protocol.parse_welcome(self.main_socket.recv_bytes())
             if conn_status != OK:
                 QMessageBox.critical(None, "Error", conn_status)
                 self.main_socket.close()
@@ -147,19 +226,68 @@ class ServerConnection(QThread):
                     self.window.close()
                 self.connected = False
                 return
-            
-            self.send_msg(self.video_socket, Message(self.name, ADD, VIDEO))
-            self.send_msg(self.audio_socket, Message(self.name, ADD, AUDIO))
+            self.wire = protocol.choose_wire(options)
+            if self.wire != WIRE_BINARY:
+                # Fragments need the binary header: keep each frame within one datagram
+                for rate in client.camera.rate_controls:
+                    rate.max_frame = MAX_PACKET
+            if 'sid' in options:
+                self.session_id = int(options['sid'])
+            self.audio_encoder = AudioEncoder(options.get('codec'))
+            if options.get('audio') == 'mix':
+                mixer.add(SERVER, self.mixed_audio)
+
+            self.send_msg(self.video_socket, self.media_msg(ADD, VIDEO))
+            self.send_msg(self.audio_socket, self.media_msg(ADD, AUDIO))
+            if 'screen' in options and self.session_id is not None:
+                self.open_screen_conn(int(options['screen']))
 
             self.connected = True
         except Exception as e:
             print(f"[ERROR] Connection failed: {e}")
             self.connected = False
     
+    def open_screen_conn(self, port: int):
+        """Screen frames get their own connection, so they never hold up chat, status and files"""
+        conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            conn.settimeout(5)
+            conn.connect((IP, port))
+            conn.send_bytes(protocol.encode(self.media_msg(ADD, SCREEN)))
+            reply = protocol.decode(conn.recv_bytes(), allow_pickle=False)
+            if reply.request != ADD:
+                raise ConnectionError("refused")
+            conn.settimeout(None)
+            self.screen_socket = conn
+        except (OSError, ValueError) as e:
+            print(f"[WARNING] No screen share connection ({e}); screen frames go on the main connection")
+            conn.close()
+
+    def close_screen_conn(self):
+        conn, self.screen_socket = self.screen_socket, None
+        if conn is not None:
+            conn.close()
+
+    def send_screen(self, data: bytes, seq: int = None):
+        if self.screen_socket is None:
+            self.send_msg(self.main_socket, Message(self.name, POST, SCREEN, data, seq=seq, timestamp=media_clock()))
+            return
+        try:
+            msg = self.media_msg(POST, SCREEN, data)
+            msg.seq, msg.timestamp = seq, media_clock()
+            self.screen_socket.send_bytes(protocol.encode(msg))
+        except OSError as e:
+            print(f"[WARNING] Screen share connection lost ({e}); using the main connection")
+            self.close_screen_conn()
+
     def start_conn_threads(self):
         self.main_conn_thread = Worker(self.handle_conn, self.main_socket, TEXT)
         self.threadpool.start(self.main_conn_thread)
 
+        if self.screen_socket is not None:
+            self.screen_conn_thread = Worker(self.handle_conn, self.screen_socket, SCREEN)
+            self.threadpool.start(self.screen_conn_thread)
+
         self.video_conn_thread = Worker(self.handle_conn, self.video_socket, VIDEO)
         self.threadpool.start(self.video_conn_thread)
 
@@ -167,22 +295,41 @@ class ServerConnection(QThread):
         self.threadpool.start(self.audio_conn_thread)
 
     def start_broadcast_threads(self):
-        self.video_broadcast_thread = Worker(self.media_broadcast_loop, self.video_socket, VIDEO)
+        self.video_broadcast_thread = Worker(self.video_broadcast_loop, self.video_socket)
         self.threadpool.start(self.video_broadcast_thread)
 
-        self.audio_broadcast_thread = Worker(self.media_broadcast_loop, self.audio_socket, AUDIO)
+        self.audio_broadcast_thread = Worker(self.audio_broadcast_loop, self.audio_socket)
         self.threadpool.start(self.audio_broadcast_thread)
+
+        self.screen_broadcast_thread = Worker(self.screen_broadcast_loop)
+        self.threadpool.start(self.screen_broadcast_thread)
+
+        self.report_thread = Worker(self.report_loop)
+        self.threadpool.start(self.report_thread)
     
+    def request_keyframe(self):
+        """Ask the presenter for a whole picture after missing screen deltas"""
+        if not self.connected or self.wire != WIRE_BINARY:
+            return  # a legacy server sends keyframes only and would show the request as chat
+        self.send_msg(self.main_socket, Message(self.name, GET, SCREEN))
+
     def disconnect_server(self):
         if self.connected:
             self.send_msg(self.main_socket, Message(self.name, DISCONNECT))
-            self.main_socket.disconnect()
+            self.main_socket.close()
         self.connected = False
+        self.close_screen_conn()
+        client.stop_capture()
     
+    def media_msg(self, request: str, media: str, data: any = None) -> Message:
+        """Media packets carry only the session id once the server has assigned one"""
+        if self.session_id is None:
+            return Message(self.name, request, media, data)
+        return Message('', request, media, data, sender_id=self.session_id)
+
     def send_msg(self, conn: socket.socket, msg: Message):
         try:
-            # Use protocol 2 for better cross-platform compatibility
-            msg_bytes = pickle.dumps(msg, protocol=2)
+            msg_bytes = protocol.encode(msg, self.wire)
 
             if msg.data_type == VIDEO and VIDEO_ADDR:
                 # Check packet size before sending - be more strict to prevent truncation
@@ -200,6 +347,8 @@ class ServerConnection(QThread):
                 conn.sendto(msg_bytes, AUDIO_ADDR)
             else:
                 conn.send_bytes(msg_bytes)
+        except protocol.ProtocolError as e:
+            print(f"[ERROR] Cannot encode {msg.data_type} message: {e}")
         except (BrokenPipeError, ConnectionResetError, OSError) as e:
             print(f"[ERROR] Connection error: {e}")
             self.connected = False
@@ -269,29 +418,158 @@ class ServerConnection(QThread):
         msg = Message(self.name, DOWNLOAD_FILE, FILE, {"transfer_id": transfer_id})
         self.send_msg(self.main_socket, msg)
 
-    def media_broadcast_loop(self, conn: socket.socket, media: str):
+    def send_media(self, conn: socket.socket, media: str, data: any, captured_at: int = None, layer: int = None):
+        if captured_at is None:
+            captured_at = media_clock()
+        if media == VIDEO and self.wire == WIRE_BINARY:
+            # Frames larger than one MTU go out as fragments, each with its own sequence number
+            fragments = protocol.split_fragments(data)
+            if len(fragments) > 1:
+                self.frame_id = (self.frame_id + 1) % protocol.FRAME_ID_MOD
+                for index, fragment in enumerate(fragments):
+                    msg = self.media_msg(POST, media, fragment)
+                    msg.frame_id, msg.fragment, msg.fragments = self.frame_id, index, len(fragments)
+                    msg.layer = layer
+                    self.send_media_msg(conn, msg, captured_at)
+                return
+        msg = self.media_msg(POST, media, data)
+        msg.layer = layer
+        if media == AUDIO and self.wire == WIRE_BINARY and not is_comfort_noise(data):
+            # The server ranks active speakers by this level without decoding the audio
+            msg.level = audio_level(data)
+        if media == AUDIO and self.audio_encoder.codec and not is_comfort_noise(data):
+            msg.data, msg.codec = self.audio_encoder.encode(data), self.audio_encoder.codec
+        self.send_media_msg(conn, msg, captured_at)
+
+    def send_media_msg(self, conn: socket.socket, msg: Message, captured_at: int):
+        stream = stream_key(msg.data_type, msg.layer)
+        msg.seq, msg.timestamp = self.media_seq.get(stream, 0), captured_at
+        self.media_seq[stream] = (msg.seq + 1) % SEQ_MOD
+        self.send_msg(conn, msg)
+
+    def select_video_layers(self, layers: dict):
+        """Ask the server for a simulcast layer per sender; only changes are sent"""
+        changed = {name: layer for name, layer in layers.items() if self.video_layers.get(name) != layer}
+        if not changed or not self.connected or self.wire != WIRE_BINARY:
+            return
+        self.video_layers.update(changed)
+        for name in changed:
+            self.restart_video_stats(name)
+        self.send_msg(self.main_socket, Message(self.name, LAYER, data=changed))
+
+    def subscribe_video(self, watched: dict):
+        """Tell the server whose video we render (True) or stopped rendering (False); only changes are sent"""
+        changed = {name: bool(w) for name, w in watched.items() if self.video_watched.get(name, True) != bool(w)}
+        if not changed or not self.connected or self.wire != WIRE_BINARY:
+            return
+        self.video_watched.update(changed)
+        for name in changed:
+            self.restart_video_stats(name)
+        self.send_msg(self.main_socket, Message(self.name, SUBSCRIBE, data=changed))
+
+    def pin_video(self, name: str, pinned: bool):
+        """Keep a sender's full video under last-N whoever is speaking"""
+        if not self.connected or self.wire != WIRE_BINARY:
+            return
+        if pinned:
+            self.pinned_video.add(name)
+        else:
+            self.pinned_video.discard(name)
+        self.send_msg(self.main_socket, Message(self.name, PIN, data={name: pinned}))
+
+    def set_thumbnailed(self, names):
+        for name in self.thumbnailed.symmetric_difference(names):
+            self.restart_video_stats(name)
+        self.thumbnailed = set(names)
+
+    def restart_video_stats(self, sender: str):
+        """The sequence gap from packets we stopped receiving is not loss"""
+        self.stream_stats.forget(sender, VIDEO)
+        for key in [k for k in tuple(self.reported) if k[0] == sender]:
+            self.reported.pop(key, None)
+
+    def video_broadcast_loop(self, conn: socket.socket):
+        """Send each camera frame once, as the capture thread publishes it on its fixed-rate clock"""
+        last_seq = 0
+        camera = client.camera_thread
+        while self.connected:
+            try:
+                latest = camera.slot.wait_newer(last_seq, timeout=0.5)
+                if latest is None or not client.camera_enabled:
+                    continue  # camera off or not producing
+                last_seq, frame = latest
+                if frame.packets is None:
+                    continue  # unchanged picture, nothing to send
+                for layer, packet in frame.packets.items():
+                    # Only a binary-wire server relays layers; otherwise just layer 0 runs
+                    self.send_media(conn, VIDEO, packet, frame.captured_at,
+                                    layer if self.wire == WIRE_BINARY else None)
+            except Exception as e:
+                print(f"[ERROR] Media broadcast error ({VIDEO}): {e}")
+                time.sleep(0.1)
+
+    def screen_broadcast_loop(self):
+        """
+        Encode and send the newest screen capture whenever the last send is done;
+        captures that came in meanwhile are skipped, and the capture rate follows
+        how long this takes, up to a higher rate while a video is being shared.
+        """
+        last_seq = 0
+        pacer = ScreenPacer(SCREEN_FPS)
+        screen = client.screen_thread
         while self.connected:
             try:
-                if media == VIDEO:
-                    data = client.get_video()
-                elif media == AUDIO:
-                    data = client.get_audio()
-                else:
-                    break
-                    
+                latest = screen.slot.wait_newer(last_seq, timeout=0.5)
+                if latest is None or not client.screen_sharing:
+                    continue
+                last_seq, image = latest
+                start = time.monotonic()
+                encoder = client.screen_encoder
+                encoder.keyframes_only = self.wire != WIRE_BINARY  # a legacy server drops deltas
+                frame = encoder.encode(image)
+                if frame is not None and client.screen_encoder is encoder:
+                    self.send_screen(*frame)
+                pacer.max_fps = VIDEO_MODE_FPS if encoder.video_mode else SCREEN_FPS
+                client.screen_clock.set_fps(pacer.update(time.monotonic() - start))
+            except Exception as e:
+                print(f"[ERROR] Media broadcast error ({SCREEN}): {e}")
+                time.sleep(0.1)
+
+    def audio_broadcast_loop(self, conn: socket.socket):
+        """Send microphone frames as the capture callback delivers them"""
+        while self.connected:
+            try:
+                data = client.get_audio()  # waits for the next captured frame
                 if data is None:
-                    time.sleep(1/30)  # Reduced FPS when no data to save bandwidth
+                    if not client.microphone_enabled or client.microphone is None:
+                        time.sleep(0.05)
                     continue
-                    
-                msg = Message(self.name, POST, media, data)
-                self.send_msg(conn, msg)
-                pass  # Media data sent
-                time.sleep(1/30)  # 30 FPS for better stability and bandwidth usage
-                
+                self.send_media(conn, AUDIO, data)
             except Exception as e:
-                print(f"[ERROR] Media broadcast error ({media}): {e}")
+                print(f"[ERROR] Media broadcast error ({AUDIO}): {e}")
                 time.sleep(0.1)
-                continue
+
+    def report_loop(self):
+        """Tell each video sender how much of its stream (per simulcast layer) was lost since the last report, and its delay"""
+        while self.connected:
+            time.sleep(REPORT_INTERVAL)
+            for sender, streams in self.stream_stats.snapshot().items():
+                if sender in self.thumbnailed:
+                    continue  # sparse on purpose, not lossy
+                for stream, video in streams.items():
+                    media, _, layer = stream.partition('/')
+                    if media != VIDEO:
+                        continue
+                    expected, received = self.reported.get((sender, stream), (0, 0))
+                    self.reported[(sender, stream)] = (video['expected'], video['received'])
+                    expected, received = video['expected'] - expected, video['received'] - received
+                    if expected <= 0:
+                        continue  # nothing sent, e.g. a still picture or a layer we left
+                    report = {VIDEO: round(max(0, expected - received) / expected, 3),
+                              'delay': round(video['latency_ms'])}
+                    if layer:
+                        report['layer'] = int(layer)
+                    self.send_msg(self.main_socket, Message(self.name, REPORT, data=report, to_names=(sender,)))
 
     def handle_conn(self, conn: socket.socket, media: str):
         while self.connected:
@@ -300,13 +578,29 @@ class ServerConnection(QThread):
             else:
                 msg_bytes = conn.recv_bytes()
             if not msg_bytes:
+                if media == SCREEN:
+                    # Only the screen connection is gone; frames come on the main one
+                    self.close_screen_conn()
+                    break
                 self.connected = False
                 break
             try:
-                msg = pickle.loads(msg_bytes)
+                # Media payloads stay views into the datagram; no extra copy
+                msg = protocol.decode(msg_bytes, allow_pickle=(self.wire == WIRE_PICKLE),
+                                      copy=media not in [VIDEO, AUDIO])
             except (pickle.UnpicklingError, pickle.PickleError, EOFError, ValueError) as e:
-                print(f"[{self.name}] [{media}] [ERROR] Pickle error: {e}")
+                print(f"[{self.name}] [{media}] [ERROR] Decode error: {e}")
                 continue
+            if not msg.from_name:
+                msg.from_name = self.session_names.get(msg.sender_id)
+                if msg.from_name is None:
+                    continue  # media from a session we have not been told about yet
+            if media in [VIDEO, AUDIO]:
+                self.stream_stats.record(msg.from_name, stream_key(media, msg.layer), msg.seq, msg.timestamp)
+            if media == VIDEO and msg.fragments is not None:
+                msg.data = self.frames.push(msg.from_name, msg)
+                if msg.data is None:
+                    continue  # frame not complete yet
 
             if msg.request == DISCONNECT:
                 self.connected = False
@@ -317,6 +611,12 @@ class ServerConnection(QThread):
                 print(f"[{self.name}] [{media}] [ERROR] {e}")
                 continue
 
+    def decode_audio(self, decoder: AudioDecoder, msg: Message):
+        """Raw PCM for the jitter buffer; comfort noise and PCM pass through"""
+        if msg.codec is None:
+            return msg.data
+        return decoder.decode(msg.codec, msg.data)
+
     def handle_msg(self, msg: Message):
         global all_clients
         client_name = msg.from_name
@@ -325,6 +625,9 @@ class ServerConnection(QThread):
                 if msg.data == "Screen sharing already active by another user":
                     self.screen_share_reject_signal.emit()
                     return
+            if msg.data_type == AUDIO and client_name == SERVER:
+                self.mixed_audio.push(self.decode_audio(self.mixed_decoder, msg), msg.seq)
+                return
             if client_name not in all_clients:
                 if msg.data_type in [VIDEO, AUDIO]:
                     all_clients[client_name] = Client(client_name)
@@ -339,10 +642,13 @@ class ServerConnection(QThread):
                     pass  # Video received
             elif msg.data_type == AUDIO:
                 if client_name in all_clients:
-                    all_clients[client_name].audio_data = msg.data
-                    pass  # Audio received
+                    c = all_clients[client_name]
+                    c.speaking = not is_comfort_noise(msg.data)
+                    if c.speaking:
+                        c.spoke_at = time.monotonic()
+                    c.jitter_buffer.push(self.decode_audio(c.audio_decoder, msg), msg.seq)
             elif msg.data_type == SCREEN:
-                self.screen_update_signal.emit(msg.data)
+                self.screen_update_signal.emit(msg.data, msg.seq)
             if msg.data_type == TEXT:
                 # special status update (camera / microphone) sent as dict
                 if isinstance(msg.data, dict):
@@ -361,6 +667,9 @@ class ServerConnection(QThread):
                         c.microphone_enabled = bool(status['microphone_enabled'])
                         if not c.microphone_enabled:
                             c.audio_data = None
+                            c.speaking = False
+                            if c.jitter_buffer is not None:
+                                c.jitter_buffer.reset()
                     # optionally show a small system message
                     self.add_msg_signal.emit(client_name, f"Status updated: {status}")
                 else:
@@ -377,16 +686,48 @@ class ServerConnection(QThread):
                 pass
 
         elif msg.request == ADD:
+            if msg.sender_id is not None:
+                self.session_names[msg.sender_id] = client_name
             if client_name not in all_clients:
                 all_clients[client_name] = Client(client_name)
                 self.add_client_signal.emit(all_clients[client_name])
 
+        elif msg.request == REPORT:
+            if isinstance(msg.data, dict) and VIDEO in msg.data and client.camera is not None:
+                delay = msg.data.get('delay')
+                client.camera.on_report(client_name, int(msg.data.get('layer', 0)), float(msg.data[VIDEO]),
+                                        float(delay) if isinstance(delay, (int, float)) else None)
+
+        elif msg.request == LAYER:
+            if client_name == SERVER and isinstance(msg.data, list) and client.camera is not None:
+                client.camera.set_layers(msg.data)
+
+        elif msg.request == LAST_N:
+            if client_name == SERVER and isinstance(msg.data, list):
+                self.set_thumbnailed(msg.data)
+
         elif msg.request == RM:
+            for session_id, name in tuple(self.session_names.items()):
+                if name == client_name:
+                    self.session_names.pop(session_id)
+            self.stream_stats.forget(client_name)
+            self.frames.forget(client_name)
+            for key in [k for k in tuple(self.reported) if k[0] == client_name]:
+                self.reported.pop(key)
+            self.video_layers.pop(client_name, None)
+            self.video_watched.pop(client_name, None)
+            self.pinned_video.discard(client_name)
+            self.thumbnailed.discard(client_name)
+            client.camera.forget(client_name)
             if client_name not in all_clients:
                 return
             self.remove_client_signal.emit(client_name)
             all_clients.pop(client_name)
 
+        elif msg.request == GET and msg.data_type == SCREEN:
+            if client.screen_encoder is not None:
+                client.screen_encoder.request_keyframe()
+
         elif msg.request == START_SHARE:
             self.screen_share_start_signal.emit(msg.data)
 
@@ -464,5 +805,7 @@ if __name__ == "__main__":
 
     status_code = app.exec()
     server_conn.disconnect_server()
+    if window.audio_output is not None:
+        window.audio_output.close()
     os._exit(status_code)
 
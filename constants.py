@@ -9,6 +9,8 @@ PORT = 53535
 MAIN_PORT = 53530
 VIDEO_PORT = 53531
 AUDIO_PORT = 53532
+SCREEN_PORT = 53533  # screen share: its own TCP connection, so frames never queue behind chat and files
+SCREEN_DELTA_MAGIC = b'SD'  # screen payload with changed tiles only; keyframes are plain JPEG
 SIZE = 1024
 
 SERVER = 'SERVER'
@@ -22,6 +24,11 @@ RM = 'RM'
 START_SHARE = 'START_SHARE'
 STOP_SHARE = 'STOP_SHARE'
 DISCONNECT = 'QUIT!'
+REPORT = 'REPORT'  # receiver report: media loss seen from one sender
+LAYER = 'LAYER'    # simulcast: video layer a receiver wants of each sender
+SUBSCRIBE = 'SUBSCRIBE'  # senders whose video a receiver renders (or stopped rendering)
+PIN = 'PIN'        # last-N: senders a receiver wants in full video whoever is speaking
+LAST_N = 'LAST_N'  # last-N: senders the server sends a receiver only thumbnails of
 
 # File-related requests
 GET_FILES = 'GET_FILES'          # Client asks server for available files for that client
@@ -37,6 +44,21 @@ FILE = 'File'
 SCREEN = 'Screen'
 
 MEDIA_SIZE = {VIDEO: 65536, AUDIO: 8192}  # 64KB video, 8KB audio - balanced for stability
+# Video frames travel as fragments of at most FRAGMENT_SIZE payload bytes, so
+# each datagram fits a 1500-byte Ethernet MTU with IP, UDP and message headers
+FRAGMENT_SIZE = 1200
+MAX_FRAGMENTS = 256  # largest frame: 300 KB
+MEDIA_RECV_BUFFER = 1 << 21  # video socket receive buffer, room for bursts of fragments
+
+# Audio format: 48 kHz mono int16, one packet per block
+SAMPLE_RATE = 48000
+BLOCK_SIZE = 2048
+
+# Audio codecs (see audio_codecs.py); raw PCM has no codec
+ULAW = 'ulaw'
+ADPCM = 'adpcm'
+ADPCM_16K = 'adpcm16k'
+ULAW_16K = 'ulaw16k'
 
 # --- socket helpers (send/recv with length prefix) ---
 def send_bytes(self, msg: bytes):
@@ -99,6 +121,15 @@ class Message:
     data_type: str = None
     data: any = None
     to_names: tuple[str] = None
+    sender_id: int = None  # server-assigned session id; media packets carry only this
+    seq: int = None        # per-stream media sequence number
+    timestamp: int = None  # media capture time, see media_stats.media_clock
+    codec: str = None      # audio codec of the payload, None for raw PCM
+    frame_id: int = None   # video frame a fragment belongs to
+    fragment: int = None   # index of this fragment in the frame
+    fragments: int = None  # number of fragments in the frame
+    layer: int = None      # simulcast layer of a video packet, 0 = smallest
+    level: int = None      # audio level of the block in -dBov, 0 = loudest, 127 = silence
 
     def __str__(self):
         if self.data_type in [VIDEO, AUDIO, SCREEN]:
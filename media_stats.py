@@ -0,0 +1,158 @@
+# media_stats.py
+"""
+Receive statistics for UDP media streams.
+
+Senders stamp every video/audio packet with a per-stream sequence number and
+a capture timestamp from media_clock(). Receivers (the server relay and each
+client) feed those into MediaStats, which tracks per sender and media type
+(per simulcast layer for video, see stream_key):
+
+  - loss rate      : packets never seen, from the sequence number range
+  - reordered      : packets that arrived after a higher sequence number
+  - duplicates     : packets seen twice (within the last 64 sequence numbers)
+  - jitter         : RFC 3550 interarrival jitter, in milliseconds
+  - latency        : arrival time minus capture time, in milliseconds
+
+media_clock() is monotonic but anchored to wall-clock time at start-up, so the
+latency figure is meaningful between machines whose clocks are synchronized
+(NTP on the LAN); jitter does not depend on clock synchronization.
+"""
+import threading
+import time
+
+SEQ_MOD = 1 << 32
+CLOCK_MOD = 1 << 32
+REPLAY_WINDOW = 64
+
+_clock_origin = time.time() - time.monotonic()
+
+
+def media_clock() -> int:
+    """Capture timestamp in milliseconds, wrapping at 32 bits"""
+    return int((_clock_origin + time.monotonic()) * 1000) % CLOCK_MOD
+
+
+def stream_key(media: str, layer: int = None) -> str:
+    """Stats key of one stream; each simulcast video layer has its own sequence numbers"""
+    return media if layer is None else f"{media}/{layer}"
+
+
+def _signed_diff(a: int, b: int, mod: int) -> int:
+    """a - b for wrapping counters, in the range [-mod/2, mod/2)"""
+    return (a - b + mod // 2) % mod - mod // 2
+
+
+class StreamStats:
+    """Counters for one sender's stream of one media type"""
+
+    def __init__(self):
+        self.base_seq = None
+        self.max_seq = 0      # extended (unwrapped) highest sequence number
+        self.window = 0       # bit i set: max_seq - i has been received
+        self.received = 0
+        self.reordered = 0
+        self.duplicates = 0
+        self.jitter = 0.0
+        self.latency = 0.0    # smoothed, ms
+        self.last_latency = 0
+        self.last_transit = None
+
+    def update(self, seq: int, timestamp: int, arrival: int = None):
+        if arrival is None:
+            arrival = media_clock()
+
+        if self.base_seq is None:
+            self.base_seq = self.max_seq = seq
+            self.window = 1
+        else:
+            delta = _signed_diff(seq, self.max_seq % SEQ_MOD, SEQ_MOD)
+            if delta > 0:
+                self.max_seq += delta
+                self.window = ((self.window << delta) | 1) & ((1 << REPLAY_WINDOW) - 1)
+            elif -delta < REPLAY_WINDOW:
+                bit = 1 << -delta
+                if self.window & bit:
+                    self.duplicates += 1
+                    return
+                self.window |= bit
+                self.reordered += 1
+            else:
+                # Too old to tell apart from a duplicate
+                self.reordered += 1
+        self.received += 1
+
+        # RFC 3550 section 6.4.1: J += (|D(i-1,i)| - J) / 16
+        transit = _signed_diff(arrival, timestamp, CLOCK_MOD)
+        if self.last_transit is not None:
+            d = abs(transit - self.last_transit)
+            self.jitter += (d - self.jitter) / 16
+        self.last_transit = transit
+        self.last_latency = transit
+        if self.received == 1:
+            self.latency = transit
+        else:
+            self.latency += (transit - self.latency) / 16
+
+    @property
+    def expected(self) -> int:
+        if self.base_seq is None:
+            return 0
+        return self.max_seq - self.base_seq + 1
+
+    @property
+    def lost(self) -> int:
+        return max(0, self.expected - self.received)
+
+    @property
+    def loss_rate(self) -> float:
+        return self.lost / self.expected if self.expected else 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            "received": self.received,
+            "expected": self.expected,
+            "lost": self.lost,
+            "loss_rate": self.loss_rate,
+            "reordered": self.reordered,
+            "duplicates": self.duplicates,
+            "jitter_ms": self.jitter,
+            "latency_ms": self.latency,
+            "last_latency_ms": self.last_latency,
+        }
+
+
+class MediaStats:
+    """Thread-safe StreamStats per (sender, media type)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.streams: dict[tuple, StreamStats] = {}
+
+    def record(self, sender: str, media: str, seq: int, timestamp: int, arrival: int = None):
+        if seq is None or timestamp is None:
+            return  # legacy sender without a media header
+        with self.lock:
+            stream = self.streams.get((sender, media))
+            if stream is None:
+                stream = self.streams[(sender, media)] = StreamStats()
+            stream.update(seq, timestamp, arrival)
+
+    def forget(self, sender: str, media: str = None):
+        """Drop a sender's streams; only those of one media type (all its layers) if given"""
+        with self.lock:
+            for key in [k for k in self.streams if k[0] == sender]:
+                if media is None or key[1].partition('/')[0] == media:
+                    self.streams.pop(key)
+
+    def get(self, sender: str, media: str) -> dict:
+        with self.lock:
+            stream = self.streams.get((sender, media))
+            return stream.snapshot() if stream else None
+
+    def snapshot(self) -> dict:
+        """{sender: {media: stats dict}} for every stream seen so far"""
+        with self.lock:
+            result = {}
+            for (sender, media), stream in self.streams.items():
+                result.setdefault(sender, {})[media] = stream.snapshot()
+            return result
@@ -0,0 +1,344 @@
+# protocol.py
+"""
+Binary wire format for Message.
+
+Every packet is a fixed header followed by the sender name, the recipient
+list and a raw payload:
+
+    magic 'VC' | version | data type | request | flags | sender id
+    | name length | to-names length | payload length
+    [| sequence number | capture timestamp]      (media packets, FLAG_MEDIA)
+    [| audio codec]                              (coded audio, FLAG_CODEC)
+    [| frame id | fragment index | count]        (video fragments, FLAG_FRAGMENT)
+    [| layer]                                    (simulcast video, FLAG_LAYER)
+    [| audio level]                              (speech level in -dBov, FLAG_LEVEL)
+
+The sender id is the session id the server assigns at login; media packets
+carry only that id and leave the name empty. Data types and requests travel
+as small enums. Media payloads (JPEG frames,
+PCM blocks) are carried as raw bytes, so the header can be read without
+touching the payload. Structured payloads (file lists, status dicts) are
+JSON; nothing on this path ever unpickles.
+
+Video frames are split into fragments that each fit one MTU-sized datagram
+(split_fragments); the relay forwards fragments as they come and receivers
+put frames back together with a Reassembler.
+
+Pickle stays available as a fallback for clients that did not negotiate the
+binary format at login.
+"""
+import json
+import pickle
+import struct
+import time
+
+from constants import *
+
+WIRE_PICKLE = 'pickle'
+WIRE_BINARY = 'bin1'
+
+MAGIC = b'VC'
+VERSION = 1
+
+# Enum tables: index on the wire <-> string constant. Append only.
+DATA_TYPES = (None, VIDEO, AUDIO, TEXT, FILE, SCREEN)
+REQUESTS = (None, GET, POST, ADD, RM, START_SHARE, STOP_SHARE, DISCONNECT,
+            GET_FILES, DOWNLOAD_FILE, FILE_LIST, FILE_CHUNK, REPORT, LAYER, SUBSCRIBE,
+            PIN, LAST_N)
+DATA_TYPE_IDS = {data_type: i for i, data_type in enumerate(DATA_TYPES)}
+REQUEST_IDS = {request: i for i, request in enumerate(REQUESTS)}
+AUDIO_CODECS = (None, ULAW, ADPCM, ADPCM_16K, ULAW_16K)
+AUDIO_CODEC_IDS = {codec: i for i, codec in enumerate(AUDIO_CODECS)}
+
+# Payload encodings (low two bits of flags)
+PAYLOAD_NONE = 0
+PAYLOAD_BYTES = 1
+PAYLOAD_TEXT = 2
+PAYLOAD_JSON = 3
+PAYLOAD_MASK = 0x03
+
+# Optional header extensions, present in this order when their flag is set
+FLAG_MEDIA = 0x04
+FLAG_CODEC = 0x08
+FLAG_FRAGMENT = 0x10
+FLAG_LAYER = 0x20
+FLAG_LEVEL = 0x40
+
+# magic, version, data type, request, flags, sender id, name length, to-names length, payload length
+HEADER = struct.Struct('>2sBBBBHBHI')
+# sequence number, capture timestamp (ms, wrapping)
+MEDIA_HEADER = struct.Struct('>II')
+# audio codec id
+CODEC_HEADER = struct.Struct('>B')
+# frame id, fragment index, fragment count
+FRAGMENT_HEADER = struct.Struct('>IHH')
+# simulcast layer
+LAYER_HEADER = struct.Struct('>B')
+# audio level, -dBov (as in RFC 6464)
+LEVEL_HEADER = struct.Struct('>B')
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def is_binary(data) -> bool:
+    return data[:2] == MAGIC
+
+
+def _encode_payload(data) -> tuple[int, bytes]:
+    if data is None:
+        return PAYLOAD_NONE, b''
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return PAYLOAD_BYTES, data
+    if isinstance(data, str):
+        return PAYLOAD_TEXT, data.encode()
+    try:
+        return PAYLOAD_JSON, json.dumps(data, separators=(',', ':')).encode()
+    except (TypeError, ValueError) as e:
+        raise ProtocolError(f"Unsupported payload type {type(data).__name__}") from e
+
+
+def encode(msg: Message, wire: str = WIRE_BINARY) -> bytes:
+    if wire == WIRE_PICKLE:
+        # Use protocol 2 for better cross-platform compatibility
+        return pickle.dumps(msg, protocol=2)
+
+    name = msg.from_name.encode() if msg.from_name else b''
+    to_names = '\0'.join(msg.to_names).encode() if msg.to_names else b''
+    flags, payload = _encode_payload(msg.data)
+    extensions = b''
+    try:
+        if msg.seq is not None:
+            flags |= FLAG_MEDIA
+            extensions += MEDIA_HEADER.pack(msg.seq, msg.timestamp or 0)
+        if msg.codec is not None:
+            flags |= FLAG_CODEC
+            extensions += CODEC_HEADER.pack(AUDIO_CODEC_IDS[msg.codec])
+        if msg.fragments is not None:
+            flags |= FLAG_FRAGMENT
+            extensions += FRAGMENT_HEADER.pack(msg.frame_id, msg.fragment, msg.fragments)
+        if msg.layer is not None:
+            flags |= FLAG_LAYER
+            extensions += LAYER_HEADER.pack(msg.layer)
+        if msg.level is not None:
+            flags |= FLAG_LEVEL
+            extensions += LEVEL_HEADER.pack(msg.level)
+        header = HEADER.pack(MAGIC, VERSION, DATA_TYPE_IDS[msg.data_type], REQUEST_IDS[msg.request],
+                             flags, msg.sender_id or 0, len(name), len(to_names), len(payload))
+    except KeyError as e:
+        raise ProtocolError(f"Unknown enum value {e}") from e
+    except struct.error as e:
+        raise ProtocolError(str(e)) from e
+    return b''.join((header, extensions, name, to_names, payload))
+
+
+def decode(data: bytes, allow_pickle: bool = True, copy: bool = True, payload: bool = True) -> Message:
+    """
+    Parse one packet.
+    copy=False returns raw payloads as memoryview slices of data instead of new bytes.
+    payload=False parses the header only and leaves msg.data as None.
+    """
+    if not is_binary(data):
+        if not allow_pickle:
+            raise ProtocolError("Pickle packet on a binary connection")
+        return pickle.loads(data)
+
+    if len(data) < HEADER.size:
+        raise ProtocolError(f"Truncated header ({len(data)} bytes)")
+    _, version, type_id, request_id, flags, sender_id, name_len, to_len, payload_len = HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ProtocolError(f"Unsupported version {version}")
+    offset = HEADER.size
+    seq = timestamp = None
+    if flags & FLAG_MEDIA:
+        if len(data) < offset + MEDIA_HEADER.size:
+            raise ProtocolError("Truncated media header")
+        seq, timestamp = MEDIA_HEADER.unpack_from(data, offset)
+        offset += MEDIA_HEADER.size
+    codec = None
+    if flags & FLAG_CODEC:
+        if len(data) < offset + CODEC_HEADER.size:
+            raise ProtocolError("Truncated codec header")
+        codec_id, = CODEC_HEADER.unpack_from(data, offset)
+        offset += CODEC_HEADER.size
+        if codec_id >= len(AUDIO_CODECS):
+            raise ProtocolError(f"Unknown audio codec {codec_id}")
+        codec = AUDIO_CODECS[codec_id]
+    frame_id = fragment = fragments = None
+    if flags & FLAG_FRAGMENT:
+        if len(data) < offset + FRAGMENT_HEADER.size:
+            raise ProtocolError("Truncated fragment header")
+        frame_id, fragment, fragments = FRAGMENT_HEADER.unpack_from(data, offset)
+        offset += FRAGMENT_HEADER.size
+        if not fragment < fragments <= MAX_FRAGMENTS:
+            raise ProtocolError(f"Bad fragment {fragment} of {fragments}")
+    layer = None
+    if flags & FLAG_LAYER:
+        if len(data) < offset + LAYER_HEADER.size:
+            raise ProtocolError("Truncated layer header")
+        layer, = LAYER_HEADER.unpack_from(data, offset)
+        offset += LAYER_HEADER.size
+    level = None
+    if flags & FLAG_LEVEL:
+        if len(data) < offset + LEVEL_HEADER.size:
+            raise ProtocolError("Truncated level header")
+        level, = LEVEL_HEADER.unpack_from(data, offset)
+        offset += LEVEL_HEADER.size
+    end = offset + name_len + to_len + payload_len
+    if len(data) != end:
+        raise ProtocolError(f"Length mismatch ({len(data)} bytes, header says {end})")
+    try:
+        data_type = DATA_TYPES[type_id]
+        request = REQUESTS[request_id]
+    except IndexError as e:
+        raise ProtocolError("Unknown enum value") from e
+
+    view = memoryview(data)
+    from_name = str(view[offset:offset + name_len], 'utf-8')
+    offset += name_len
+    to_names = tuple(str(view[offset:offset + to_len], 'utf-8').split('\0')) if to_len else None
+    offset += to_len
+    msg = Message(from_name, request, data_type, None, to_names, sender_id or None, seq, timestamp, codec,
+                  frame_id, fragment, fragments, layer, level)
+    if not payload:
+        return msg
+
+    raw = view[offset:end]
+    kind = flags & PAYLOAD_MASK
+    if kind == PAYLOAD_BYTES:
+        msg.data = bytes(raw) if copy else raw
+    elif kind == PAYLOAD_TEXT:
+        msg.data = str(raw, 'utf-8')
+    elif kind == PAYLOAD_JSON:
+        msg.data = json.loads(str(raw, 'utf-8'))
+    return msg
+
+
+class Encoded:
+    """One message, serialized lazily and at most once per wire format"""
+
+    def __init__(self, msg: Message = None, wire: str = None, packet: bytes = None, from_name: str = None):
+        self.msg = msg
+        self.from_name = from_name  # fills in the name when transcoding an id-only media packet
+        self.packets = {}
+        if packet is not None:
+            self.packets[wire] = packet
+
+    def __getitem__(self, wire: str) -> bytes:
+        packet = self.packets.get(wire)
+        if packet is None:
+            if self.msg is None:
+                # Only a received packet so far: decode it once to transcode
+                self.msg = decode(next(iter(self.packets.values())))
+                self.msg.from_name = self.msg.from_name or self.from_name
+            packet = self.packets[wire] = encode(self.msg, wire)
+        return packet
+
+
+# --- fragmentation ---
+FRAGMENT_TIMEOUT = 0.25  # seconds an incomplete frame waits for its missing fragments
+FRAME_ID_MOD = 1 << 32
+
+
+def split_fragments(payload) -> list:
+    """Equal slices of at most FRAGMENT_SIZE bytes (views, not copies); one for a small payload"""
+    view = memoryview(payload)
+    count = max(1, -(-len(view) // FRAGMENT_SIZE))
+    if count > MAX_FRAGMENTS:
+        raise ProtocolError(f"Frame too large ({len(view)} bytes, {count} fragments)")
+    size = -(-len(view) // count)
+    return [view[i * size:(i + 1) * size] for i in range(count)]
+
+
+class Reassembler:
+    """
+    Puts fragmented frames back together, per sender. A frame is handed out once
+    all its fragments are in; it is dropped if they do not all arrive within
+    FRAGMENT_TIMEOUT, or once a newer frame from the same sender completes.
+    Used from one receiving thread.
+    """
+
+    def __init__(self, timeout: float = FRAGMENT_TIMEOUT):
+        self.timeout = timeout
+        self.pending = {}  # (sender, frame id) -> [fragment count, {index: payload}, first arrival]
+        self.completed = 0
+        self.dropped = 0
+
+    def push(self, sender, msg: Message, now: float = None):
+        """The whole frame once msg completes it, else None. Unfragmented payloads pass straight through."""
+        if msg.fragments is None:
+            return msg.data
+        if now is None:
+            now = time.monotonic()
+        self.expire(now)
+        key = (sender, msg.frame_id)
+        entry = self.pending.get(key)
+        if entry is None:
+            entry = self.pending[key] = [msg.fragments, {}, now]
+        elif entry[0] != msg.fragments:
+            return None  # does not match the frame's other fragments
+        entry[1][msg.fragment] = msg.data
+        if len(entry[1]) < entry[0]:
+            return None
+        del self.pending[key]
+        self.completed += 1
+        # Older frames of this sender can no longer be shown in order
+        for older in [k for k in self.pending
+                      if k[0] == sender and 0 < (msg.frame_id - k[1]) % FRAME_ID_MOD < FRAME_ID_MOD // 2]:
+            del self.pending[older]
+            self.dropped += 1
+        return b''.join(entry[1][i] for i in range(entry[0]))
+
+    def expire(self, now: float):
+        for key in [k for k, entry in self.pending.items() if now - entry[2] > self.timeout]:
+            del self.pending[key]
+            self.dropped += 1
+
+    def forget(self, sender):
+        for key in [k for k in self.pending if k[0] == sender]:
+            del self.pending[key]
+
+
+# --- login handshake ---
+# The client sends "<name> wire=bin1 codecs=<audio codecs it can decode>";
+# usernames cannot contain spaces. The server answers
+# "OK wire=bin1 sid=<session id> codec=<audio codec to send>" if it accepts, or
+# a plain "OK" (pickle). Legacy clients send a bare name and get a bare "OK".
+
+def _parse_options(tokens) -> dict:
+    options = {}
+    for token in tokens:
+        key, _, value = token.partition('=')
+        options[key] = value
+    return options
+
+
+def hello(name: str, wires=(WIRE_BINARY,), codecs=()) -> bytes:
+    text = f"{name} wire={','.join(wires)}"
+    if codecs:
+        text += f" codecs={','.join(codecs)}"
+    return text.encode()
+
+
+def parse_hello(data: bytes) -> tuple[str, dict]:
+    name, *tokens = data.decode().split(' ')
+    return name, _parse_options(tokens)
+
+
+def choose_wire(options: dict) -> str:
+    return WIRE_BINARY if WIRE_BINARY in options.get('wire', '').split(',') else WIRE_PICKLE
+
+
+def welcome(options: dict) -> bytes:
+    tokens = [OK] + [f"{key}={value}" for key, value in options.items()]
+    return ' '.join(tokens).encode()
+
+
+def parse_welcome(data: bytes) -> tuple[str, dict]:
+    """Return (status, options); status is the whole reply when the login was refused"""
+    text = data.decode()
+    status, *tokens = text.split(' ')
+    if status != OK:
+        return text, {}
+    return OK, _parse_options(tokens)
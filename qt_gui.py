@@ -4,9 +4,12 @@ import pyaudio
 import mss
 import numpy as np
 import sys
+import threading
 import time
-from PyQt6.QtCore import Qt, QThread, QTimer, QSize, QRunnable, pyqtSlot, QPropertyAnimation, QEasingCurve, QEvent
-from PyQt6.QtGui import QImage, QPixmap, QActionGroup, QIcon, QFont, QAction
+from collections import deque
+from PyQt6.QtCore import Qt, QThread, QTimer, QSize, QRunnable, pyqtSlot, QPropertyAnimation, QEasingCurve, QEvent, \
+    QObject, pyqtSignal, QRect
+from PyQt6.QtGui import QImage, QPixmap, QActionGroup, QIcon, QFont, QAction, QPainter, QPen, QColor
 from PyQt6.QtWidgets import QMainWindow, QVBoxLayout, QHBoxLayout, QGridLayout, QDockWidget \
     , QLabel, QWidget, QListWidget, QListWidgetItem, QMessageBox \
     , QComboBox, QTextEdit, QLineEdit, QPushButton, QFileDialog \
@@ -14,6 +17,11 @@ from PyQt6.QtWidgets import QMainWindow, QVBoxLayout, QHBoxLayout, QGridLayout,
     , QSpacerItem, QSizePolicy, QProgressBar, QMenuBar, QToolButton,QInputDialog,QApplication
 
 from constants import *
+from audio import AudioMixer
+from capture import VideoFrame
+from video import ChangeDetector, RateController, choose_layer, encode_frame
+from media_stats import media_clock
+from screen import ScreenDecoder, ScreenEncoder, capture_area, fit_within, is_delta
 
 # Screen capture integration from qijungu/screenshare
 ver = sys.version_info.major
@@ -30,7 +38,20 @@ else:
 
 # Camera
 CAMERA_RES = '240p'
+VIDEO_FPS = 30
+VIDEO_FPS_OPTIONS = (10, 15, 24, 30)
+VIDEO_BUDGET = 2000  # kbit/s for the camera stream, all simulcast layers together
+VIDEO_BUDGET_OPTIONS = (500, 1000, 2000, 4000, 8000)
 LAYOUT_RES = '900p'
+# Screen share
+SCREEN_FPS = 5  # capture rate while encoding keeps up (screen.ScreenPacer)
+SCREEN_SIZE = '1080p'
+SCREEN_SIZE_OPTIONS = {  # largest picture sent; bigger screens are scaled down
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+    '1440p': (2560, 1440),
+    'Native': None,
+}
 frame_size = {
     '240p': (352, 240),
     '360p': (480, 360),
@@ -39,6 +60,14 @@ frame_size = {
     '720p': (1080, 720),
     '900p': (1400, 900),
 }
+# Simulcast: the camera encodes each layer from the same capture with its own
+# rate controller; receivers pick one layer per sender (video.choose_layer)
+SIMULCAST_LAYERS = (  # (resolutions the layer's rate controller may pick, share of VIDEO_BUDGET)
+    (('240p',), 0.15),
+    (('360p', '480p'), 0.3),
+    (('560p', '720p'), 0.55),
+)
+ACTIVE_SPEAKER_HOLD = 3.0  # seconds a participant stays the active speaker after speaking
 FRAME_WIDTH = frame_size[CAMERA_RES][0]
 FRAME_HEIGHT = frame_size[CAMERA_RES][1]
 
@@ -55,11 +84,18 @@ NOCAM_FRAME = NOCAM_FRAME[y:y+FRAME_HEIGHT, x:x+FRAME_WIDTH]
 # frame for no microphone
 NOMIC_FRAME = cv2.imread("img/nomic.jpeg")
 
-# Audio
+# Audio (format constants live in constants.py)
 ENABLE_AUDIO = True
-SAMPLE_RATE = 48000
-BLOCK_SIZE = 2048
+PLAYOUT_BLOCK = 512  # samples per output callback (~11 ms)
+CAPTURE_BLOCK = 480  # samples per input callback (10 ms); re-cut into send frames
+MAX_QUEUED_FRAMES = 50  # captured frames kept for a stalled sender (~2 s)
+AUDIO_FRAME_SIZES = (960, 1920, BLOCK_SIZE, 3840)  # selectable send frames: 20, 40, 43, 80 ms
+VOLUME_LEVELS = (25, 50, 100, 150, 200)  # per-participant playback volume, percent
+
+VIDEO_TILE_STYLE = "border-radius: 12px; background-color: #313244;"
+SPEAKING_BORDER = " border: 2px solid #a6e3a1;"
 pa = pyaudio.PyAudio()
+mixer = AudioMixer()  # playout for every remote participant
 
 # Modern Stylesheet
 MODERN_STYLESHEET = """
@@ -202,67 +238,111 @@ class Worker(QRunnable):
 
 
 class Microphone:
-    def __init__(self):
+    """
+    Callback-driven capture. PortAudio hands over every device block on its own
+    thread; blocks are re-cut into frames of frame_samples and queued, so no
+    device samples are lost while the sender is busy. The frame size can be
+    changed at any time.
+    """
+    def __init__(self, frame_samples: int = BLOCK_SIZE):
+        self.frames = deque()
+        self.pending = bytearray()
+        self.ready = threading.Condition()
+        self.frame_samples = frame_samples
+        self.overflows = 0  # frames dropped because nobody collected them
         try:
             self.stream = pa.open(
                 rate=SAMPLE_RATE,
                 channels=1,
                 format=pyaudio.paInt16,
                 input=True,
-                frames_per_buffer=BLOCK_SIZE
+                frames_per_buffer=CAPTURE_BLOCK,
+                stream_callback=self.on_capture
             )
         except Exception as e:
             print(f"[ERROR] Microphone initialization failed: {e}")
             self.stream = None
 
-    def get_data(self):
+    def set_frame_samples(self, frame_samples: int):
+        with self.ready:
+            self.frame_samples = frame_samples
+
+    def on_capture(self, in_data, frame_count, time_info, status):
+        # Called on the PortAudio thread for every captured device block
+        with self.ready:
+            self.pending += in_data
+            size = self.frame_samples * 2
+            while len(self.pending) >= size:
+                if len(self.frames) >= MAX_QUEUED_FRAMES:
+                    self.frames.popleft()
+                    self.overflows += 1
+                self.frames.append(bytes(self.pending[:size]))
+                del self.pending[:size]
+            self.ready.notify()
+        return None, pyaudio.paContinue
+
+    def get_data(self, timeout: float = 0.5):
+        """Next captured frame, waiting for it if necessary; None if none arrives in time"""
         if self.stream is None:
+            time.sleep(timeout)
             return None
-        try:
-            return self.stream.read(BLOCK_SIZE)
-        except Exception as e:
-            print(f"[ERROR] Microphone read failed: {e}")
-            return None
-
-
-class AudioThread(QThread):
-    def __init__(self, client, parent=None):
-        super().__init__(parent)
-        self.client = client
+        with self.ready:
+            if not self.frames:
+                self.ready.wait(timeout)
+            return self.frames.popleft() if self.frames else None
+
+    def flush(self):
+        """Drop captured audio nobody should hear, e.g. while muted"""
+        with self.ready:
+            self.frames.clear()
+            self.pending.clear()
+
+
+class AudioOutput:
+    """
+    The one output stream for all OTHER clients. The device pulls mixed samples
+    through the stream callback, so the device clock paces playout and no
+    per-participant stream or thread is needed.
+    """
+    def __init__(self, mixer: AudioMixer):
+        self.mixer = mixer
         try:
             self.stream = pa.open(
                 rate=SAMPLE_RATE,
                 channels=1,
                 format=pyaudio.paInt16,
                 output=True,
-                frames_per_buffer=BLOCK_SIZE
+                frames_per_buffer=PLAYOUT_BLOCK,
+                stream_callback=self.fill_output
             )
         except Exception as e:
             print(f"[ERROR] Audio output initialization failed: {e}")
             self.stream = None
-        self.connected = True
 
-    def run(self):
-        # This thread is for playing audio from OTHER clients, not our own microphone
-        while self.connected:
-            self.update_audio()
-            time.sleep(0.01)  # Small delay to prevent tight loop
-
-    def update_audio(self):
-        # Play audio data from this client (received from server)
-        if hasattr(self.client, 'audio_data') and self.client.audio_data is not None and self.stream is not None:
-            try:
-                self.stream.write(self.client.audio_data)
-                pass  # Audio playing
-            except Exception as e:
-                print(f"[ERROR] Audio playback failed for {self.client.name}: {e}")
-        else:
-            pass  # No audio data to play
+    def fill_output(self, in_data, frame_count, time_info, status):
+        # Called on the PortAudio thread whenever the device needs frame_count more samples
+        return self.mixer.read(frame_count).tobytes(), pyaudio.paContinue
+
+    def close(self):
+        if self.stream is None:
+            return
+        try:
+            self.stream.stop_stream()
+            self.stream.close()
+        except Exception as e:
+            print(f"[ERROR] Audio output close failed: {e}")
+        self.stream = None
 
 
 class Camera:
     def __init__(self):
         self.cap = None
+        self.rate_controls = [RateController([frame_size[res] for res in ladder], VIDEO_BUDGET * share,
+                                             VIDEO_FPS_OPTIONS) for ladder, share in SIMULCAST_LAYERS]
+        # One reference per layer: a layer not due on a capture must still see the change on its next one
+        self.change_detectors = [ChangeDetector() for _ in SIMULCAST_LAYERS]
+        self.layers = [0]  # simulcast layers some receiver wants; none when nobody watches
+        self.clock = None  # capture FrameClock, kept at the fastest layer's frame rate
         self.camera_detected = False
         self.error_logged = False
         
@@ -295,6 +375,11 @@ class Camera:
                             # Set camera properties for better performance
                             self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
                             self.cap.set(cv2.CAP_PROP_FPS, 30)
+                            # Ask for the top layer's size; the camera settles on what it supports
+                            width, height = frame_size[SIMULCAST_LAYERS[-1][0][-1]]
+                            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+                            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+                            self.limit_layers(int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) or test_frame.shape[0])
                             return
                         else:
                             cap.release()
@@ -307,33 +392,84 @@ class Camera:
             print("Camera not detected")
             self.error_logged = True
 
-    def get_frame(self):
+    def limit_layers(self, height: int):
+        """No upscaling: layers above the camera's height fall back to its largest size"""
+        sizes = [frame_size[res] for ladder, _ in SIMULCAST_LAYERS for res in ladder]
+        largest = max((size for size in sizes if size[1] <= height), default=sizes[0])
+        for rate, (ladder, _) in zip(self.rate_controls, SIMULCAST_LAYERS):
+            rate.set_ladder([frame_size[res] for res in ladder if frame_size[res][1] <= height] or [largest])
+
+    def set_layers(self, layers):
+        """Layers the server says receivers want; a receiver that switched gets a fresh frame"""
+        self.layers = sorted({layer for layer in layers if 0 <= layer < len(self.rate_controls)})
+        self.force_refresh()
+
+    def force_refresh(self):
+        """Send the next frame of every layer regardless of change"""
+        for detector in self.change_detectors:
+            detector.force_refresh()
+
+    def set_budget(self, kbps: float):
+        for rate, (_, share) in zip(self.rate_controls, SIMULCAST_LAYERS):
+            rate.set_budget(kbps * share)
+
+    def set_max_fps(self, fps: float):
+        for rate in self.rate_controls:
+            rate.set_max_fps(fps)
+
+    def on_report(self, reporter: str, layer: int, loss_rate: float, delay: float = None):
+        if 0 <= layer < len(self.rate_controls):
+            self.rate_controls[layer].on_report(reporter, loss_rate, delay)
+
+    def forget(self, reporter: str):
+        for rate in self.rate_controls:
+            rate.forget(reporter)
+
+    def capture(self):
+        """
+        Read the camera once; returns a VideoFrame with the RGB preview and a JPEG
+        packet per simulcast layer due, or no packets when the picture has not
+        changed enough to send.
+        """
         if not self.camera_detected or self.cap is None:
             return None
             
         try:
             ret, frame = self.cap.read()
-            if ret and frame is not None:
-                # Resize first for better performance
-                frame = cv2.resize(frame, frame_size[CAMERA_RES], interpolation=cv2.INTER_AREA)
-                
+            if not ret or frame is None:
+                return None
+            captured_at = media_clock()
+            now = time.monotonic()
+            layers = self.layers
+            if self.clock is not None:
+                fps = max(self.rate_controls[layer].fps for layer in layers or [-1])
+                if fps != self.clock.fps:
+                    self.clock.set_fps(fps)
+            # Resize first for better performance; each layer's rate controller picks its size
+            top = layers[-1] if layers else len(self.rate_controls) - 1
+            scaled = {top: cv2.resize(frame, self.rate_controls[top].size, interpolation=cv2.INTER_AREA)}
+            image = cv2.cvtColor(scaled[top], cv2.COLOR_BGR2RGB)
+            if not layers:
+                return VideoFrame(image, None, captured_at)  # nobody watches: preview only
+            packets = {}
+            for layer in layers:
+                rate = self.rate_controls[layer]
+                if not rate.due(now):
+                    continue  # this layer runs at a lower frame rate
+                if not self.change_detectors[layer].changed(scaled[top], now):
+                    continue  # static picture: no encode or send; receivers keep the last frame
+                if layer not in scaled:
+                    scaled[layer] = cv2.resize(frame, rate.size, interpolation=cv2.INTER_AREA)
                 if ENABLE_ENCODE:
-                    # Keep frame in BGR for JPEG encoding (cross-platform compatibility)
-                    encode_param = [cv2.IMWRITE_JPEG_QUALITY, 40]  # Very low quality to prevent truncation
-                    success, encoded_frame = cv2.imencode('.jpg', frame, encode_param)
-                    if success:
-                        # Return as bytes for network transmission
-                        return encoded_frame.tobytes()
-                    else:
-                        # Fallback: convert to RGB for display
-                        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                    # Encode from BGR for JPEG (cross-platform compatibility), within what can be sent
+                    packet = encode_frame(scaled[layer], rate, now)
                 else:
-                    # For unencoded frames, convert to RGB for display
-                    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            else:
-                return None
+                    packet = cv2.cvtColor(scaled[layer], cv2.COLOR_BGR2RGB)
+                if packet is not None:
+                    packets[layer] = packet
+            return VideoFrame(image, packets or None, captured_at)
         except Exception as e:
-            print(f"[ERROR] Camera get_frame error: {e}")
+            print(f"[ERROR] Camera capture error: {e}")
             return None
     
     def release(self):
@@ -352,23 +488,108 @@ class Camera:
 
 
 class ScreenCapturer:
+    """
+    Grabs what is being shared: a whole monitor or a region of one. The mode can
+    be changed while sharing; the next capture picks it up, and the encoder sends
+    a keyframe when the picture size changes.
+    """
     def __init__(self):
-        self.sct = mss.mss()
-        self.monitor = self.sct.monitors[1]  # main monitor
+        # Opened by each capture thread (one per session): mss handles belong to the thread that made them
+        self.local = threading.local()
+        self.area = (1, None)  # (mss monitor index, region on it or None), replaced whole
+        self.max_size = SCREEN_SIZE_OPTIONS[SCREEN_SIZE]
         print("[INFO] ScreenCapturer initialized with MSS backend")
 
+    @staticmethod
+    def monitors() -> list:
+        """The displays as mss reports them, read afresh so newly plugged-in ones show up"""
+        with mss.mss() as sct:
+            return sct.monitors[1:]
+
+    @staticmethod
+    def snapshot(monitor: int) -> np.ndarray:
+        """One BGR grab of a whole monitor, for picking a region"""
+        with mss.mss() as sct:
+            return cv2.cvtColor(np.array(sct.grab(sct.monitors[monitor])), cv2.COLOR_BGRA2BGR)
+
+    def set_monitor(self, monitor: int):
+        """Share all of a monitor (1 = the first); a region belongs to its monitor and is dropped"""
+        self.area = (monitor, None)
+
+    def set_region(self, region: tuple):
+        """(x, y, width, height) on the current monitor, in its pixels; None for the whole monitor"""
+        self.area = (self.area[0], region)
+
+    def set_max_size(self, size: tuple):
+        """(width, height) the picture is scaled down to fit, or None for native size"""
+        self.max_size = size
+
     def capture(self):
+        """The shared area as a BGR array within max_size; encoding is left to screen.ScreenEncoder"""
         try:
-            frame = np.array(self.sct.grab(self.monitor))
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
-            _, img_encoded = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), 80])
-            return img_encoded.tobytes()
+            sct = getattr(self.local, 'sct', None)
+            if sct is None:
+                sct = self.local.sct = mss.mss()
+            monitor, region = self.area
+            monitors = sct.monitors
+            if not 0 < monitor < len(monitors):
+                monitor, region = 1, None  # display unplugged
+            # Only the shared area is grabbed, so capture and encode cost follow its size
+            frame = np.array(sct.grab(capture_area(monitors[monitor], region)))
+            # Scale first: the colour conversion then runs on the smaller picture
+            return cv2.cvtColor(fit_within(frame, self.max_size), cv2.COLOR_BGRA2BGR)
         except Exception as e:
             print(f"[ERROR] MSS screen capture failed: {e}")
             return None
 
 
 
+class RegionDialog(QDialog):
+    """A snapshot of a monitor to drag the shared region on"""
+    MIN_REGION = 64  # pixels of the monitor per side
+
+    def __init__(self, snapshot: np.ndarray, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Drag the area to share")
+        h, w = snapshot.shape[:2]
+        self.scale = min(1.0, 960 / w, 600 / h)  # monitor pixels to dialog pixels
+        image = cv2.cvtColor(fit_within(snapshot, (round(w * self.scale), round(h * self.scale))), cv2.COLOR_BGR2RGB)
+        self.pixmap = QPixmap.fromImage(QImage(image.data, image.shape[1], image.shape[0], 3 * image.shape[1],
+                                               QImage.Format.Format_RGB888).copy())
+        self.setFixedSize(self.pixmap.size())
+        self.setCursor(Qt.CursorShape.CrossCursor)
+        self.origin = self.current = None
+        self.region = None  # (x, y, width, height) in monitor pixels once picked
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.drawPixmap(0, 0, self.pixmap)
+        if self.origin is not None:
+            painter.setPen(QPen(QColor("#89b4fa"), 2))
+            painter.drawRect(QRect(self.origin, self.current).normalized())
+
+    def mousePressEvent(self, event):
+        self.origin = self.current = event.position().toPoint()
+        self.update()
+
+    def mouseMoveEvent(self, event):
+        if self.origin is not None:
+            self.current = event.position().toPoint()
+            self.update()
+
+    def mouseReleaseEvent(self, event):
+        if self.origin is None:
+            return
+        rect = QRect(self.origin, event.position().toPoint()).normalized()
+        region = tuple(round(v / self.scale) for v in (rect.x(), rect.y(), rect.width(), rect.height()))
+        self.origin = None
+        if min(region[2:]) < self.MIN_REGION:
+            self.update()  # too small to be meant: pick again
+            return
+        self.region = region
+        self.accept()
+
+
 class VideoWidget(QWidget):
     def __init__(self, client, parent=None):
         super().__init__(parent)
@@ -379,7 +600,8 @@ class VideoWidget(QWidget):
         self.init_video()
 
     def init_ui(self):
-        self.setStyleSheet("border-radius: 12px; background-color: #313244;")
+        self.speaking_shown = False
+        self.setStyleSheet(VIDEO_TILE_STYLE)
         shadow = QGraphicsDropShadowEffect()
         shadow.setBlurRadius(10)
         shadow.setColor(Qt.GlobalColor.black)
@@ -400,6 +622,35 @@ class VideoWidget(QWidget):
         self.layout.addWidget(self.video_viewer)
         self.layout.addWidget(self.name_label)
         self.setLayout(self.layout)
+
+    def contextMenuEvent(self, event):
+        # Per-participant controls; they only affect what this device sees and hears
+        server_conn = getattr(self.window(), 'server_conn', None)
+        if self.client.current_device or (not ENABLE_AUDIO and server_conn is None):
+            return
+        menu = QMenu(self)
+        menu.setStyleSheet("QMenu { background-color: #313244; color: #cdd6f4; }")
+        if server_conn is not None:
+            # Under the server's last-N, a pinned camera stays in full video when others speak
+            pinned = self.client.name in server_conn.pinned_video
+            menu.addAction("Unpin Video" if pinned else "Pin Video",
+                           lambda: server_conn.pin_video(self.client.name, not pinned))
+        if not ENABLE_AUDIO:
+            menu.exec(event.globalPos())
+            return
+        muted = mixer.is_muted(self.client.name)
+        menu.addAction("Unmute" if muted else "Mute",
+                       lambda: mixer.set_muted(self.client.name, not muted))
+        volume_menu = menu.addMenu("Volume")
+        volume_group = QActionGroup(volume_menu)
+        current = mixer.get_gain(self.client.name)
+        for percent in VOLUME_LEVELS:
+            action = volume_group.addAction(f"{percent}%")
+            action.setCheckable(True)
+            action.setChecked(abs(current * 100 - percent) < 1)
+            action.triggered.connect(lambda checked, gain=percent / 100: mixer.set_gain(self.client.name, gain))
+            volume_menu.addAction(action)
+        menu.exec(event.globalPos())
     
     def init_video(self):
         # 30 FPS for better stability and performance
@@ -407,14 +658,14 @@ class VideoWidget(QWidget):
     
     def update_video(self):
         try:
-            frame = self.client.get_video()
+            frame = self.client.get_preview()
             
             # Video display for client
             
             # Handle different frame types with better cross-platform compatibility
             if frame is None:
                 frame = NOCAM_FRAME.copy()
-            elif isinstance(frame, (bytes, bytearray)):
+            elif isinstance(frame, (bytes, bytearray, memoryview)):
                 # Decode JPEG encoded frame (cross-platform format)
                 try:
                     frame_array = np.frombuffer(frame, np.uint8)
@@ -460,6 +711,12 @@ class VideoWidget(QWidget):
             # Resize frame to standard size
             frame = cv2.resize(frame, (FRAME_WIDTH, FRAME_HEIGHT), interpolation=cv2.INTER_AREA)
             
+            # Highlight the tile while this participant is speaking
+            speaking = getattr(self.client, 'speaking', False)
+            if speaking != self.speaking_shown:
+                self.speaking_shown = speaking
+                self.setStyleSheet(VIDEO_TILE_STYLE + (SPEAKING_BORDER if speaking else ""))
+
             # Add microphone indicator if audio is disabled
             if hasattr(self.client, 'microphone_enabled') and not self.client.microphone_enabled:
                 try:
@@ -490,13 +747,87 @@ class VideoWidget(QWidget):
                 pass  # If even the fallback fails, just skip this frame
 
 
+class ScreenRenderer(QObject):
+    """
+    Decodes the incoming screen share on its own thread. Every frame is applied
+    to the canvas in order (a keyframe makes the frames still queued before it
+    moot), then the canvas is converted once per place it is shown, straight to
+    an RGB image at that size. Frames that arrive meanwhile are rendered
+    together the next time round, so the GUI thread only swaps pixmaps.
+    """
+    frame_ready = pyqtSignal(object, object)  # QImage for the viewer, for the pop-out window (or None)
+    keyframe_wanted = pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self.decoder = ScreenDecoder()
+        self.pending = []  # (payload, frame number) not applied yet
+        self.targets = (None, None)  # (width, height) of the viewer and the pop-out; None where not shown
+        self.dirty = False  # targets changed: render again even without new frames
+        self.wakeup = threading.Condition()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def push(self, payload: bytes, seq: int = None):
+        with self.wakeup:
+            if not is_delta(payload):
+                self.pending.clear()
+            self.pending.append((payload, seq))
+            self.wakeup.notify()
+
+    def set_targets(self, viewer: QSize, popout: QSize = None):
+        with self.wakeup:
+            self.targets = tuple(None if size is None or size.isEmpty() else (size.width(), size.height())
+                                 for size in (viewer, popout))
+            self.dirty = True
+            self.wakeup.notify()
+
+    def reset(self):
+        """A new share: forget the picture"""
+        with self.wakeup:
+            self.pending.clear()
+            self.decoder = ScreenDecoder()
+
+    def run(self):
+        while True:
+            with self.wakeup:
+                self.wakeup.wait_for(lambda: self.pending or self.dirty)
+                pending, self.pending = self.pending, []
+                changed, self.dirty = self.dirty, False
+                decoder, targets = self.decoder, self.targets
+            try:
+                for payload, seq in pending:
+                    changed = decoder.decode(payload, seq) is not None or changed
+                if decoder.wants_keyframe():
+                    self.keyframe_wanted.emit()
+                if not changed or decoder.canvas is None:
+                    continue
+                images = [None if size is None else self.render(decoder.canvas, size) for size in targets]
+            except Exception as e:
+                print(f"[ScreenRenderer] Failed to render image: {e}")
+                continue
+            if decoder is self.decoder:
+                self.frame_ready.emit(*images)
+
+    @staticmethod
+    def render(canvas: np.ndarray, box: tuple) -> QImage:
+        """The canvas scaled to fit box, keeping its aspect ratio, as an RGB image"""
+        h, w = canvas.shape[:2]
+        scale = min(box[0] / w, box[1] / h)
+        size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        image = cv2.cvtColor(cv2.resize(canvas, size, interpolation=interpolation), cv2.COLOR_BGR2RGB)
+        return QImage(image.data, size[0], size[1], 3 * size[0], QImage.Format.Format_RGB888).copy()
+
+
 class ScreenShareWidget(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.presenter_name = ""
         self.maximized = False
         self.default_height = 300
-        self.last_image_bytes = None
+        self.screen_window = None
+        self.renderer = ScreenRenderer()  # the presenter's picture, decoded off the GUI thread
+        self.renderer.frame_ready.connect(self.on_frame)
 
         # Use size policy so layout controls width; we only control heights
         sp = QSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Fixed)
@@ -545,6 +876,18 @@ class ScreenShareWidget(QWidget):
         except Exception:
             pass
         super().resizeEvent(event)
+        self.update_render_targets()
+
+    def update_render_targets(self):
+        """Tell the renderer the sizes the picture is shown at"""
+        popout = self.screen_label.size() if self.screen_window is not None else None
+        self.renderer.set_targets(self.screen_viewer.size(), popout)
+
+    def on_frame(self, viewer_image, popout_image):
+        if viewer_image is not None:
+            self.screen_viewer.setPixmap(QPixmap.fromImage(viewer_image))
+        if popout_image is not None and self.screen_window is not None:
+            self.screen_label.setPixmap(QPixmap.fromImage(popout_image))
 
     def set_minimized_height(self, factor: float = 0.6):
         """Set widget's height to fraction of window height (default 60% for better visibility)."""
@@ -615,50 +958,24 @@ class ScreenShareWidget(QWidget):
         def reposition():
             margin = 15
             restore_btn.move(self.screen_window.width() - restore_btn.width() - margin, margin)
-        self.screen_window.resizeEvent = lambda e: reposition()
+        def on_resize(e):
+            reposition()
+            self.update_render_targets()
+        self.screen_window.resizeEvent = on_resize
 
         # Cleanup on close
         def on_close():
             self.screen_window = None
+            self.update_render_targets()
         self.screen_window.finished.connect(on_close)
 
-        # --- Show current image if available ---
-        if hasattr(self, "last_image_bytes") and self.last_image_bytes:
-            self._update_screen_window_image(self.last_image_bytes)
-
         # Show window
         self.screen_window.show()
         reposition()
         QApplication.processEvents()
 
-    def _update_screen_window_image(self, image_bytes: bytes):
-        """Continuously update the flexible screen window with latest frame."""
-        if not hasattr(self, "screen_window") or self.screen_window is None:
-            return
-        if not image_bytes:
-            return
-        try:
-            image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
-            if image is None:
-                return
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            h, w, ch = image.shape
-            q_img = QImage(image.data, w, h, ch * w, QImage.Format.Format_RGB888)
-            pixmap = QPixmap.fromImage(q_img)
-            pixmap = pixmap.scaled(
-                self.screen_window.width(),
-                self.screen_window.height(),
-                Qt.AspectRatioMode.KeepAspectRatio,
-                Qt.TransformationMode.SmoothTransformation
-            )
-            self.screen_label.setPixmap(pixmap)
-        except Exception as e:
-            print(f"[Screen Window Update Error] {e}")
-
-
-
-    def show_share(self, presenter_name, image_bytes, is_presenter=False):
-        """Render the shared screen (safe, idempotent)."""
+    def show_share(self, presenter_name, image_bytes, is_presenter=False, seq=None):
+        """Render the shared screen (safe, idempotent); image_bytes is a keyframe or a delta numbered seq."""
         self.presenter_name = presenter_name
 
         # ensure minimized height on first show unless maximized state already set
@@ -690,37 +1007,17 @@ class ScreenShareWidget(QWidget):
         self.presenter_label.setText(f"Screen shared by: {presenter_name}")
 
         if image_bytes:
-            try:
-                image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
-                if image is not None:
-                    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                    h, w, ch = image.shape
-                    bytes_per_line = ch * w
-                    q_img = QImage(image.data, w, h, bytes_per_line, QImage.Format.Format_RGB888)
-                    pixmap = QPixmap.fromImage(q_img)
-                    pixmap = pixmap.scaled(
-                        self.screen_viewer.size(),
-                        Qt.AspectRatioMode.KeepAspectRatio,
-                        Qt.TransformationMode.SmoothTransformation
-                    )
-                    self.screen_viewer.setPixmap(pixmap)
-                    self.last_image_bytes = image_bytes
-                    # if fullscreen active, update that too
-                    # Update flexible screen window if open
-                    if hasattr(self, "screen_window") and self.screen_window is not None:
-                        self._update_screen_window_image(image_bytes)
-
-
-                    return
-            except Exception as e:
-                print(f"[ScreenShareWidget] Failed to render image: {e}")
+            self.renderer.push(image_bytes, seq)
+            return
 
         self.screen_viewer.setText("Waiting for screen data...")
-        self.last_image_bytes = None
+        self.renderer.reset()  # a new share
 
 
 
 class VideoListWidget(QListWidget):
+    screen_keyframe_wanted = pyqtSignal()  # the shared screen cannot be shown until a keyframe
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.all_items = {}
@@ -751,7 +1048,7 @@ class VideoListWidget(QListWidget):
         self.resize_widgets()
 
     
-    def add_screen_share(self, presenter_name, image_bytes, is_presenter=False):
+    def add_screen_share(self, presenter_name, image_bytes, is_presenter=False, seq=None):
         """
         Ensure only a single screen_share_widget is created and reused.
         Do NOT re-add multiple times to the layout — only show/hide/update.
@@ -760,6 +1057,7 @@ class VideoListWidget(QListWidget):
             # create only once
             if not self.screen_share_widget:
                 self.screen_share_widget = ScreenShareWidget(parent=self.parentWidget())
+                self.screen_share_widget.renderer.keyframe_wanted.connect(self.screen_keyframe_wanted)
                 # place widget at top of central layout if not already present
                 central_layout = self.parentWidget().layout()
                 if central_layout is not None and central_layout.indexOf(self.screen_share_widget) == -1:
@@ -767,7 +1065,7 @@ class VideoListWidget(QListWidget):
                     central_layout.insertWidget(0, self.screen_share_widget)
                 # make sure the widget does not get duplicated
             # just update content — do not re-parent or add again
-            self.screen_share_widget.show_share(presenter_name, image_bytes, is_presenter)
+            self.screen_share_widget.show_share(presenter_name, image_bytes, is_presenter, seq)
             self.screen_share_widget.show()
         except Exception as e:
             pass
@@ -779,7 +1077,7 @@ class VideoListWidget(QListWidget):
                 # simply hide; do not delete
                 self.screen_share_widget.hide()
                 # reset last image but keep object to avoid recreate loops
-                self.screen_share_widget.last_image_bytes = None
+                self.screen_share_widget.renderer.reset()
         except Exception as e:
             pass
 
@@ -1417,7 +1715,7 @@ class MainWindow(QMainWindow):
         super().__init__()
         self.client = client
         self.server_conn = server_conn
-        self.audio_threads = {}
+        self.audio_output = AudioOutput(mixer) if ENABLE_AUDIO else None
         self.screen_share_active = False
         self.other_sharing = False
         self.current_presenter = None
@@ -1453,6 +1751,7 @@ class MainWindow(QMainWindow):
         
         self.video_list_widget = VideoListWidget()
         self.central_layout.addWidget(self.video_list_widget)
+        self.video_list_widget.screen_keyframe_wanted.connect(self.server_conn.request_keyframe)
         
         self.sidebar = QDockWidget("Chat", self)
         self.sidebar.setFeatures(QDockWidget.DockWidgetFeature.NoDockWidgetFeatures)
@@ -1465,21 +1764,59 @@ class MainWindow(QMainWindow):
         self.chat_widget.share_button.clicked.connect(self.toggle_screen_share)
         self.chat_widget.end_button.clicked.connect(self.close)
 
-        self.screen_timer = QTimer()
-        self.screen_timer.timeout.connect(self.capture_and_send_screen)
-        self.screen_timer.setInterval(200)  # Improved screen sharing FPS (5 FPS -> ~5 FPS for better quality)
-        
+
         self.camera_menu = self.menuBar().addMenu("Camera")
         self.camera_menu.setStyleSheet("QMenu { background-color: #313244; color: #cdd6f4; }")
         self.microphone_menu = self.menuBar().addMenu("Microphone")
         self.microphone_menu.setStyleSheet("QMenu { background-color: #313244; color: #cdd6f4; }")
         self.layout_menu = self.menuBar().addMenu("Layout")
         self.layout_menu.setStyleSheet("QMenu { background-color: #313244; color: #cdd6f4; }")
+        self.screen_menu = self.menuBar().addMenu("Screen")
+        self.screen_menu.setStyleSheet("QMenu { background-color: #313244; color: #cdd6f4; }")
         
         self.camera_menu.addAction("Disable", self.toggle_camera)
         self.camera_menu.actions()[0].setIcon(QIcon('img/cam-disable.png'))
         self.microphone_menu.addAction("Disable", self.toggle_microphone)
         self.microphone_menu.actions()[0].setIcon(QIcon('img/mic-disable.png'))
+
+        # Capture rates, adjustable during the call
+        fps_menu = self.camera_menu.addMenu("Frame Rate")
+        fps_group = QActionGroup(self)
+        for fps in VIDEO_FPS_OPTIONS:
+            action = fps_group.addAction(f"{fps} fps")
+            action.setCheckable(True)
+            action.setChecked(fps == VIDEO_FPS)
+            action.triggered.connect(lambda checked, fps=fps: self.client.camera.set_max_fps(fps))
+            fps_menu.addAction(action)
+        budget_menu = self.camera_menu.addMenu("Bandwidth")
+        budget_group = QActionGroup(self)
+        for kbps in VIDEO_BUDGET_OPTIONS:
+            action = budget_group.addAction(f"{kbps / 1000:g} Mbit/s")
+            action.setCheckable(True)
+            action.setChecked(kbps == VIDEO_BUDGET)
+            action.triggered.connect(lambda checked, kbps=kbps: self.client.camera.set_budget(kbps))
+            budget_menu.addAction(action)
+        # What to share, changeable while sharing
+        self.monitor_menu = self.screen_menu.addMenu("Monitor")
+        self.monitor_menu.aboutToShow.connect(self.populate_monitor_menu)
+        self.screen_menu.addAction("Select Region...", self.select_screen_region)
+        self.screen_menu.addAction("Whole Monitor", lambda: self.client.screen_capturer.set_region(None))
+        size_menu = self.screen_menu.addMenu("Max Resolution")
+        size_group = QActionGroup(self)
+        for label, size in SCREEN_SIZE_OPTIONS.items():
+            action = size_group.addAction(label)
+            action.setCheckable(True)
+            action.setChecked(label == SCREEN_SIZE)
+            action.triggered.connect(lambda checked, size=size: self.client.screen_capturer.set_max_size(size))
+            size_menu.addAction(action)
+        frame_menu = self.microphone_menu.addMenu("Frame Size")
+        frame_group = QActionGroup(self)
+        for samples in AUDIO_FRAME_SIZES:
+            action = frame_group.addAction(f"{samples * 1000 / SAMPLE_RATE:.0f} ms")
+            action.setCheckable(True)
+            action.setChecked(samples == BLOCK_SIZE)
+            action.triggered.connect(lambda checked, samples=samples: self.set_audio_frame(samples))
+            frame_menu.addAction(action)
         
         self.layout_actions = {}
         layout_action_group = QActionGroup(self)
@@ -1497,6 +1834,11 @@ class MainWindow(QMainWindow):
         self.file_refresh_timer.timeout.connect(self.server_conn.request_file_list)
         self.file_refresh_timer.start(5000)  # 5 seconds
 
+        # Re-pick which remote cameras are on screen, and their simulcast layer, as tiles and speakers change
+        self.layer_timer = QTimer()
+        self.layer_timer.timeout.connect(self.update_video_layers)
+        self.layer_timer.start(1000)
+
             
         # === FILE TRANSFER SIGNAL CONNECTIONS ===
         self.server_conn.files_list_signal.connect(self.chat_widget.populate_download_menu)
@@ -1515,20 +1857,11 @@ class MainWindow(QMainWindow):
 
 
     
-    def capture_and_send_screen(self):
-        if not self.client.screen_sharing:
-            return
-        data = self.client.get_screen()
-        if data is not None:
-            msg = Message(self.client.name, POST, SCREEN, data)
-            self.server_conn.send_msg(self.server_conn.main_socket, msg)
-    
     def add_client(self, client):
         self.video_list_widget.add_client(client)
-        # Only create audio thread for OTHER clients, not for current user
+        # Only mix audio from OTHER clients, not from the current user
         if ENABLE_AUDIO and not client.current_device:
-            self.audio_threads[client.name] = AudioThread(client, self)
-            self.audio_threads[client.name].start()
+            mixer.add(client.name, client.jitter_buffer)
         if not client.current_device:
             self.chat_widget.add_client(client.name)
         # --- new join message ---
@@ -1537,10 +1870,8 @@ class MainWindow(QMainWindow):
 
     def remove_client(self, name: str):
         self.video_list_widget.remove_client(name)
-        if ENABLE_AUDIO and name in self.audio_threads:
-            self.audio_threads[name].connected = False
-            self.audio_threads[name].wait()
-            self.audio_threads.pop(name)
+        if ENABLE_AUDIO:
+            mixer.remove(name)
         self.chat_widget.remove_client(name)
         # --- new leave message ---
         leave_msg = f"🔴 {name} left the chat"
@@ -1586,6 +1917,8 @@ class MainWindow(QMainWindow):
         if self.client.camera_enabled:
             self.camera_menu.actions()[0].setText("Disable")
             self.camera_menu.actions()[0].setIcon(QIcon('img/cam-disable.png'))
+            # Receivers dropped our last frame when the camera went off; send a fresh one
+            self.client.camera.force_refresh()
         else:
             self.camera_menu.actions()[0].setText("Enable")
             self.camera_menu.actions()[0].setIcon(QIcon('img/cam-enable.png'))
@@ -1595,6 +1928,72 @@ class MainWindow(QMainWindow):
         self.server_conn.send_msg(self.server_conn.main_socket, msg)
 
 
+    def update_video_layers(self):
+        """
+        Subscribe to the remote cameras whose tile is on screen, and pick a layer
+        per tile: as tall as the tile, one up for the active speaker.
+        """
+        heights = [frame_size[ladder[-1]][1] for ladder, _ in SIMULCAST_LAYERS]
+        tiles = {item: self.video_list_widget.itemWidget(item).client
+                 for item in self.video_list_widget.all_items.values()}
+        remote = [c for c in tiles.values() if not c.current_device]
+        speaker = max(remote, key=lambda c: c.spoke_at, default=None)
+        if speaker is not None and time.monotonic() - speaker.spoke_at > ACTIVE_SPEAKER_HOLD:
+            speaker = None
+        shown = self.shown_video_tiles()
+        self.server_conn.subscribe_video(
+            {c.name: item in shown for item, c in tiles.items() if not c.current_device})
+        self.server_conn.select_video_layers(
+            {c.name: choose_layer(heights, FRAME_HEIGHT, c is speaker) for c in remote})
+
+    def shown_video_tiles(self) -> set:
+        """Tiles not scrolled out of view; none while minimized or watching only a full-screen share"""
+        popout = getattr(self.video_list_widget.screen_share_widget, 'screen_window', None)
+        if self.isMinimized() or not self.video_list_widget.isVisible() or (
+                popout is not None and popout.isVisible() and popout.isActiveWindow()
+                and (popout.isMaximized() or popout.isFullScreen())):
+            return set()
+        viewport = self.video_list_widget.viewport().rect()
+        return {item for item in self.video_list_widget.all_items.values()
+                if self.video_list_widget.visualItemRect(item).intersects(viewport)}
+
+    def changeEvent(self, event):
+        # Minimizing or restoring changes which tiles are on screen; do not wait for layer_timer
+        if event.type() == QEvent.Type.WindowStateChange and hasattr(self, 'layer_timer'):
+            self.update_video_layers()
+        super().changeEvent(event)
+
+    def populate_monitor_menu(self):
+        self.monitor_menu.clear()
+        capturer = self.client.screen_capturer
+        group = QActionGroup(self.monitor_menu)
+        try:
+            monitors = capturer.monitors()
+        except Exception as e:
+            print(f"[ERROR] Listing monitors failed: {e}")
+            return
+        for index, monitor in enumerate(monitors, 1):
+            action = group.addAction(f"Monitor {index} ({monitor['width']}x{monitor['height']})")
+            action.setCheckable(True)
+            action.setChecked(index == capturer.area[0])
+            action.triggered.connect(lambda checked, index=index: capturer.set_monitor(index))
+            self.monitor_menu.addAction(action)
+
+    def select_screen_region(self):
+        capturer = self.client.screen_capturer
+        try:
+            snapshot = capturer.snapshot(capturer.area[0])
+        except Exception as e:
+            print(f"[ERROR] Screen snapshot failed: {e}")
+            return
+        dialog = RegionDialog(snapshot, self)
+        if dialog.exec() and dialog.region is not None:
+            capturer.set_region(dialog.region)
+
+    def set_audio_frame(self, samples: int):
+        if self.client.microphone is not None:
+            self.client.microphone.set_frame_samples(samples)
+
     def toggle_microphone(self):
         self.client.microphone_enabled = not self.client.microphone_enabled
         if self.client.microphone_enabled:
@@ -1626,9 +2025,9 @@ class MainWindow(QMainWindow):
         if presenter_name == self.client.name:
             # You are the presenter
             self.video_list_widget.add_screen_share(presenter_name, b'', is_presenter=True)
+            self.client.screen_encoder = ScreenEncoder()  # starts with a keyframe
             self.client.screen_sharing = True
             self.screen_share_active = True
-            self.screen_timer.start()
             self.chat_widget.share_button.setText("Stop Screen Share")
             self.chat_widget.share_button.setEnabled(True)
             # Resize camera widgets to 240p when presenting
@@ -1643,14 +2042,14 @@ class MainWindow(QMainWindow):
             # Resize camera widgets to 240p when someone else is sharing
             self.video_list_widget.resize_widgets("240p")
 
-    def on_screen_update(self, image_bytes):
+    def on_screen_update(self, image_bytes, seq):
         if self.current_presenter:
             if not image_bytes:
                 # keep widget visible but show placeholder
                 self.video_list_widget.add_screen_share(self.current_presenter, b'', is_presenter=False)
                 return
             # forward bytes to the existing widget instance
-            self.video_list_widget.add_screen_share(self.current_presenter, image_bytes, is_presenter=False)
+            self.video_list_widget.add_screen_share(self.current_presenter, image_bytes, is_presenter=False, seq=seq)
 
 
 
@@ -1662,7 +2061,6 @@ class MainWindow(QMainWindow):
         if self.screen_share_active:
             # You stopped sharing
             self.client.screen_sharing = False
-            self.screen_timer.stop()
             self.screen_share_active = False
 
         # Reset sharing flags
@@ -0,0 +1,373 @@
+# screen.py
+"""
+Screen share codec, independent of the capture backend and the GUI.
+
+ScreenEncoder compares each captured frame with the previous one in TILE x
+TILE blocks and sends only what changed: rectangles of changed tiles in one
+delta packet. Nothing changed means nothing is sent. Each changed tile is
+classified first: text and UI (mostly flat runs of one colour) is coded
+losslessly, as a palette image when it has few enough colours, so it stays
+sharp, unless a JPEG of it comes out smaller; photographic tiles are coded
+as JPEG. A keyframe (the whole frame as
+a plain JPEG, which is also all that receivers predating deltas understand)
+goes out for the first frame, when the picture size changes, when more than
+KEYFRAME_CHANGED of the tiles changed, every KEYFRAME_INTERVAL, and when a
+receiver asks for one; its text tiles follow losslessly in the next delta.
+
+When most of the picture keeps changing with photographic content, a video
+is playing: the encoder switches to video mode, which scales frames down to
+VIDEO_MODE_SIZE and lets the sender capture at VIDEO_MODE_FPS.
+
+ScreenPacer sets the capture rate from how long frames take to encode and
+send, so a big or busy screen is shared at fewer frames per second instead
+of falling behind.
+
+ScreenDecoder keeps the receiver's canvas: keyframes replace it and deltas
+are painted onto it in order. Frames are numbered; the relay sends a slow
+receiver no deltas from the first one it could not take until the next
+keyframe. Should a delta still go missing, the decoder ignores deltas until
+a keyframe arrives and asks for one meanwhile.
+"""
+import struct
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from constants import *
+
+TILE = 64                   # pixels per side of the blocks compared between frames
+JPEG_QUALITY = 80
+KEYFRAME_INTERVAL = 5.0     # seconds between keyframes even on an unchanging screen
+KEYFRAME_MIN_INTERVAL = 1.0  # seconds between keyframes that receivers asked for
+KEYFRAME_RETRY = 1.0        # seconds between a receiver's keyframe requests
+KEYFRAME_CHANGED = 0.25     # share of tiles changing above which a keyframe is sent instead of a delta
+MIN_FPS = 1.0
+ENCODE_SHARE = 0.5          # of the frame interval that encoding and sending a frame may take
+FRAME_MOD = 1 << 32
+TEXT_FLATNESS = 0.5         # share of a tile's bytes equal to the pixel's left neighbour, above which it is text
+PNG_COMPRESSION = 1         # fastest zlib level; screen text compresses well even so
+VIDEO_MODE_SIZE = (1280, 720)
+VIDEO_MODE_FPS = 15
+VIDEO_MODE_CHANGED = 0.4    # share of tiles changing, nearly all photographic, that means a video is playing
+VIDEO_MODE_PHOTO = 0.8      # of those changed tiles
+VIDEO_MODE_FRAMES = 10      # frames in a row that must agree before the mode switches
+
+# How a region of a delta is coded
+JPEG, PNG, PALETTE = range(3)
+
+# width, height of the picture
+DELTA_HEADER = struct.Struct('>2sHH')
+# x, y, width, height, codec, data length of one changed rectangle
+REGION_HEADER = struct.Struct('>HHHHBI')
+
+
+def is_delta(payload) -> bool:
+    return bytes(payload[:2]) == SCREEN_DELTA_MAGIC
+
+
+def changed_tiles(frame: np.ndarray, previous: np.ndarray, tile: int = TILE) -> np.ndarray:
+    """Grid with one entry per tile, True where any pixel differs"""
+    h, w = frame.shape[:2]
+    row_bytes = frame[0].nbytes
+    tile_bytes = tile * row_bytes // w
+    # Compare in the widest words that split evenly into tiles: 8 bytes at a time for 1080p BGR
+    word = next(size for size in (8, 4, 2, 1) if row_bytes % size == 0 and tile_bytes % size == 0)
+    dtype = np.dtype(f'u{word}')
+    diff = (np.ascontiguousarray(frame).reshape(h, -1).view(dtype)
+            != np.ascontiguousarray(previous).reshape(h, -1).view(dtype))
+    rows = np.logical_or.reduceat(diff, np.arange(0, h, tile), axis=0)
+    return np.logical_or.reduceat(rows, np.arange(0, diff.shape[1], tile_bytes // word), axis=1)
+
+
+def changed_rects(grid: np.ndarray, merge_rows: bool = True) -> list[tuple]:
+    """Rectangles (row, col, rows, cols) of tiles covering the changed ones: runs along a row, merged down"""
+    rects = []
+    open_rects = {}  # (col, cols) -> index in rects of a rectangle ending on the previous row
+    for row, line in enumerate(grid):
+        padded = np.concatenate(([False], line, [False]))
+        edges = np.flatnonzero(padded[1:] != padded[:-1])
+        still_open = {}
+        for col, end in zip(edges[::2], edges[1::2]):
+            run = (int(col), int(end - col))
+            index = open_rects.get(run) if merge_rows else None
+            if index is None:
+                index = len(rects)
+                rects.append([row, run[0], 0, run[1]])
+            rects[index][2] += 1
+            still_open[run] = index
+        open_rects = still_open
+    return [tuple(rect) for rect in rects]
+
+
+def text_tiles(frame: np.ndarray, tiles: np.ndarray = None, tile: int = TILE) -> np.ndarray:
+    """
+    Grid with one entry per tile, True where the tile looks like text or UI
+    rather than a photo: most of its pixels repeat the one to their left.
+    Only the tiles where tiles is True are looked at; the rest are False.
+    """
+    h, w = frame.shape[:2]
+    flat = np.ascontiguousarray(frame).reshape(h, -1)
+    step = flat.shape[1] // w  # bytes per pixel
+    starts = np.append(np.arange(0, flat.shape[1], tile * step), flat.shape[1])
+    grid = np.zeros((-(-h // tile), len(starts) - 1), bool)
+    if tiles is None:
+        tiles = ~grid
+    for row, col, _, cols in changed_rects(tiles, merge_rows=False):
+        band = flat[row * tile:(row + 1) * tile, starts[col]:starts[col + cols]]
+        same = np.ones(band.shape, bool)
+        np.equal(band[:, step:], band[:, :-step], out=same[:, step:])
+        edges = starts[col:col + cols + 1] - starts[col]
+        counts = np.add.reduceat(np.count_nonzero(same, axis=0), edges[:-1])
+        grid[row, col:col + cols] = counts > TEXT_FLATNESS * np.diff(edges) * band.shape[0]
+    return grid
+
+
+def capture_area(monitor: dict, region: tuple = None) -> dict:
+    """
+    The rectangle to grab, in the mss format (left, top, width, height): the
+    monitor, or region (x, y, width, height relative to the monitor) clipped to it
+    """
+    if region is None:
+        return monitor
+    x, y, w, h = region
+    left, top = max(0, x), max(0, y)
+    width = min(monitor['width'], x + w) - left
+    height = min(monitor['height'], y + h) - top
+    if width <= 0 or height <= 0:
+        return monitor  # region off this monitor: share all of it
+    return {'left': monitor['left'] + left, 'top': monitor['top'] + top, 'width': width, 'height': height}
+
+
+def fit_within(frame: np.ndarray, max_size: tuple = None) -> np.ndarray:
+    """Downscale to fit max_size (width, height), keeping the aspect ratio; None for native size"""
+    if max_size is None:
+        return frame
+    h, w = frame.shape[:2]
+    scale = min(max_size[0] / w, max_size[1] / h)
+    if scale >= 1:
+        return frame
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+
+def encode_jpeg(image: np.ndarray, quality: int = JPEG_QUALITY) -> bytes:
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("JPEG encoding failed")
+    return encoded.tobytes()
+
+
+def encode_png(image: np.ndarray) -> bytes:
+    # Unfiltered: screen content compresses about as well, three times faster
+    ok, encoded = cv2.imencode('.png', image, [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION,
+                                               cv2.IMWRITE_PNG_FILTER, cv2.IMWRITE_PNG_FILTER_NONE])
+    if not ok:
+        raise ValueError("PNG encoding failed")
+    return encoded.tobytes()
+
+
+def encode_region(region: np.ndarray, text: bool, quality: int = JPEG_QUALITY) -> tuple:
+    """
+    (codec, data) for a BGR region: JPEG for photographic content; for text, a
+    palette of up to 256 colours and a PNG of indices into it, or a plain PNG
+    when there are more colours than that, unless the JPEG is smaller still
+    """
+    jpeg = encode_jpeg(region, quality)
+    if not text:
+        return JPEG, jpeg
+    # One 32-bit value per pixel (BGR plus opaque alpha); sorting them is much quicker than np.unique
+    packed = cv2.cvtColor(region, cv2.COLOR_BGR2BGRA).view(np.uint32)[..., 0]
+    values = np.sort(packed, axis=None)
+    colors = values[np.concatenate(([True], values[1:] != values[:-1]))]
+    if len(colors) > 256:
+        codec, data = PNG, encode_png(region)
+    else:
+        palette = colors.view(np.uint8).reshape(-1, 4)[:, :3]
+        indices = palette_indices(packed, colors)
+        codec, data = PALETTE, bytes([len(colors) - 1]) + palette.tobytes() + encode_png(indices)
+    return (codec, data) if len(data) <= len(jpeg) else (JPEG, jpeg)
+
+
+palette_tables = threading.local()
+
+
+def palette_indices(packed: np.ndarray, colors: np.ndarray) -> np.ndarray:
+    """Index into colors (sorted, at most 256) of each packed pixel; a lookup is three times quicker than searchsorted"""
+    table = getattr(palette_tables, 'table', None)
+    if table is None:
+        table = palette_tables.table = np.zeros(1 << 24, np.uint8)  # BGR -> index, one per thread
+    table[colors & 0xFFFFFF] = np.arange(len(colors))
+    return table[packed & 0xFFFFFF]
+
+
+def decode_region(codec: int, data) -> np.ndarray:
+    """The BGR region coded by encode_region; None if it cannot be decoded"""
+    if codec in (JPEG, PNG):
+        return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if codec != PALETTE or len(data) < 1:
+        return None
+    count = data[0] + 1
+    palette = np.frombuffer(data[1:1 + 3 * count], np.uint8).reshape(-1, 3)
+    indices = cv2.imdecode(np.frombuffer(data[1 + 3 * count:], np.uint8), cv2.IMREAD_UNCHANGED)
+    if len(palette) != count or indices is None or indices.ndim != 2 or indices.max() >= count:
+        return None
+    return palette[indices]
+
+
+class ScreenEncoder:
+    def __init__(self, quality: int = JPEG_QUALITY, tile: int = TILE):
+        self.quality = quality
+        self.tile = tile
+        self.previous = None  # last frame sent, BGR
+        self.seq = 0  # number of the last frame sent
+        self.last_keyframe = None
+        self.keyframe_requested = False
+        self.refine = False  # the text tiles of the last keyframe are still to be sent losslessly
+        self.video_mode = False
+        self.mode_frames = 0  # frames in a row that disagreed with the mode
+        self.keyframes_only = False  # for receivers that cannot apply deltas
+        self.keyframes = 0
+        self.deltas = 0
+        self.unchanged = 0
+
+    def request_keyframe(self):
+        """A receiver lost track; honoured at most every KEYFRAME_MIN_INTERVAL"""
+        self.keyframe_requested = True
+
+    def encode(self, frame: np.ndarray, now: float = None):
+        """
+        Returns (payload, frame number) for a BGR frame, or None when nothing
+        changed. The frame is kept as the reference: do not modify it afterwards.
+        """
+        if now is None:
+            now = time.monotonic()
+        if self.video_mode:
+            frame = fit_within(frame, VIDEO_MODE_SIZE)
+        since_key = None if self.last_keyframe is None else now - self.last_keyframe
+        keyframe = (self.previous is None or self.previous.shape != frame.shape
+                    or since_key >= KEYFRAME_INTERVAL
+                    or (self.keyframe_requested and since_key >= KEYFRAME_MIN_INTERVAL))
+        if not keyframe:
+            changed = changed_tiles(frame, self.previous, self.tile)
+            # A delta of much of the picture (scrolling, a new slide) is about as large as a keyframe, and slower
+            keyframe = self.keyframes_only or np.count_nonzero(changed) > KEYFRAME_CHANGED * changed.size
+            # Unchanged tiles are as in the last keyframe: its text tiles are the frame's
+            refine = self.refine and not keyframe
+            text = text_tiles(frame, None if refine else changed, self.tile)
+            grid = changed | text if refine else changed
+            self.detect_video(changed, text)
+            if not grid.any():
+                self.unchanged += 1
+                return None
+        if keyframe:
+            payload = encode_jpeg(frame, self.quality)
+            self.refine = not self.keyframes_only
+            self.last_keyframe = now
+            self.keyframe_requested = False
+            self.keyframes += 1
+        else:
+            payload = self.encode_delta(frame, grid, text)
+            self.refine = False
+            self.deltas += 1
+        self.previous = frame
+        self.seq = (self.seq + 1) % FRAME_MOD
+        return payload, self.seq
+
+    def detect_video(self, changed: np.ndarray, text: np.ndarray):
+        """Switch video mode once VIDEO_MODE_FRAMES frames in a row say so; it takes half the change to stay in it"""
+        count = np.count_nonzero(changed)
+        threshold = VIDEO_MODE_CHANGED / 2 if self.video_mode else VIDEO_MODE_CHANGED
+        video = (count > 0 and count >= threshold * changed.size
+                 and np.count_nonzero(changed & ~text) >= VIDEO_MODE_PHOTO * count)
+        self.mode_frames = self.mode_frames + 1 if video != self.video_mode else 0
+        if self.mode_frames >= VIDEO_MODE_FRAMES:
+            self.video_mode, self.mode_frames = video, 0
+
+    def encode_delta(self, frame: np.ndarray, grid: np.ndarray, text: np.ndarray) -> bytes:
+        """
+        The tiles in grid, as rectangles of photographic tiles and strips one
+        tile high of text, which fit a palette more often than large areas do
+        """
+        h, w = frame.shape[:2]
+        parts = [DELTA_HEADER.pack(SCREEN_DELTA_MAGIC, w, h)]
+        for is_text, tiles in ((True, grid & text), (False, grid & ~text)):
+            for row, col, rows, cols in changed_rects(tiles, merge_rows=not is_text):
+                y, x = row * self.tile, col * self.tile
+                region = frame[y:min(h, y + rows * self.tile), x:min(w, x + cols * self.tile)]
+                codec, data = encode_region(region, is_text, self.quality)
+                parts.append(REGION_HEADER.pack(x, y, region.shape[1], region.shape[0], codec, len(data)))
+                parts.append(data)
+        return b''.join(parts)
+
+
+class ScreenPacer:
+    """Capture rate for the screen share: as fast as max_fps allows while encoding keeps up"""
+
+    def __init__(self, max_fps: float, min_fps: float = MIN_FPS):
+        self.max_fps = max_fps
+        self.min_fps = min_fps
+        self.busy = None  # smoothed seconds spent per frame
+
+    def update(self, seconds: float) -> float:
+        """Record how long the last frame took; returns the frame rate to capture at"""
+        self.busy = seconds if self.busy is None else self.busy + 0.2 * (seconds - self.busy)
+        if self.busy <= 0:
+            return self.max_fps
+        return min(self.max_fps, max(self.min_fps, ENCODE_SHARE / self.busy))
+
+
+class ScreenDecoder:
+    def __init__(self):
+        self.canvas = None  # BGR picture as of frame self.seq
+        self.seq = None
+        self.lost = False  # missed a frame: waiting for a keyframe
+        self.requested_at = None
+
+    def decode(self, payload, seq: int = None) -> np.ndarray:
+        """Apply one frame; returns the updated canvas, or None if it could not be applied"""
+        if not is_delta(payload):
+            image = cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                return None
+            self.canvas, self.seq, self.lost = image, seq, False
+            return self.canvas
+        if (self.lost or self.canvas is None or seq is None or self.seq is None
+                or seq != (self.seq + 1) % FRAME_MOD):
+            self.lost = True
+            return None
+        try:
+            self.apply_delta(payload)
+        except (ValueError, struct.error) as e:
+            print(f"[WARNING] Bad screen delta: {e}")
+            self.lost = True
+            return None
+        self.seq = seq
+        return self.canvas
+
+    def apply_delta(self, payload):
+        view = memoryview(payload)
+        _, w, h = DELTA_HEADER.unpack_from(view)
+        if (h, w) != self.canvas.shape[:2]:
+            raise ValueError(f"delta for {w}x{h}, canvas is {self.canvas.shape[1]}x{self.canvas.shape[0]}")
+        offset = DELTA_HEADER.size
+        while offset < len(view):
+            x, y, rw, rh, codec, size = REGION_HEADER.unpack_from(view, offset)
+            offset += REGION_HEADER.size
+            region = decode_region(codec, view[offset:offset + size])
+            offset += size
+            if region is None or region.shape[:2] != (rh, rw) or x + rw > w or y + rh > h:
+                raise ValueError(f"bad region {rw}x{rh} at {x},{y}")
+            self.canvas[y:y + rh, x:x + rw] = region
+
+    def wants_keyframe(self, now: float = None) -> bool:
+        """True, at most every KEYFRAME_RETRY, while deltas cannot be applied"""
+        if not self.lost:
+            return False
+        if now is None:
+            now = time.monotonic()
+        if self.requested_at is not None and now - self.requested_at < KEYFRAME_RETRY:
+            return False
+        self.requested_at = now
+        return True
@@ -1,20 +1,57 @@
 # server.py
+import argparse
+import asyncio
 import socket
+import struct
 import threading
 import time
 import os
 import traceback
 import pickle
+from collections import deque
 from dataclasses import dataclass, field
 from constants import *
+import protocol
+from protocol import Encoded, WIRE_BINARY, WIRE_PICKLE
+from media_stats import MediaStats, SEQ_MOD, media_clock, stream_key
+from audio import ActiveSpeakers, ConferenceMixer, FRAME_MS, audio_level, is_comfort_noise
+from audio_codecs import AudioDecoder, AudioEncoder, choose_codec, choose_mix_codec
 
 IP = ''
 clients = {}
 current_presenter = None
+screen_keyframe_asked = None  # when the presenter was last asked for a keyframe
 video_conn = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 audio_conn = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+video_conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, MEDIA_RECV_BUFFER)
 media_conns = {VIDEO: video_conn, AUDIO: audio_conn}
 
+# Media relay tables: session id -> Client, and per media port, source address -> session id
+sessions = {}
+media_peers = {VIDEO: {}, AUDIO: {}}
+last_session_id = 0
+# Video fragments are relayed as they arrive; only legacy (pickle) receivers,
+# which cannot reassemble, get whole frames put back together here
+legacy_frames = protocol.Reassembler()
+# Loss, reordering, jitter and latency of every incoming media stream, per sender
+stream_stats = MediaStats()
+# Audio mixing mode (--audio mix): speakers feed audio_mixer, and every binary
+# client gets one mixed packet per frame interval instead of one per speaker.
+# Legacy (pickle) clients predate mixed audio and keep getting the relay.
+AUDIO_MIX = False
+audio_mixer = ConferenceMixer()
+mix_seq = 0
+mix_encoders = {}  # codec -> encoder of the shared mix for listeners who are not speaking
+# Audio codec offered first at login (--codec); None sends raw PCM
+AUDIO_CODEC = ADPCM_16K
+# Last-N forwarding (--last-n): each receiver gets full video of the N most
+# recent speakers plus the participants it pinned, and a thumbnail (one layer-0
+# frame every THUMBNAIL_INTERVAL) of everyone else. None forwards all video.
+VIDEO_LAST_N = None
+THUMBNAIL_INTERVAL = 2.0
+speakers = ActiveSpeakers()
+last_n_lock = threading.Lock()
+
 # Directory to store uploaded files
 DATA_DIR = "data"
 os.makedirs(DATA_DIR, exist_ok=True)
@@ -101,43 +138,483 @@ def valid_file(path: str) -> bool:
         return False
 
 
+# Outbound control-channel queue limits, in packets per client
+SEND_QUEUE_HIGH_WATER = 1024  # past this the client is disconnected as a slow consumer
+SEND_QUEUE_LOW_WATER = 256    # server-generated streams (file downloads) wait below this
+SCREEN_KEYFRAME_WAIT = 2.0    # seconds between keyframes asked of the presenter, which go to everyone
+
+class SendQueue:
+    """
+    Outbound queue for one client's control connection.
+    Screen frames are latest-wins: a new frame replaces one that is still waiting,
+    or with if_idle is dropped instead. Everything else (TEXT, FILE, control
+    messages) is never dropped.
+    """
+
+    def __init__(self):
+        self.items = deque()
+        self.cond = threading.Condition()
+        self.screen_slot = None  # queued [packet] of the pending screen frame
+        self.closed = False
+        self.dropped = 0
+        self.on_put = None  # wakeup hook for the asyncio writer task
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, packet: bytes, latest_only: bool = False, if_idle: bool = False) -> bool:
+        """Queue a packet; False when it was dropped"""
+        with self.cond:
+            if self.closed:
+                return False
+            if latest_only and self.screen_slot is not None:
+                self.dropped += 1
+                if if_idle:
+                    return False
+                self.screen_slot[0] = packet
+                return True
+            slot = [packet]
+            if latest_only:
+                self.screen_slot = slot
+            self.items.append(slot)
+            self.cond.notify_all()
+        if self.on_put is not None:
+            self.on_put()
+        return True
+
+    def get(self, block: bool = True):
+        """Return the next packet, or None once closed and drained (or empty when not blocking)"""
+        with self.cond:
+            while block and not self.items and not self.closed:
+                self.cond.wait()
+            if not self.items:
+                return None
+            slot = self.items.popleft()
+            if slot is self.screen_slot:
+                self.screen_slot = None
+            self.cond.notify_all()
+            return slot[0]
+
+    def wait_below(self, depth: int, timeout: float = 1.0):
+        """Block a producer until the queue has drained below depth"""
+        with self.cond:
+            self.cond.wait_for(lambda: len(self.items) < depth or self.closed, timeout)
+
+    def close(self, final: bytes = None, discard: bool = False):
+        """Stop accepting packets; optionally drop the backlog and queue one last packet"""
+        with self.cond:
+            if discard:
+                self.items.clear()
+                self.screen_slot = None
+            if final is not None and not self.closed:
+                self.items.append([final])
+            self.closed = True
+            self.cond.notify_all()
+        if self.on_put is not None:
+            self.on_put()
+
 @dataclass
 class Client:
     name: str
     main_conn: socket.socket
     connected: bool
     media_addrs: dict = field(default_factory=lambda: {VIDEO: None, AUDIO: None})
+    outbox: SendQueue = field(default_factory=SendQueue)
+    wire: str = WIRE_PICKLE  # negotiated at login
+    host: str = None  # peer IP of the control connection
+    session_id: int = 0
+    speaking: bool = False  # last audio packet was speech, not comfort noise
+    codec: str = None  # audio codec this client sends and decodes; None: raw PCM only
+    audio_decoder: AudioDecoder = field(default_factory=AudioDecoder)  # its incoming audio
+    mix_codec: str = None  # codec of the mixes it gets in mixing mode
+    mix_encoder: AudioEncoder = None  # its N-1 mix in mixing mode
+    video_layers: dict = field(default_factory=dict)  # sender name -> simulcast layer it receives (default 0)
+    unwatched: set = field(default_factory=set)  # senders whose video it does not render; gets none of it
+    wanted_layers: list = None  # layers of its own camera it was last told are watched
+    pinned: set = field(default_factory=set)  # senders it wants in full video whoever is speaking
+    thumbnailed: set = field(default_factory=set)  # senders it gets only thumbnails of (last-N)
+    thumbnail_frames: dict = field(default_factory=dict)  # sender -> (frame id, time) of its last thumbnail
+    screen_conn: any = None  # its screen-share connection; None: screen frames share main_conn
+    screen_outbox: SendQueue = None  # latest screen frame waiting for screen_conn, never more than one
+    screen_held: bool = False  # missed a screen delta; gets nothing more until the next keyframe
 
-    def send_msg(self, from_name: str, request: str, data_type: str = None, data: any = None):
-        msg = Message(from_name, request, data_type, data)
-        try:
-            if data_type in [VIDEO, AUDIO]:
-                addr = self.media_addrs.get(data_type, None)
-                if addr is None:
-                    return
-                # Use protocol 2 for better cross-platform compatibility
-                media_conns[data_type].sendto(pickle.dumps(msg, protocol=2), addr)
-            else:
-                self.main_conn.send_bytes(pickle.dumps(msg, protocol=2))
-        except (BrokenPipeError, ConnectionResetError, OSError) as e:
-            print(f"[{self.name}] [ERROR] Connection error: {e}")
+    @property
+    def queue_depth(self) -> int:
+        return len(self.outbox)
+
+    def send_msg(self, from_name: str, request: str, data_type: str = None, data: any = None, sender_id: int = None):
+        msg = Message(from_name, request, data_type, data, sender_id=sender_id)
+        self.send_packet(protocol.encode(msg, self.wire), data_type,
+                         latest_only=(request == POST and data_type == SCREEN))
+
+    def send_packet(self, packet: bytes, data_type: str = None, latest_only: bool = False,
+                    if_idle: bool = False) -> bool:
+        """Send an already serialized message; the same bytes may go to many clients"""
+        if data_type in [VIDEO, AUDIO]:
+            addr = self.media_addrs.get(data_type, None)
+            if addr is None:
+                return False
+            try:
+                media_conns[data_type].sendto(packet, addr)
+            except (BrokenPipeError, ConnectionResetError, OSError) as e:
+                print(f"[{self.name}] [ERROR] Connection error: {e}")
+                self.connected = False
+                return False
+            return True
+
+        # Control channel: queue for the writer so a slow socket never blocks the sender
+        queued = self.outbox.put(packet, latest_only, if_idle)
+        if self.connected and self.queue_depth > SEND_QUEUE_HIGH_WATER:
+            print(f"[{self.name}] [WARNING] {self.queue_depth} packets queued, disconnecting slow client")
             self.connected = False
+            self.outbox.close(discard=True)
+            try:
+                # Wakes the reader so the normal disconnect path runs
+                self.main_conn.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+        return queued
+
+    def wait_for_room(self):
+        self.outbox.wait_below(SEND_QUEUE_LOW_WATER)
+
+    def writer_loop(self, outbox: SendQueue = None, conn=None):
+        """Threaded engine: drain an outbox (the control one by default) onto its socket, then hang up"""
+        if outbox is None:
+            outbox, conn = self.outbox, self.main_conn
+        while True:
+            packet = outbox.get()
+            if packet is None:
+                break
+            try:
+                conn.send_bytes(packet)
+            except (BrokenPipeError, ConnectionResetError, OSError) as e:
+                print(f"[{self.name}] [ERROR] Connection error: {e}")
+                if outbox is self.outbox:
+                    self.connected = False
+                outbox.close(discard=True)
+                break
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def start_writer(self, outbox: SendQueue = None, conn=None):
+        threading.Thread(target=self.writer_loop, args=(outbox, conn), daemon=True).start()
+
+    def close(self):
+        """Send DISCONNECT after anything already queued; the writer closes the connection"""
+        self.outbox.close(final=protocol.encode(Message(SERVER, DISCONNECT), self.wire))
+
+def queue_depths() -> dict[str, int]:
+    """Outbound queue depth per connected client"""
+    return {name: client.queue_depth for name, client in tuple(clients.items())}
 
-def broadcast_msg(from_name: str, request: str, data_type: str = None, data: any = None):
+def broadcast_packet(from_name: str, encoded: Encoded, data_type: str = None, latest_only: bool = False):
     all_clients = tuple(clients.values())
     for client in all_clients:
         if client.name == from_name:
             continue
-        client.send_msg(from_name, request, data_type, data)
+        client.send_packet(encoded[client.wire], data_type, latest_only)
+
+def broadcast_msg(from_name: str, request: str, data_type: str = None, data: any = None, sender_id: int = None):
+    # Serialize once per wire format, fan out the same bytes
+    msg = Message(from_name, request, data_type, data, sender_id=sender_id)
+    broadcast_packet(from_name, Encoded(msg), data_type,
+                     latest_only=(request == POST and data_type == SCREEN))
 
 def multicast_msg(from_name: str, request: str, to_names: tuple[str], data_type: str = None, data: any = None):
     if not to_names:
         broadcast_msg(from_name, request, data_type, data)
         return
+    encoded = Encoded(Message(from_name, request, data_type, data))
+    latest_only = request == POST and data_type == SCREEN
     for name in to_names:
         if name not in clients:
             continue
-        clients[name].send_msg(from_name, request, data_type, data)
+        clients[name].send_packet(encoded[clients[name].wire], data_type, latest_only)
+
+def register_media_addr(media: str, msg_bytes: bytes, addr: tuple):
+    """Accept an ADD from an unknown address and map the address to its session"""
+    if protocol.is_binary(msg_bytes):
+        msg = protocol.decode(msg_bytes, payload=False)
+        client = sessions.get(msg.sender_id)
+    elif any(c.wire == WIRE_PICKLE and c.host == addr[0] for c in tuple(clients.values())):
+        # Only unpickle datagrams from hosts that logged in with the legacy format
+        msg = protocol.decode(msg_bytes, payload=False)
+        client = clients.get(msg.from_name)
+    else:
+        return
+    if msg.request != ADD or client is None or client.host != addr[0]:
+        return
+    old_addr = client.media_addrs.get(media)
+    if old_addr is not None:
+        media_peers[media].pop(old_addr, None)
+    client.media_addrs[media] = addr
+    media_peers[media][addr] = client.session_id
+
+def handle_media_packet(media: str, msg_bytes: bytes, addr: tuple):
+    """Register or relay a single datagram received on a media port"""
+    session_id = media_peers[media].get(addr)
+    try:
+        if session_id is None:
+            register_media_addr(media, msg_bytes, addr)
+            return
+        client = sessions.get(session_id)
+        if client is None:
+            return
+        if protocol.is_binary(msg_bytes):
+            # Relay on the header alone; audio is small and its (uncopied) payload
+            # tells speech from comfort noise
+            msg: Message = protocol.decode(msg_bytes, copy=False, payload=(media == AUDIO))
+            if msg.sender_id != session_id:
+                return
+            encoded = Encoded(None, WIRE_BINARY, msg_bytes, from_name=client.name)
+        else:
+            msg = protocol.decode(msg_bytes)
+            if msg.from_name != client.name:
+                return
+            msg.sender_id = session_id
+            encoded = Encoded(msg, WIRE_PICKLE, msg_bytes)
+    except (pickle.UnpicklingError, pickle.PickleError, EOFError, ValueError) as e:
+        print(f"[{addr}] [{media}] [ERROR] Decode error (packet size: {len(msg_bytes)}): {e}")
+        return
+    except Exception as e:
+        print(f"[{addr}] [{media}] [ERROR] Unexpected error: {e}")
+        return
+
+    if msg.request == POST and msg.data_type == media and msg.to_names is None:
+        stream_stats.record(client.name, stream_key(media, msg.layer), msg.seq, msg.timestamp)
+        if media == AUDIO:
+            client.speaking = not is_comfort_noise(msg.data)
+            if VIDEO_LAST_N is not None and speakers.update(client.name, speech_level(msg)):
+                update_last_n()
+        if media == AUDIO:
+            relay_audio_packet(client, msg, encoded)
+        else:
+            relay_video_packet(client, msg, msg_bytes, encoded)
+
+def attach_screen_conn(hello: bytes, conn, host: str) -> Client:
+    """
+    Accept a screen connection whose first packet is an ADD from a logged-in
+    binary client on the same host; it gets a fresh latest-wins outbox and an
+    ADD back once frames will flow on it. Returns None for anything else.
+    """
+    if not protocol.is_binary(hello):
+        return None
+    msg = protocol.decode(hello, allow_pickle=False)
+    client = sessions.get(msg.sender_id)
+    if msg.request != ADD or msg.data_type != SCREEN or client is None or client.host != host:
+        return None
+    if client.screen_outbox is not None:
+        detach_screen_conn(client, client.screen_outbox, client.screen_conn)  # reconnected
+    outbox = SendQueue()
+    outbox.put(protocol.encode(Message(SERVER, ADD, SCREEN)))
+    client.screen_conn, client.screen_outbox = conn, outbox
+    return client
+
+def detach_screen_conn(client: Client, outbox: SendQueue, conn):
+    """Close a screen connection; frames for the client go back on its control connection"""
+    if client.screen_outbox is outbox:
+        client.screen_conn = client.screen_outbox = None
+        client.screen_held = True  # a discarded delta would leave its picture broken
+    outbox.close(discard=True)
+    try:
+        conn.shutdown(socket.SHUT_RDWR)  # wakes its reader
+    except Exception:
+        pass
+
+def handle_screen_packet(client: Client, msg_bytes: bytes):
+    """One packet from a screen connection; relayed on the header alone"""
+    try:
+        msg = protocol.decode(msg_bytes, allow_pickle=False, copy=False)
+    except ValueError as e:
+        print(f"[{client.name}] [{SCREEN}] [ERROR] Decode error: {e}")
+        return
+    if msg.request == POST and msg.data_type == SCREEN and msg.sender_id == client.session_id:
+        relay_screen(client, Encoded(None, WIRE_BINARY, msg_bytes, from_name=client.name), msg.data)
+
+def relay_screen(client: Client, encoded: Encoded, payload):
+    """
+    The presenter's frame to everyone else, latest-wins: a keyframe replaces a
+    frame still waiting for a slow receiver rather than queueing behind it. A
+    delta cannot, since the receiver would miss the change the waiting frame
+    carried: the delta is dropped instead, and that receiver gets no more until
+    the next keyframe, which the presenter is asked for. Legacy receivers only
+    understand whole pictures and get the keyframes alone.
+    """
+    if client.name != current_presenter:
+        return
+    delta = isinstance(payload, (bytes, memoryview)) and payload[:2] == SCREEN_DELTA_MAGIC
+    held = False
+    for other in tuple(clients.values()):
+        if other is client or (delta and other.wire == WIRE_PICKLE):
+            continue
+        if delta and other.screen_held:
+            held = True
+            continue
+        outbox = other.screen_outbox
+        if outbox is not None:
+            queued = outbox.put(encoded[WIRE_BINARY], latest_only=True, if_idle=delta)
+        else:
+            queued = other.send_packet(encoded[other.wire], SCREEN, latest_only=True, if_idle=delta)
+        other.screen_held = delta and not queued
+        held = held or other.screen_held
+    if held:
+        request_screen_keyframe(client)
+
+def request_screen_keyframe(presenter: Client):
+    """Ask the presenter for a keyframe unless one was asked for within SCREEN_KEYFRAME_WAIT"""
+    global screen_keyframe_asked
+    now = time.monotonic()
+    # A legacy presenter sends only keyframes and would show the request as chat
+    if presenter.wire == WIRE_PICKLE or (screen_keyframe_asked is not None
+                                         and now - screen_keyframe_asked < SCREEN_KEYFRAME_WAIT):
+        return
+    screen_keyframe_asked = now
+    presenter.send_msg(SERVER, GET, SCREEN)
+
+def relay_video_packet(client: Client, msg: Message, msg_bytes: bytes, encoded: Encoded):
+    """
+    Forward a video packet untouched to the receivers that render this sender
+    and chose its simulcast layer. Legacy receivers cannot reassemble: they get
+    fragmented frames once complete.
+    """
+    legacy = []
+    for other in tuple(clients.values()):
+        if other is client or client.name in other.unwatched:
+            continue
+        if client.name in other.thumbnailed:
+            if msg.layer or not thumbnail_due(other, client.name, msg):
+                continue
+        elif msg.layer is not None and other.video_layers.get(client.name, 0) != msg.layer:
+            continue
+        if msg.fragments is not None and other.wire == WIRE_PICKLE:
+            legacy.append(other)
+            continue
+        other.send_packet(encoded[other.wire], VIDEO)
+    if not legacy:
+        return
+    frame = legacy_frames.push(client.name, protocol.decode(msg_bytes, copy=False))
+    if frame is None or len(frame) > MEDIA_SIZE[VIDEO] - 2000:
+        return  # incomplete, or too large for a legacy client's receive buffer
+    packet = protocol.encode(Message(client.name, POST, VIDEO, frame), WIRE_PICKLE)
+    for other in legacy:
+        other.send_packet(packet, VIDEO)
+
+def thumbnail_due(receiver: Client, sender: str, msg: Message) -> bool:
+    """Whether this packet is part of the one frame per THUMBNAIL_INTERVAL a thumbnail gets"""
+    frame_id, sent_at = receiver.thumbnail_frames.get(sender, (None, None))
+    if msg.frame_id is not None and msg.frame_id == frame_id:
+        return True  # rest of the frame being sent
+    now = time.monotonic()
+    if (sent_at is not None and now - sent_at < THUMBNAIL_INTERVAL) or msg.fragment:
+        return False  # a new thumbnail starts at a frame's first fragment
+    receiver.thumbnail_frames[sender] = (msg.frame_id, now)
+    return True
+
+def speech_level(msg: Message) -> float:
+    """Level of an audio packet in dBFS for the speaker order; None for comfort noise"""
+    if is_comfort_noise(msg.data):
+        return None
+    if msg.level is not None:
+        return -msg.level
+    if msg.codec is None:
+        return -audio_level(msg.data)
+    return -30.0  # coded audio from a client that sends no level: speech of average loudness
+
+def relay_audio_packet(client: Client, msg: Message, encoded: Encoded):
+    """
+    Relay one audio packet, or in mixing mode feed it to the mixer. Receivers that
+    cannot take it as is (no codec negotiated, or legacy clients in mixing mode)
+    get it decoded to raw PCM, decoded at most once.
+    """
+    pcm = None
+    if AUDIO_MIX and client.speaking:
+        # Silent speakers drop out of the mix after SPEAKER_IDLE
+        pcm = decode_audio(client, msg)
+        if pcm is not None:
+            audio_mixer.push(client.session_id, pcm.msg.data, msg.seq)
+    for other in tuple(clients.values()):
+        if other is client or (AUDIO_MIX and other.wire != WIRE_PICKLE):
+            continue
+        if msg.codec is None or other.codec is not None:
+            other.send_packet(encoded[other.wire], AUDIO)
+            continue
+        if pcm is None:
+            pcm = decode_audio(client, msg)
+            if pcm is None:
+                return
+        other.send_packet(pcm[other.wire], AUDIO)
+
+def decode_audio(client: Client, msg: Message) -> Encoded:
+    """The packet with its payload decoded to raw PCM, or None if it cannot be decoded"""
+    try:
+        data = msg.data if is_comfort_noise(msg.data) else client.audio_decoder.decode(msg.codec, msg.data).tobytes()
+    except (ValueError, struct.error) as e:
+        print(f"[{client.name}] [{AUDIO}] [ERROR] Cannot decode {msg.codec} packet: {e}")
+        return None
+    return Encoded(Message(client.name, POST, AUDIO, data, sender_id=client.session_id,
+                           seq=msg.seq, timestamp=msg.timestamp))
+
+def mix_audio() -> list:
+    """
+    Mixing mode: one frame interval of mixed audio for every binary client, as
+    (client, packet) pairs. Only mixes and codes, so it can run off the event loop.
+    """
+    global mix_seq
+    everyone, own = audio_mixer.mix()
+    if everyone is None:
+        return []
+    seq, timestamp = mix_seq, media_clock()
+    mix_seq = (mix_seq + 1) % SEQ_MOD
+    shared = {}  # codec -> packet
+    packets = []
+    for client in tuple(clients.values()):
+        if client.wire == WIRE_PICKLE:
+            continue
+        codec = client.mix_codec
+        pcm = own.get(client.session_id)
+        if pcm is None:
+            # Not speaking: the full mix, encoded once per codec for all such listeners
+            if not everyone.any():
+                continue
+            if codec not in shared:
+                encoder = mix_encoders.setdefault(codec, AudioEncoder(codec))
+                shared[codec] = protocol.encode(Message(SERVER, POST, AUDIO, encoder.encode(everyone),
+                                                        seq=seq, timestamp=timestamp, codec=codec))
+            packets.append((client, shared[codec]))
+        elif pcm.any():
+            # Speaking: everyone but themselves (nothing to send if they are alone)
+            if client.mix_encoder is None:
+                client.mix_encoder = AudioEncoder(codec)
+            data = client.mix_encoder.encode(pcm)
+            packets.append((client, protocol.encode(Message(SERVER, POST, AUDIO, data, seq=seq, timestamp=timestamp,
+                                                            codec=codec))))
+    return packets
+
+def send_audio_mix(packets: list = None):
+    """Mixing mode: send one frame interval of mixed audio to every binary client"""
+    if packets is None:
+        packets = mix_audio()
+    for client, packet in packets:
+        client.send_packet(packet, AUDIO)
+
+def audio_mix_loop():
+    """Threaded engine: mix on a fixed frame clock, skipping ahead if a tick overruns"""
+    interval = FRAME_MS / 1000
+    deadline = time.monotonic()
+    while True:
+        deadline += interval
+        delay = deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            deadline = time.monotonic()
+        try:
+            send_audio_mix()
+        except Exception as e:
+            print(f"[{AUDIO}] [ERROR] Mixing failed: {e}")
 
 def media_server(media: str, port: int):
     conn = media_conns[media]
@@ -157,23 +634,8 @@ def media_server(media: str, port: int):
         except Exception as e:
             print(f"[{media}] Receive error: {e}")
             continue
-            
-        try:
-            msg: Message = pickle.loads(msg_bytes)
-        except (pickle.UnpicklingError, pickle.PickleError, EOFError, ValueError) as e:
-            print(f"[{addr}] [{media}] [ERROR] Pickle error (packet size: {len(msg_bytes)}): {e}")
-            continue
-        except Exception as e:
-            print(f"[{addr}] [{media}] [ERROR] Unexpected error: {e}")
-            continue
-            
-        if msg.request == ADD:
-            client = clients[msg.from_name]
-            client.media_addrs[media] = addr
-            pass  # Client registered
-        else:
-            pass  # Broadcasting media
-            broadcast_msg(msg.from_name, msg.request, msg.data_type, msg.data)
+
+        handle_media_packet(media, msg_bytes, addr)
 
 def ensure_files_index_for(recipient: str):
     if recipient not in files_index:
@@ -366,6 +828,7 @@ def handle_download_request(msg: Message, requester_name: str):
                 chunk = f.read(SIZE)
                 if not chunk:
                     break
+                clients[requester_name].wait_for_room()
                 clients[requester_name].send_msg(SERVER, FILE_CHUNK, FILE, chunk)
                 bytes_sent += len(chunk)
                 # small sleep to avoid flooding
@@ -382,96 +845,288 @@ def handle_download_request(msg: Message, requester_name: str):
     # send final None marker to indicate end
     clients[requester_name].send_msg(SERVER, FILE_CHUNK, FILE, None)
 
+def valid_video_choice(data, value_type) -> bool:
+    """A LAYER (value_type int), SUBSCRIBE or PIN (bool) payload: sender names to values"""
+    if not isinstance(data, dict):
+        return False
+    for sender, value in data.items():
+        if not isinstance(sender, str) or type(value) is not value_type:
+            return False
+        if value_type is int and value < 0:
+            return False
+    return True
+
+def select_video_layers(client: Client, layers: dict):
+    for sender, layer in layers.items():
+        client.video_layers[sender] = layer
+        if sender in clients:
+            send_wanted_layers(clients[sender], refresh=True)
+
+def subscribe_video(client: Client, senders: dict):
+    """Receiver starts (True) or stops (False) rendering the video of each sender"""
+    for sender, watched in senders.items():
+        if watched:
+            client.unwatched.discard(sender)
+        else:
+            client.unwatched.add(sender)
+        if sender in clients:
+            send_wanted_layers(clients[sender], refresh=bool(watched))
+
+def send_wanted_layers(sender: Client, refresh: bool = False):
+    """
+    Tell a sender which simulcast layers are watched; it encodes only those, none
+    if nobody watches. Each message also makes it send a fresh frame (refresh),
+    for a receiver that just switched layer or started watching.
+    """
+    if sender.wire == WIRE_PICKLE:
+        return  # legacy clients send one layer and would show the message as chat
+    wanted = sorted({0 if sender.name in c.thumbnailed else c.video_layers.get(sender.name, 0)
+                     for c in tuple(clients.values()) if c is not sender and sender.name not in c.unwatched})
+    if refresh or wanted != sender.wanted_layers:
+        sender.wanted_layers = wanted
+        sender.send_msg(SERVER, LAYER, data=wanted)
+
+def pin_video(client: Client, senders: dict):
+    """Receiver pins (True) or unpins (False) senders it wants in full video"""
+    for sender, pinned in senders.items():
+        if pinned:
+            client.pinned.add(sender)
+        else:
+            client.pinned.discard(sender)
+    update_last_n()
+
+def forwards_video(sender: Client, receiver: Client) -> bool:
+    """Last-N: full video of the N most recent speakers other than the receiver, and of those it pinned"""
+    if VIDEO_LAST_N is None or sender.name in receiver.pinned:
+        return True
+    rank = speakers.rank
+    position = rank.get(sender.name, 0)
+    # A receiver among the last N does not take up one of its own N places
+    return position < VIDEO_LAST_N or (position == VIDEO_LAST_N and rank.get(receiver.name, VIDEO_LAST_N) < VIDEO_LAST_N)
+
+def update_last_n():
+    """
+    Recompute whom each receiver gets only thumbnails of after the speaker order,
+    pins or the room changed. Receivers are told (they stop counting the gaps as
+    loss) and the senders concerned get a fresh frame and their wanted layers.
+    """
+    if VIDEO_LAST_N is None:
+        return
+    with last_n_lock:
+        everyone = tuple(clients.values())
+        changed = set()
+        for receiver in everyone:
+            thumbnailed = {s.name for s in everyone if s is not receiver and not forwards_video(s, receiver)}
+            if thumbnailed == receiver.thumbnailed:
+                continue
+            changed |= thumbnailed ^ receiver.thumbnailed
+            receiver.thumbnailed = thumbnailed
+            if receiver.wire != WIRE_PICKLE:
+                receiver.send_msg(SERVER, LAST_N, data=sorted(thumbnailed))
+    for name in changed:
+        if name in clients:
+            send_wanted_layers(clients[name], refresh=True)
+
 def disconnect_client(client: Client):
     global clients, current_presenter
     if current_presenter == client.name:
         current_presenter = None
         broadcast_msg(SERVER, STOP_SHARE, SCREEN)
+    for media, addr in client.media_addrs.items():
+        if addr is not None:
+            media_peers[media].pop(addr, None)
     client.media_addrs.update({VIDEO: None, AUDIO: None})
+    if sessions.get(client.session_id) is client:
+        sessions.pop(client.session_id)
+    stream_stats.forget(client.name)
+    audio_mixer.remove(client.session_id)
+    speakers.remove(client.name)
+    if client.screen_outbox is not None:
+        detach_screen_conn(client, client.screen_outbox, client.screen_conn)
     client.connected = False
     broadcast_msg(client.name, RM)
-    try:
-        client.main_conn.disconnect()
-    except Exception:
-        pass
+    client.close()
     try:
         clients.pop(client.name)
     except KeyError:
         pass
+    # Layers only this client watched can stop
+    update_last_n()
+    for sender in tuple(clients.values()):
+        send_wanted_layers(sender)
 
-def handle_main_conn(name: str):
+def new_session_id() -> int:
+    global last_session_id
+    while True:
+        last_session_id = last_session_id % 0xFFFF + 1
+        if last_session_id not in sessions:
+            return last_session_id
+
+def register_client(name: str, conn, options: dict, host: str) -> Client:
+    """Create the Client for a successful login; the caller replies with welcome_options"""
+    codec = choose_codec(options.get('codecs', ''), AUDIO_CODEC)
+    client = Client(name, conn, True, wire=protocol.choose_wire(options), host=host, session_id=new_session_id(),
+                    codec=codec, mix_codec=choose_mix_codec(codec, options.get('codecs', '')))
+    clients[name] = client
+    sessions[client.session_id] = client
+    speakers.add(name)
+    return client
+
+def welcome_options(client: Client) -> dict:
+    if client.wire == WIRE_PICKLE:
+        return {}
+    options = {'wire': client.wire, 'sid': client.session_id, 'screen': SCREEN_PORT}
+    if AUDIO_MIX:
+        options['audio'] = 'mix'
+    if client.codec is not None:
+        options['codec'] = client.codec
+    return options
+
+def greet_client(client: Client):
+    """Send the current member list to a new client and announce it to the rest"""
+    for other in tuple(clients.values()):
+        if other is client:
+            continue
+        client.send_msg(other.name, ADD, sender_id=other.session_id)
+    broadcast_msg(client.name, ADD, sender_id=client.session_id)
+    # Watches everyone until it says otherwise; last-N places the newcomer at the back
+    update_last_n()
+    for other in tuple(clients.values()):
+        send_wanted_layers(other, refresh=other is not client)
+
+def handle_client_msg(client: Client, msg: Message) -> bool:
+    """Act on one control-channel message. Returns False once the client should be dropped."""
     global current_presenter
+    name = client.name
+
+    if msg.request == DISCONNECT:
+        return False
+
+    # SCREEN sharing logic unchanged
+    elif msg.request == START_SHARE:
+        if current_presenter is None:
+            current_presenter = name
+            # send explicit start confirmation to the requester
+            clients[name].send_msg(SERVER, START_SHARE, SCREEN, data=name)
+            # broadcast to the rest that someone started sharing
+            broadcast_msg(SERVER, START_SHARE, SCREEN, data=name)
+        else:
+            # send rejection to requester only
+            clients[name].send_msg(SERVER, POST, TEXT, "Screen sharing already active by another user")
+
+    elif msg.request == STOP_SHARE:
+        if current_presenter == name:
+            current_presenter = None
+            broadcast_msg(SERVER, STOP_SHARE, SCREEN)
+        else:
+            clients[name].send_msg(SERVER, POST, TEXT, "You are not the current presenter")
+
+    # FILE transfer posted by a client (server stores it)
+    elif msg.request == POST and msg.data_type == FILE:
+        try:
+            handle_file_post(msg, name)
+        except Exception as e:
+            print(f"[ERROR] handle_file_post: {e}")
+            traceback.print_exc()
+
+    # Screen frame from a client without a screen connection
+    elif msg.request == POST and msg.data_type == SCREEN:
+        relay_screen(client, Encoded(msg), msg.data)
+
+    # Receiver lost track of the screen deltas: the presenter sends a keyframe
+    elif msg.request == GET and msg.data_type == SCREEN:
+        presenter = clients.get(current_presenter)
+        if presenter is not None and presenter is not client:
+            request_screen_keyframe(presenter)
+
+    # Receiver picks the simulcast layer it wants of each sender
+    elif msg.request == LAYER:
+        if valid_video_choice(msg.data, int):
+            select_video_layers(client, msg.data)
+        else:
+            print(f"[{name}] [WARNING] Malformed LAYER message dropped")
+
+    # Receiver starts or stops rendering some senders' video
+    elif msg.request == SUBSCRIBE:
+        if valid_video_choice(msg.data, bool):
+            subscribe_video(client, msg.data)
+        else:
+            print(f"[{name}] [WARNING] Malformed SUBSCRIBE message dropped")
+
+    # Receiver pins senders it wants in full video under last-N
+    elif msg.request == PIN:
+        if valid_video_choice(msg.data, bool):
+            pin_video(client, msg.data)
+        else:
+            print(f"[{name}] [WARNING] Malformed PIN message dropped")
+
+    # Client requests list of files available for them
+    elif msg.request == GET_FILES:
+        # msg.from_name is the requester
+        try:
+            send_file_list_to(name)
+        except Exception as e:
+            print(f"[ERROR] send_file_list_to: {e}")
+
+    # Client requests server to stream a particular file to them
+    elif msg.request == DOWNLOAD_FILE and msg.data_type == FILE:
+        try:
+            handle_download_request(msg, name)
+        except Exception as e:
+            print(f"[ERROR] handle_download_request: {e}")
+
+    else:
+        # default behavior: forward as multicast (text, video, audio, etc.)
+        multicast_msg(name, msg.request, msg.to_names, msg.data_type, msg.data)
+
+    return True
+
+def handle_main_conn(name: str):
     client: Client = clients[name]
     conn = client.main_conn
-    # Send list of existing clients to the new one
-    for client_name in clients:
-        if client_name == name:
-            continue
-        client.send_msg(client_name, ADD)
-    broadcast_msg(name, ADD)
+    greet_client(client)
 
     while client.connected:
         msg_bytes = conn.recv_bytes()
         if not msg_bytes:
             break
         try:
-            msg = pickle.loads(msg_bytes)
+            msg = protocol.decode(msg_bytes, allow_pickle=(client.wire == WIRE_PICKLE))
         except (pickle.UnpicklingError, pickle.PickleError, EOFError, ValueError) as e:
-            print(f"[{name}] [ERROR] Pickle error: {e}")
+            print(f"[{name}] [ERROR] Decode error: {e}")
             continue
 
-
-
-        if msg.request == DISCONNECT:
+        if not handle_client_msg(client, msg):
             break
 
-        # SCREEN sharing logic unchanged
-        elif msg.request == START_SHARE:
-            if current_presenter is None:
-                current_presenter = name
-                # send explicit start confirmation to the requester
-                clients[name].send_msg(SERVER, START_SHARE, SCREEN, data=name)
-                # broadcast to the rest that someone started sharing
-                broadcast_msg(SERVER, START_SHARE, SCREEN, data=name)
-            else:
-                # send rejection to requester only
-                clients[name].send_msg(SERVER, POST, TEXT, "Screen sharing already active by another user")
-
-        elif msg.request == STOP_SHARE:
-            if current_presenter == name:
-                current_presenter = None
-                broadcast_msg(SERVER, STOP_SHARE, SCREEN)
-            else:
-                clients[name].send_msg(SERVER, POST, TEXT, "You are not the current presenter")
-
-        # FILE transfer posted by a client (server stores it)
-        elif msg.request == POST and msg.data_type == FILE:
-            try:
-                handle_file_post(msg, name)
-            except Exception as e:
-                print(f"[ERROR] handle_file_post: {e}")
-                traceback.print_exc()
-
-        # Client requests list of files available for them
-        elif msg.request == GET_FILES:
-            # msg.from_name is the requester
-            try:
-                send_file_list_to(name)
-            except Exception as e:
-                print(f"[ERROR] send_file_list_to: {e}")
-
-        # Client requests server to stream a particular file to them
-        elif msg.request == DOWNLOAD_FILE and msg.data_type == FILE:
-            try:
-                handle_download_request(msg, name)
-            except Exception as e:
-                print(f"[ERROR] handle_download_request: {e}")
+    disconnect_client(client)
 
-        else:
-            # default behavior: forward as multicast (text, video, audio, etc.)
-            multicast_msg(name, msg.request, msg.to_names, msg.data_type, msg.data)
+def handle_screen_conn(conn: socket.socket, host: str):
+    """Threaded engine: a client's screen connection, frames in and the latest frames out"""
+    try:
+        client = attach_screen_conn(conn.recv_bytes(), conn, host)
+    except ValueError:
+        client = None
+    if client is None:
+        conn.close()
+        return
+    outbox = client.screen_outbox
+    client.start_writer(outbox, conn)
+    while client.connected and client.screen_outbox is outbox:
+        msg_bytes = conn.recv_bytes()
+        if not msg_bytes:
+            break
+        handle_screen_packet(client, msg_bytes)
+    detach_screen_conn(client, outbox, conn)
 
-    disconnect_client(client)
+def screen_server():
+    screen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    screen_socket.bind((IP, SCREEN_PORT))
+    screen_socket.listen()
+    print(f"[LISTENING] {SCREEN} Server is listening on {IP}:{SCREEN_PORT}")
+    while True:
+        conn, addr = screen_socket.accept()
+        threading.Thread(target=handle_screen_conn, args=(conn, addr[0]), daemon=True).start()
 
 def main_server():
     main_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -485,23 +1140,229 @@ def main_server():
     audio_server_thread = threading.Thread(target=media_server, args=(AUDIO, AUDIO_PORT))
     audio_server_thread.start()
 
+    threading.Thread(target=screen_server, daemon=True).start()
+
+    if AUDIO_MIX:
+        threading.Thread(target=audio_mix_loop, daemon=True).start()
+
     while True:
         conn, addr = main_socket.accept()
-        name = conn.recv_bytes().decode()
+        try:
+            name, options = protocol.parse_hello(conn.recv_bytes())
+        except UnicodeDecodeError:
+            conn.close()
+            continue
         if name in clients:
             conn.send_bytes("Username already taken".encode())
             continue
-        conn.send_bytes(OK.encode())
-        clients[name] = Client(name, conn, True)
+        # Register before replying so the client's media ADD cannot arrive first
+        client = register_client(name, conn, options, addr[0])
+        conn.send_bytes(protocol.welcome(welcome_options(client)))
+        client.start_writer()
         main_conn_thread = threading.Thread(target=handle_main_conn, args=(name,))
         main_conn_thread.start()
 
+# --- asyncio engine ---
+# A single event loop serves the TCP control channel and both UDP media ports.
+# The message handlers above are shared with the threaded engine; only the
+# transports differ, so the wire format is identical.
+
+class StreamConn:
+    """Socket-like wrapper so a Client and its writer task can drive an asyncio stream"""
+
+    def __init__(self, writer: asyncio.StreamWriter, loop: asyncio.AbstractEventLoop):
+        self.writer = writer
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+
+    def _call(self, fn, *args):
+        # Handlers run on the loop, except file downloads which run in an executor thread
+        if threading.get_ident() == self.loop_thread:
+            fn(*args)
+        elif not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(fn, *args)
+
+    def send_bytes(self, msg: bytes):
+        if self.writer.is_closing():
+            raise ConnectionResetError("stream is closing")
+        self._call(self.writer.write, struct.pack('>I', len(msg)) + msg)
+
+    def close(self):
+        try:
+            self._call(self.writer.close)
+        except Exception:
+            pass
+
+    def shutdown(self, how=None):
+        # Abort drops buffered output and wakes the reader, like socket.shutdown
+        self._call(self.writer.transport.abort)
+
+class MediaProtocol(asyncio.DatagramProtocol):
+    """Datagram endpoint for one media port; relays through handle_media_packet"""
+
+    def __init__(self, media: str):
+        self.media = media
+
+    def connection_made(self, transport):
+        # DatagramTransport.sendto has the same signature as socket.sendto
+        media_conns[self.media] = transport
+        if self.media == VIDEO:
+            transport.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, MEDIA_RECV_BUFFER)
+
+    def datagram_received(self, data: bytes, addr: tuple):
+        handle_media_packet(self.media, data, addr)
+
+    def error_received(self, exc: Exception):
+        print(f"[{self.media}] Network error: {exc}")
+
+async def read_frame(reader: asyncio.StreamReader) -> bytes:
+    raw_msglen = await reader.readexactly(4)
+    msglen = struct.unpack('>I', raw_msglen)[0]
+    return await reader.readexactly(msglen)
+
+async def stream_writer(client: Client, outbox: SendQueue = None, conn: StreamConn = None):
+    """Asyncio engine: drain an outbox (the control one by default) onto its stream, honouring backpressure"""
+    if outbox is None:
+        outbox, conn = client.outbox, client.main_conn
+    wakeup = asyncio.Event()
+    outbox.on_put = lambda: conn._call(wakeup.set)
+    while True:
+        packet = outbox.get(block=False)
+        if packet is None:
+            if outbox.closed:
+                break
+            await wakeup.wait()
+            wakeup.clear()
+            continue
+        try:
+            conn.send_bytes(packet)
+            await conn.writer.drain()
+        except (ConnectionError, OSError) as e:
+            print(f"[{client.name}] [ERROR] Connection error: {e}")
+            if outbox is client.outbox:
+                client.connected = False
+            outbox.close(discard=True)
+            break
+    conn.close()
+
+async def handle_stream(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    loop = asyncio.get_running_loop()
+    conn = StreamConn(writer, loop)
+    try:
+        name, options = protocol.parse_hello(await read_frame(reader))
+    except (asyncio.IncompleteReadError, ConnectionError, UnicodeDecodeError):
+        conn.close()
+        return
+    if name in clients:
+        conn.send_bytes("Username already taken".encode())
+        conn.close()
+        return
+    client = register_client(name, conn, options, writer.get_extra_info('peername')[0])
+    conn.send_bytes(protocol.welcome(welcome_options(client)))
+    writer_task = asyncio.create_task(stream_writer(client))
+    greet_client(client)
+
+    while client.connected:
+        try:
+            msg_bytes = await read_frame(reader)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            break
+        try:
+            msg = protocol.decode(msg_bytes, allow_pickle=(client.wire == WIRE_PICKLE))
+        except (pickle.UnpicklingError, pickle.PickleError, EOFError, ValueError) as e:
+            print(f"[{name}] [ERROR] Decode error: {e}")
+            continue
+
+        if msg.request == DOWNLOAD_FILE:
+            # File streaming reads from disk and paces itself with sleeps
+            keep = await loop.run_in_executor(None, handle_client_msg, client, msg)
+        else:
+            keep = handle_client_msg(client, msg)
+        if not keep:
+            break
+
+    disconnect_client(client)
+    await writer_task
+
+async def handle_screen_stream(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Asyncio engine: a client's screen connection, as handle_screen_conn"""
+    conn = StreamConn(writer, asyncio.get_running_loop())
+    try:
+        client = attach_screen_conn(await read_frame(reader), conn, writer.get_extra_info('peername')[0])
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        client = None
+    if client is None:
+        conn.close()
+        return
+    outbox = client.screen_outbox
+    writer_task = asyncio.create_task(stream_writer(client, outbox, conn))
+    while client.connected and client.screen_outbox is outbox:
+        try:
+            msg_bytes = await read_frame(reader)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            break
+        handle_screen_packet(client, msg_bytes)
+    detach_screen_conn(client, outbox, conn)
+    await writer_task
+
+async def async_audio_mix_loop():
+    """Asyncio engine: the same frame clock as audio_mix_loop, kept on the event loop"""
+    loop = asyncio.get_running_loop()
+    interval = FRAME_MS / 1000
+    deadline = loop.time()
+    while True:
+        deadline += interval
+        delay = deadline - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            deadline = loop.time()
+        try:
+            # Mixing and coding run in a worker so the loop keeps relaying; sending stays on the loop
+            send_audio_mix(await loop.run_in_executor(None, mix_audio))
+        except Exception as e:
+            print(f"[{AUDIO}] [ERROR] Mixing failed: {e}")
+
+async def async_main_server():
+    loop = asyncio.get_running_loop()
+    host = IP or '0.0.0.0'
+    for media, port in ((VIDEO, VIDEO_PORT), (AUDIO, AUDIO_PORT)):
+        await loop.create_datagram_endpoint(lambda media=media: MediaProtocol(media), local_addr=(host, port))
+        print(f"[LISTENING] {media} Server is listening on {IP}:{port}")
+
+    if AUDIO_MIX:
+        mix_task = asyncio.create_task(async_audio_mix_loop())
+
+    await asyncio.start_server(handle_screen_stream, host, SCREEN_PORT)
+    print(f"[LISTENING] {SCREEN} Server is listening on {IP}:{SCREEN_PORT}")
+
+    server = await asyncio.start_server(handle_stream, host, MAIN_PORT)
+    print(f"[LISTENING] Main Server (asyncio) is listening on {IP}:{MAIN_PORT}")
+    async with server:
+        await server.serve_forever()
+
 if __name__ == "__main__":
     try:
         # Clean up any leftover 0-byte files and duplicates from previous runs
         cleanup_empty_files()
         cleanup_duplicate_files()
-        main_server()
+        parser = argparse.ArgumentParser(description="LAN conferencing server")
+        parser.add_argument("--engine", choices=("threads", "asyncio"), default="threads",
+                            help="threads: one thread per client (default); asyncio: single event loop")
+        parser.add_argument("--audio", choices=("relay", "mix"), default="relay",
+                            help="relay: forward every speaker (default); mix: one mixed stream per listener")
+        parser.add_argument("--codec", choices=(ADPCM_16K, ADPCM, ULAW, ULAW_16K, "pcm"), default=AUDIO_CODEC,
+                            help="audio codec offered to clients at login (default: %(default)s)")
+        parser.add_argument("--last-n", type=int, default=None, metavar="N",
+                            help="forward full video of the N most recent speakers only, thumbnails of the rest")
+        args = parser.parse_args()
+        AUDIO_MIX = args.audio == "mix"
+        VIDEO_LAST_N = None if args.last_n is None else max(0, args.last_n)
+        AUDIO_CODEC = None if args.codec == "pcm" else args.codec
+        if args.engine == "asyncio":
+            asyncio.run(async_main_server())
+        else:
+            main_server()
     except KeyboardInterrupt:
         for client in list(clients.values()):
             disconnect_client(client)
@@ -0,0 +1,6 @@
+# tests/conftest.py
+"""Lets the tests import the modules at the repository root, wherever pytest is run from"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
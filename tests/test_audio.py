@@ -0,0 +1,81 @@
+# tests/test_audio.py
+import numpy as np
+
+from audio import FRAME_MS, MAX_CONCEALED, JitterBuffer, comfort_noise_payload
+from constants import *
+
+
+def frame(value: int) -> bytes:
+    return np.full(BLOCK_SIZE, value, np.int16).tobytes()
+
+
+def played(buffer: JitterBuffer, frames: int) -> list:
+    """The first sample of each frame read, which tells the frames apart"""
+    return [int(buffer.read(BLOCK_SIZE)[0]) for _ in range(frames)]
+
+
+def test_plays_in_order_after_prebuffering():
+    buffer = JitterBuffer()
+    buffer.push(frame(1), seq=0, arrival=0.0)
+    assert played(buffer, 1) == [0]  # still prebuffering
+    buffer.push(frame(2), seq=1, arrival=0.0)
+    buffer.push(frame(3), seq=2, arrival=0.0)
+    assert played(buffer, 3) == [1, 2, 3]
+    assert buffer.played == 3 and buffer.concealed == 0
+
+
+def test_reorders_packets():
+    buffer = JitterBuffer()
+    for seq in (1, 0, 3, 2):
+        buffer.push(frame(seq + 1), seq=seq, arrival=0.0)
+    assert played(buffer, 4) == [1, 2, 3, 4]
+
+
+def test_conceals_a_lost_packet_and_discards_it_late():
+    buffer = JitterBuffer()
+    for seq in (0, 1, 3):
+        buffer.push(frame(1000 * (seq + 1)), seq=seq, arrival=0.0)
+    first, second, concealed, fourth = (buffer.read(BLOCK_SIZE) for _ in range(4))
+    assert second[0] == 2000 and fourth[0] == 4000
+    assert 0 < concealed[-1] < concealed[0] <= 2000  # the last frame, fading
+    assert buffer.concealed == 1
+    buffer.push(frame(3000), seq=2, arrival=0.0)
+    assert buffer.late == 1
+
+
+def test_falls_silent_after_a_long_loss():
+    buffer = JitterBuffer()
+    for seq in range(2):
+        buffer.push(frame(1000), seq=seq, arrival=0.0)
+    samples = [buffer.read(BLOCK_SIZE) for _ in range(2 + MAX_CONCEALED + 1)]
+    assert buffer.underruns == 1
+    assert not samples[-1].any()
+
+
+def test_comfort_noise_is_not_an_underrun():
+    buffer = JitterBuffer()
+    for seq in range(2):
+        buffer.push(frame(1000), seq=seq, arrival=0.0)
+    buffer.push(comfort_noise_payload(-40), seq=2, arrival=0.0)
+    played(buffer, 6)
+    assert buffer.underruns == 0
+
+
+def test_jitter_deepens_the_buffer_and_trims_latency():
+    buffer = JitterBuffer()
+    arrival = 0.0
+    for seq in range(50):
+        arrival += FRAME_MS / 1000 * (3 if seq % 2 else 0.2)  # bursty arrivals
+        buffer.push(frame(1), seq=seq, arrival=arrival)
+    assert buffer.jitter > FRAME_MS / 2
+    assert buffer.target_depth > buffer.min_depth + 1
+    played(buffer, 1)
+    assert buffer.trimmed > 0 and buffer.depth <= buffer.target_depth
+
+
+def test_reads_any_number_of_samples():
+    buffer = JitterBuffer()
+    for seq in range(4):
+        buffer.push(frame(seq + 1), seq=seq, arrival=0.0)
+    samples = np.concatenate([buffer.read(n) for n in (100, BLOCK_SIZE, 3 * BLOCK_SIZE - 100)])
+    assert samples.tolist() == [1] * BLOCK_SIZE + [2] * BLOCK_SIZE + [3] * BLOCK_SIZE + [4] * BLOCK_SIZE
@@ -0,0 +1,136 @@
+# tests/test_audio_codecs.py
+import numpy as np
+import pytest
+
+from audio_codecs import (AdpcmState, AudioDecoder, AudioEncoder, Resampler, SUPPORTED, adpcm_decode,
+                          adpcm_encode, choose_codec, choose_mix_codec, clamped_cumsum, ulaw_decode, ulaw_encode)
+from constants import *
+
+
+def tone(n: int, freq: float = 440.0, rate: int = SAMPLE_RATE, amplitude: float = 10000) -> np.ndarray:
+    return (amplitude * np.sin(2 * np.pi * freq * np.arange(n) / rate)).astype(np.int16)
+
+
+def snr(reference: np.ndarray, decoded: np.ndarray) -> float:
+    """dB, at the lag (the resampling filters' delay) that lines the two up best"""
+    reference = reference.astype(np.float64)
+    decoded = decoded.astype(np.float64)
+    best = -np.inf
+    for lag in range(64):
+        a, b = reference[:len(reference) - lag], decoded[lag:lag + len(reference) - lag]
+        noise = np.sum((a - b) ** 2)
+        best = max(best, 10 * np.log10(np.sum(a ** 2) / max(noise, 1e-9)))
+    return best
+
+
+# --- mu-law ---
+
+def test_ulaw_codes_are_stable():
+    codes = np.arange(256, dtype=np.uint8).tobytes()
+    decoded = ulaw_decode(codes)
+    # 0x7F and 0xFF both mean zero; every other code decodes to a value that codes back to it
+    again = np.frombuffer(ulaw_encode(decoded), np.uint8)
+    assert np.array_equal(again[again != 0xFF], np.frombuffer(codes, np.uint8)[again != 0xFF])
+
+
+def test_ulaw_round_trip():
+    samples = tone(4800)
+    assert len(ulaw_encode(samples)) == len(samples)
+    assert snr(samples, ulaw_decode(ulaw_encode(samples))) > 30
+
+
+def test_ulaw_extremes_and_empty():
+    extremes = np.array([-32768, -32767, -1, 0, 1, 32767], np.int16)
+    assert ulaw_decode(ulaw_encode(extremes)).tolist() == [-32124, -32124, 0, 0, 0, 32124]  # clipped, not wrapped
+    assert ulaw_encode(np.zeros(0, np.int16)) == b''
+    assert len(ulaw_decode(b'')) == 0
+
+
+# --- IMA ADPCM ---
+
+@pytest.mark.parametrize("n", [0, 1, 2, 2047, 2048])
+def test_adpcm_keeps_the_sample_count(n):
+    assert len(adpcm_decode(adpcm_encode(tone(n), AdpcmState()))) == n
+
+
+def test_adpcm_round_trip():
+    samples = tone(4800)
+    assert snr(samples, adpcm_decode(adpcm_encode(samples, AdpcmState()))) > 20
+
+
+def test_adpcm_packets_decode_on_their_own():
+    samples = tone(3 * 1000)
+    state = AdpcmState()
+    packets = [adpcm_encode(samples[i:i + 1000], state) for i in range(0, len(samples), 1000)]
+    whole = adpcm_decode(adpcm_encode(samples, AdpcmState()))
+    # A lost packet does not desynchronize the next: each starts with the predictor state
+    assert np.array_equal(np.concatenate([adpcm_decode(p) for p in packets]), whole)
+    assert np.array_equal(adpcm_decode(packets[2]), whole[2000:])
+
+
+def test_adpcm_full_scale_does_not_wrap():
+    square = np.where(np.arange(4000) // 50 % 2, 32767, -32768).astype(np.int16)
+    decoded = adpcm_decode(adpcm_encode(square, AdpcmState()))
+    # The predictor slews for a few samples after each edge, then holds the rail
+    assert np.array_equal(decoded[-40:], square[-40:])
+
+
+def test_clamped_cumsum_matches_a_loop():
+    rng = np.random.default_rng(1)
+    for scale, start, low, high in ((10, 0, -100, 100), (1000, 50, 0, 88), (5, 0, -1000, 1000), (3, 0, 0, 0)):
+        steps = rng.integers(-scale, scale + 1, 500).astype(np.int32)
+        expected, value = [], start
+        for step in steps:
+            value = min(max(value + int(step), low), high)
+            expected.append(value)
+        assert clamped_cumsum(start, steps, low, high).tolist() == expected
+    assert len(clamped_cumsum(0, np.zeros(0, np.int32), 0, 1)) == 0
+
+
+# --- 16 kHz codecs and the streaming resampler ---
+
+def test_resampler_lengths_follow_the_stream():
+    resampler = Resampler()
+    down = [len(resampler.down(np.zeros(BLOCK_SIZE, np.int16))) for _ in range(3)]
+    assert sum(down) == 3 * BLOCK_SIZE // 3
+    assert len(Resampler().up(np.zeros(100, np.int16))) == 300
+
+
+@pytest.mark.parametrize("codec", [None, ULAW, ADPCM, ADPCM_16K, ULAW_16K])
+def test_codec_streams_round_trip(codec):
+    samples = tone(6 * BLOCK_SIZE, freq=1000)
+    encoder, decoder = AudioEncoder(codec), AudioDecoder()
+    blocks = [samples[i:i + BLOCK_SIZE] for i in range(0, len(samples), BLOCK_SIZE)]
+    decoded = np.concatenate([decoder.decode(codec, encoder.encode(block.tobytes())) for block in blocks])
+    assert len(decoded) == len(samples)
+    assert snr(samples[BLOCK_SIZE:], decoded[BLOCK_SIZE:]) > (60 if codec is None else 15)
+
+
+def test_16k_codecs_cut_what_16k_cannot_carry():
+    high = tone(6 * BLOCK_SIZE, freq=12000)
+    encoder, decoder = AudioEncoder(ULAW_16K), AudioDecoder()
+    decoded = np.concatenate([decoder.decode(ULAW_16K, encoder.encode(high[i:i + BLOCK_SIZE].tobytes()))
+                              for i in range(0, len(high), BLOCK_SIZE)])
+    assert np.abs(decoded[BLOCK_SIZE:]).max() < 0.1 * np.abs(high).max()
+
+
+def test_unknown_codec_is_refused():
+    with pytest.raises(ValueError):
+        AudioDecoder().decode('opus', b'')
+
+
+# --- negotiation ---
+
+def test_choose_codec():
+    assert choose_codec(','.join(SUPPORTED)) == ADPCM_16K
+    assert choose_codec(f'{ULAW},{ADPCM}') == ULAW
+    assert choose_codec(f'{ULAW},{ADPCM}', preferred=ADPCM) == ADPCM
+    assert choose_codec('opus') is None
+    assert choose_codec('') is None
+    assert choose_codec(','.join(SUPPORTED), preferred=None) is None
+
+
+def test_choose_mix_codec():
+    assert choose_mix_codec(ADPCM_16K, ','.join(SUPPORTED)) == ULAW_16K
+    assert choose_mix_codec(ADPCM, f'{ADPCM},{ULAW}') == ADPCM  # a client from before ulaw16k
+    assert choose_mix_codec(None, ','.join(SUPPORTED)) is None
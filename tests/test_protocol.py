@@ -0,0 +1,179 @@
+# tests/test_protocol.py
+import pickle
+
+import pytest
+
+import protocol
+from constants import *
+from protocol import (Encoded, ProtocolError, Reassembler, WIRE_BINARY, WIRE_PICKLE, FRAGMENT_TIMEOUT,
+                      split_fragments)
+
+FRAME_ID_LAST = protocol.FRAME_ID_MOD - 1
+
+
+def fragments(payload: bytes, frame_id: int = 1) -> list:
+    parts = split_fragments(payload)
+    return [Message('', POST, VIDEO, bytes(part), frame_id=frame_id, fragment=i, fragments=len(parts))
+            for i, part in enumerate(parts)]
+
+
+# --- encode / decode ---
+
+@pytest.mark.parametrize("data", [None, b'', b'\x00\xffraw', 'text é', {'layer': 1, 'names': ['a', 'b']}, [1, 2]])
+def test_binary_round_trip_payloads(data):
+    msg = Message('alice', POST, TEXT, data)
+    assert protocol.decode(protocol.encode(msg)) == msg
+
+
+def test_binary_round_trip_all_fields():
+    msg = Message('bob', POST, AUDIO, b'pcm', to_names=('alice', 'carol'), sender_id=7, seq=2 ** 32 - 1,
+                  timestamp=12345, codec=ADPCM_16K, frame_id=3, fragment=1, fragments=2, layer=2, level=127)
+    assert protocol.decode(protocol.encode(msg)) == msg
+
+
+def test_every_audio_codec_round_trips():
+    for codec in protocol.AUDIO_CODECS:
+        msg = Message('', POST, AUDIO, b'x', sender_id=1, seq=1, timestamp=0, codec=codec)
+        assert protocol.decode(protocol.encode(msg)).codec == codec
+
+
+def test_decode_without_copy_or_payload():
+    packet = protocol.encode(Message('alice', POST, SCREEN, b'frame', seq=4, timestamp=9))
+    view = protocol.decode(packet, copy=False).data
+    assert isinstance(view, memoryview) and bytes(view) == b'frame'
+    header = protocol.decode(packet, payload=False)
+    assert header.data is None and header.seq == 4 and header.from_name == 'alice'
+
+
+def test_pickle_wire_round_trip():
+    msg = Message('alice', POST, TEXT, 'hello', to_names=('bob',))
+    packet = protocol.encode(msg, WIRE_PICKLE)
+    assert not protocol.is_binary(packet)
+    assert protocol.decode(packet) == msg
+
+
+def test_pickle_refused_on_binary_connection():
+    packet = pickle.dumps(Message('mallory', POST, TEXT, 'hi'), protocol=2)
+    with pytest.raises(ProtocolError):
+        protocol.decode(packet, allow_pickle=False)
+
+
+def test_encode_rejects_unknown_values():
+    with pytest.raises(ProtocolError):
+        protocol.encode(Message('alice', 'BOGUS', TEXT, 'x'))
+    with pytest.raises(ProtocolError):
+        protocol.encode(Message('alice', POST, TEXT, object()))
+    with pytest.raises(ProtocolError):
+        protocol.encode(Message('alice', POST, VIDEO, b'', layer=256))
+
+
+def test_decode_rejects_malformed_packets():
+    packet = protocol.encode(Message('alice', POST, VIDEO, b'payload', seq=1, timestamp=1,
+                                     frame_id=1, fragment=0, fragments=2))
+    for bad in (packet[:protocol.HEADER.size - 1], packet[:-1], packet + b'x'):
+        with pytest.raises(ProtocolError):
+            protocol.decode(bad)
+    wrong_version = bytearray(packet)
+    wrong_version[2] = protocol.VERSION + 1
+    with pytest.raises(ProtocolError):
+        protocol.decode(bytes(wrong_version))
+
+
+def test_decode_rejects_bad_codec_and_fragment_index():
+    packet = bytearray(protocol.encode(Message('', POST, AUDIO, b'x', codec=ULAW)))
+    packet[protocol.HEADER.size] = len(protocol.AUDIO_CODECS)
+    with pytest.raises(ProtocolError):
+        protocol.decode(bytes(packet))
+    with pytest.raises(ProtocolError):
+        protocol.decode(protocol.encode(Message('', POST, VIDEO, b'x', frame_id=1, fragment=2, fragments=2)))
+
+
+def test_encoded_serializes_once_per_wire_and_transcodes():
+    msg = Message('alice', POST, TEXT, 'hi')
+    encoded = Encoded(msg)
+    assert encoded[WIRE_BINARY] is encoded[WIRE_BINARY]
+    assert protocol.decode(encoded[WIRE_PICKLE]) == msg
+    # A media packet that carries only the session id gets the sender's name for legacy receivers
+    packet = protocol.encode(Message('', POST, AUDIO, b'pcm', sender_id=3, seq=1, timestamp=0))
+    legacy = Encoded(None, WIRE_BINARY, packet, from_name='bob')[WIRE_PICKLE]
+    assert pickle.loads(legacy).from_name == 'bob'
+
+
+# --- fragmentation ---
+
+def test_split_fragments_sizes():
+    assert [bytes(part) for part in split_fragments(b'')] == [b'']
+    assert len(split_fragments(b'x' * FRAGMENT_SIZE)) == 1
+    parts = split_fragments(bytes(range(256)) * 10)
+    assert len(parts) == 3 and max(len(part) for part in parts) <= FRAGMENT_SIZE
+    assert b''.join(parts) == bytes(range(256)) * 10
+    with pytest.raises(ProtocolError):
+        split_fragments(b'x' * (FRAGMENT_SIZE * MAX_FRAGMENTS + 1))
+
+
+def test_reassembler_in_any_order():
+    payload = bytes(range(256)) * 20
+    parts = fragments(payload)
+    for order in (parts, parts[::-1]):
+        reassembler = Reassembler()
+        results = [reassembler.push('alice', msg, now=0.0) for msg in order]
+        assert results[:-1] == [None] * (len(parts) - 1)
+        assert results[-1] == payload
+        assert reassembler.completed == 1 and not reassembler.pending
+
+
+def test_reassembler_passes_unfragmented_payloads_through():
+    assert Reassembler().push('alice', Message('', POST, VIDEO, b'whole')) == b'whole'
+
+
+def test_reassembler_drops_a_frame_with_a_lost_fragment():
+    reassembler = Reassembler()
+    first, *_, last = fragments(b'x' * 3000)
+    assert reassembler.push('alice', first, now=0.0) is None
+    reassembler.expire(FRAGMENT_TIMEOUT + 0.01)
+    assert reassembler.dropped == 1
+    assert reassembler.push('alice', last, now=FRAGMENT_TIMEOUT + 0.02) is None
+
+
+def test_reassembler_drops_older_frames_once_a_newer_one_completes():
+    reassembler = Reassembler()
+    old = fragments(b'a' * 3000, frame_id=FRAME_ID_LAST)
+    new = fragments(b'b' * 100, frame_id=0)  # frame ids wrap
+    reassembler.push('alice', old[0], now=0.0)
+    reassembler.push('bob', fragments(b'c' * 3000, frame_id=0)[0], now=0.0)
+    assert reassembler.push('alice', new[0], now=0.0) == b'b' * 100
+    assert reassembler.dropped == 1
+    assert list(reassembler.pending) == [('bob', 0)]
+
+
+def test_reassembler_ignores_inconsistent_fragment_counts_and_forgets_senders():
+    reassembler = Reassembler()
+    parts = fragments(b'x' * 3000)
+    reassembler.push('alice', parts[0], now=0.0)
+    stray = Message('', POST, VIDEO, b'y', frame_id=1, fragment=1, fragments=len(parts) + 1)
+    assert reassembler.push('alice', stray, now=0.0) is None
+    reassembler.forget('alice')
+    assert not reassembler.pending
+
+
+# --- login handshake ---
+
+def test_hello_round_trip():
+    name, options = protocol.parse_hello(protocol.hello('alice', codecs=(ADPCM_16K, ULAW)))
+    assert name == 'alice'
+    assert options['codecs'] == f'{ADPCM_16K},{ULAW}'
+    assert protocol.choose_wire(options) == WIRE_BINARY
+
+
+def test_legacy_hello_gets_pickle():
+    name, options = protocol.parse_hello(b'carol')
+    assert name == 'carol' and options == {}
+    assert protocol.choose_wire(options) == WIRE_PICKLE
+    assert protocol.choose_wire({'wire': 'bin9'}) == WIRE_PICKLE
+
+
+def test_welcome_round_trip_and_refusal():
+    options = {'wire': WIRE_BINARY, 'sid': '5', 'codec': ADPCM}
+    assert protocol.parse_welcome(protocol.welcome(options)) == (OK, options)
+    assert protocol.parse_welcome(b'OK') == (OK, {})
+    assert protocol.parse_welcome(b'Username already taken') == ('Username already taken', {})
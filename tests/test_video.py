@@ -0,0 +1,113 @@
+# tests/test_video.py
+import pytest
+
+from video import (DELAY_RISE, LOSS_HIGH, PROBE_WAIT, QUALITY_HOLD, REPORT_INTERVAL, REPORT_TIMEOUT,
+                   TARGET_GROWTH, TARGET_MIN, RateController)
+
+LADDER = ((352, 240), (480, 360), (640, 480), (800, 560), (1080, 720))
+FPS_STEPS = (10, 15, 24, 30)
+
+
+def controller(budget_kbps: float = 8000, frame_bytes: int = 20000) -> RateController:
+    """A controller at its top settings, sending frame_bytes per frame"""
+    rate = RateController(LADDER, budget_kbps, FPS_STEPS)
+    rate.level, rate.quality = len(LADDER) - 1, 85
+    rate.on_frame(frame_bytes, now=0.0)
+    return rate
+
+
+def reports(rate: RateController, count: int, loss: float = 0.0, delay: float = 20, start: float = 1.0) -> float:
+    """count reports a REPORT_INTERVAL apart; returns the time of the last"""
+    now = start
+    for i in range(count):
+        now = start + i * REPORT_INTERVAL
+        rate.on_report("receiver", loss, delay, now=now)
+    return now
+
+
+def test_clean_reports_grow_the_target_up_to_the_budget():
+    rate = controller(budget_kbps=2000)
+    rate.target = TARGET_MIN
+    reports(rate, 20)
+    assert rate.target == 2000 * 1000
+
+
+def test_loss_cuts_to_what_got_through_and_steps_down_at_once():
+    rate = controller()
+    sent = rate.rate
+    rate.on_report("receiver", 0.8, now=1.0)
+    assert rate.ceiling == pytest.approx(sent * 0.2)
+    assert rate.target == rate.ceiling
+    assert rate.rate <= rate.target
+    assert (rate.level, rate.quality) < (len(LADDER) - 1, 85)
+
+
+def test_after_loss_the_target_settles_at_the_ceiling_before_probing():
+    rate = controller()
+    rate.on_report("receiver", 0.8, now=1.0)
+    ceiling = rate.ceiling
+    rate.target = ceiling / 2
+    reports(rate, 4, start=2.0)
+    assert ceiling * 0.9 < rate.target <= ceiling  # back fast, but not past it
+    reports(rate, PROBE_WAIT, start=6.0)
+    assert rate.target <= ceiling * TARGET_GROWTH  # then a small step past it
+
+
+def test_loss_while_probing_falls_back_to_the_ceiling():
+    rate = controller()
+    rate.on_report("receiver", 0.8, now=1.0)
+    ceiling = rate.ceiling
+    now = reports(rate, 2 * PROBE_WAIT, start=2.0)
+    assert rate.target > ceiling
+    ceiling = rate.ceiling
+    rate.on_report("receiver", LOSS_HIGH / 2, now=now + REPORT_INTERVAL)
+    assert rate.target == ceiling
+    assert rate.probes == -PROBE_WAIT
+
+
+def test_set_budget_steps_down_at_once():
+    rate = controller(frame_bytes=25000)
+    rate.set_budget(500)
+    assert rate.target == 500 * 1000
+    assert rate.rate <= rate.target
+
+
+def test_a_queue_building_up_stops_growth():
+    rate = controller()
+    rate.target = TARGET_MIN * 2
+    reports(rate, 3)
+    target = rate.target
+    reports(rate, 3, delay=20 + 2 * DELAY_RISE, start=4.0)
+    assert rate.target == target
+
+
+def test_serves_the_worst_receiver_until_its_reports_go_stale():
+    rate = controller()
+    rate.target = TARGET_MIN * 2
+    rate.on_report("slow", LOSS_HIGH / 2, now=1.0)
+    target = rate.target
+    reports(rate, 3, start=2.0)
+    assert rate.target == target
+    reports(rate, 3, start=2.0 + REPORT_TIMEOUT)
+    assert rate.target > target
+    rate.forget("receiver")
+    assert list(rate.reports) == ["slow"]
+
+
+def test_reports_update_the_target_once_per_interval():
+    rate = controller()
+    rate.target = TARGET_MIN * 2
+    rate.on_report("a", 0.0, now=1.0)
+    target = rate.target
+    rate.on_report("b", 0.0, now=1.0 + REPORT_INTERVAL / 4)
+    assert rate.target == target
+
+
+def test_frames_over_the_target_step_the_settings_down():
+    rate = controller()
+    rate.target = rate.rate / 2
+    settings = (rate.level, rate.quality, rate.fps)
+    rate.on_frame(20000, now=1.0)
+    assert (rate.level, rate.quality, rate.fps) != settings
+    rate.on_frame(20000, now=1.0 + QUALITY_HOLD / 2)  # holds while the estimate catches up
+    assert rate.last_change == 1.0
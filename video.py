@@ -0,0 +1,360 @@
+# video.py
+"""
+Webcam video processing, independent of the camera and the GUI.
+
+ChangeDetector decides per captured frame whether it is worth encoding and
+sending. It compares a small luma thumbnail of the frame with the last frame
+that was sent; when too few thumbnail pixels have changed (someone sitting
+still, a covered lens) the frame is skipped. A refresh frame still goes out
+every REFRESH_INTERVAL seconds so receivers that joined or lost packets catch
+up, and receivers simply keep showing the last frame in between.
+
+RateController picks the JPEG quality, resolution and frame rate of the
+frames that are sent, from their encoded sizes, receiver loss reports and a
+bandwidth budget, and keeps every frame within the size that can be sent.
+With simulcast the camera runs one per layer; choose_layer is the receiver's
+side, picking the layer each tile should get.
+"""
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from constants import *
+
+THUMBNAIL_STEP = 4      # sample every 4th pixel ...
+THUMBNAIL_POOL = 2      # ... then average 2x2 blocks of those to smooth sensor noise
+PIXEL_THRESHOLD = 10.0  # luma levels a thumbnail pixel must move to count as changed
+CHANGED_SHARE = 0.003   # share of changed thumbnail pixels that makes a frame new
+REFRESH_INTERVAL = 2.0  # seconds between frames sent even when nothing changed
+
+LUMA_WEIGHTS = np.array([0.114, 0.587, 0.299], np.float32)  # BGR
+
+
+def luma_thumbnail(frame: np.ndarray) -> np.ndarray:
+    """Downsampled luma of a BGR frame, as float32"""
+    sampled = frame[::THUMBNAIL_STEP, ::THUMBNAIL_STEP]
+    if sampled.ndim == 3:
+        luma = sampled[..., 0] * LUMA_WEIGHTS[0] + sampled[..., 1] * LUMA_WEIGHTS[1] + sampled[..., 2] * LUMA_WEIGHTS[2]
+    else:
+        luma = sampled.astype(np.float32)
+    h = luma.shape[0] // THUMBNAIL_POOL * THUMBNAIL_POOL
+    w = luma.shape[1] // THUMBNAIL_POOL * THUMBNAIL_POOL
+    pooled = sum(luma[i:h:THUMBNAIL_POOL, j:w:THUMBNAIL_POOL]
+                 for i in range(THUMBNAIL_POOL) for j in range(THUMBNAIL_POOL))
+    return pooled / THUMBNAIL_POOL ** 2
+
+
+class ChangeDetector:
+    def __init__(self, threshold: float = PIXEL_THRESHOLD, share: float = CHANGED_SHARE,
+                 refresh: float = REFRESH_INTERVAL):
+        self.threshold = threshold
+        self.share = share
+        self.refresh = refresh
+        self.reference = None  # thumbnail of the last frame sent
+        self.last_sent = None
+        self.sent = 0
+        self.suppressed = 0
+
+    def changed(self, frame: np.ndarray, now: float = None) -> bool:
+        """True if the frame should be encoded and sent; it then becomes the new reference"""
+        if now is None:
+            now = time.monotonic()
+        thumbnail = luma_thumbnail(frame)
+        send = (
+            self.reference is None
+            or self.reference.shape != thumbnail.shape  # resolution changed
+            or now - self.last_sent >= self.refresh
+            or np.count_nonzero(np.abs(thumbnail - self.reference) > self.threshold)
+               > self.share * thumbnail.size
+        )
+        if send:
+            self.reference = thumbnail
+            self.last_sent = now
+            self.sent += 1
+        else:
+            self.suppressed += 1
+        return send
+
+    def force_refresh(self):
+        """Send the next frame regardless, e.g. after the camera is re-enabled"""
+        self.reference = None
+
+
+# --- Rate control ---
+QUALITY_MIN = 20        # JPEG quality floor at the lowest resolution ...
+QUALITY_FLOOR = 35      # ... and above it, where dropping a resolution step looks better
+QUALITY_MAX = 85
+QUALITY_START = 40
+QUALITY_STEP = 5
+SIZE_SMOOTHING = 0.25   # weight of the newest frame in the bytes-per-frame estimate
+UNDERUSE = 0.7          # estimated rate below this share of the target: spend more
+QUALITY_HOLD = 0.25     # seconds between setting changes, for the estimate to follow
+ADAPT_HOLD = 2.0        # seconds between upward resolution or frame-rate steps
+REPORT_INTERVAL = 1.0   # seconds between receiver reports, and between target updates
+REPORT_TIMEOUT = 5.0    # reports older than this no longer count
+LOSS_HIGH = 0.10        # reported loss above this cuts the target ...
+LOSS_LOW = 0.02         # ... below this lets it grow back toward the budget
+TARGET_GROWTH = 1.08
+TARGET_RECOVERY = 0.5   # share of the way back to the ceiling per clean report
+RECOVERED = 0.95        # share of the ceiling that counts as back
+TARGET_PROBE = 1.5      # largest growth per clean report
+PROBE_WAIT = 5          # clean reports at the ceiling before probing past it again after loss
+DELAY_RISE = 40         # ms of one-way delay over a receiver's lowest that means a queue is building
+DELAY_FLOOR_DRIFT = 2   # ms per report the lowest delay creeps up, to follow a slower route
+RECOVERY_HOLD = 0.5     # seconds between upward steps while the target is over twice the rate
+TARGET_MIN = 100_000    # bit/s
+MAX_FRAME = FRAGMENT_SIZE * MAX_FRAGMENTS  # largest frame that can be fragmented
+PACKET_OVERHEAD = 512   # message header allowance inside the datagram limit
+MAX_PACKET = MEDIA_SIZE[VIDEO] - 2000 - PACKET_OVERHEAD  # largest unfragmented frame (pickle wire)
+FRAME_HEADROOM = 0.8    # single frames above this share of the limit back off at once
+FRAME_SLACK = 0.01      # seconds of capture timing jitter tolerated by due()
+
+
+class RateController:
+    """
+    Closed-loop rate control for one webcam stream.
+
+    The sender reports every encoded frame size; receivers report the loss
+    and one-way delay they see. Loss moves the target rate between TARGET_MIN
+    and the configured budget. Above LOSS_HIGH the target is cut to what got
+    through, which becomes the ceiling, and the settings follow at once. Clean
+    reports (no loss, no delay building up) bring the target halfway back to
+    the ceiling each, and raise the ceiling to the rate they saw; at the
+    ceiling it probes past it, growing faster with every clean report in a
+    row. Loss while probing falls back to the ceiling, and the next probe
+    waits PROBE_WAIT reports. Without a ceiling clean reports grow it by
+    TARGET_PROBE. Each frame, the smoothed bytes per frame times the frame
+    rate is compared with the target, and one knob moves:
+
+      over target   : quality down to its floor, then resolution, then frame rate
+      under target  : frame rate up, then resolution if it would still fit, then quality
+
+    Frames larger than max_frame (what fragmentation can carry, or one
+    datagram on the pickle wire) are re-encoded smaller via oversize(), so no
+    frame is dropped for size.
+    """
+
+    def __init__(self, ladder, budget_kbps: float, fps_steps, max_frame: int = MAX_FRAME):
+        self.lock = threading.Lock()
+        self.ladder = list(ladder)            # (width, height), smallest first
+        self.fps_steps = sorted(fps_steps)
+        self.max_frame = max_frame
+        self.level = 0
+        self.quality = QUALITY_START
+        self.max_fps = self.fps = self.fps_steps[-1]
+        self.next_frame = float('-inf')       # when this stream takes its next capture
+        self.frame_bytes = None               # smoothed encoded frame size
+        self.last_change = float('-inf')
+        self.last_step_up = float('-inf')
+        self.reports = {}                     # reporter -> (loss rate, delay ms or None, time)
+        self.delay_floor = {}                 # reporter -> lowest delay it reported
+        self.ceiling = None                   # highest rate known to get through since loss; None: no loss yet
+        self.probes = 0                       # clean reports in a row at the ceiling, negative while waiting
+        self.target_updated = float('-inf')
+        self.budget = self.target = budget_kbps * 1000
+
+    @property
+    def size(self) -> tuple:
+        return self.ladder[self.level]
+
+    @property
+    def rate(self) -> float:
+        """Estimated bit/s if every frame is sent"""
+        return (self.frame_bytes or 0) * 8 * self.fps
+
+    def set_budget(self, kbps: float):
+        with self.lock:
+            self.budget = kbps * 1000
+            self.target = min(self.budget, max(self.target, TARGET_MIN))
+            self._fit_target()
+
+    def set_ladder(self, ladder):
+        """Limit the resolutions, e.g. to what the camera delivers"""
+        with self.lock:
+            size = self.size
+            self.ladder = list(ladder)
+            self.level = max((i for i, s in enumerate(self.ladder) if s <= size), default=0)
+
+    def set_max_fps(self, fps: float):
+        with self.lock:
+            self.max_fps = fps
+            if self.fps > fps:
+                self._set_fps(fps)
+
+    def due(self, now: float) -> bool:
+        """Whether this stream takes the capture at now; paces it at its own frame rate"""
+        with self.lock:
+            if now < self.next_frame - FRAME_SLACK:
+                return False
+            interval = 1 / self.fps
+            base = self.next_frame if now - self.next_frame < interval else now
+            self.next_frame = base + interval
+            return True
+
+    def fits(self, size: int) -> bool:
+        return size <= self.max_frame
+
+    def on_report(self, reporter: str, loss_rate: float, delay: float = None, now: float = None):
+        """
+        A receiver's loss rate for this stream over its last report interval,
+        and its smoothed one-way delay in ms (None if it does not say)
+        """
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            self.reports[reporter] = (loss_rate, delay, now)
+            if delay is not None:
+                self.delay_floor[reporter] = min(delay, self.delay_floor.get(reporter, delay) + DELAY_FLOOR_DRIFT)
+            if now - self.target_updated < REPORT_INTERVAL / 2:
+                return
+            self.target_updated = now
+            # Without simulcast every receiver gets the same stream: serve the worst one
+            recent = [(r, l, d) for r, (l, d, t) in self.reports.items() if now - t < REPORT_TIMEOUT]
+            loss = max((l for _, l, _ in recent), default=0.0)
+            queued = any(d is not None and d - self.delay_floor[r] > DELAY_RISE for r, _, d in recent)
+            if loss > LOSS_HIGH:
+                self.ceiling = max(TARGET_MIN, self.rate * (1 - loss))  # what got through
+                self.probes = -PROBE_WAIT
+                self.target = max(TARGET_MIN, min(self.target * (1 - loss / 2), self.ceiling))
+                self._fit_target()
+            elif self.ceiling is None:
+                if loss == 0 and not queued:
+                    self.target = min(self.budget, self.target * TARGET_PROBE)
+                elif loss < LOSS_LOW and not queued:
+                    self.target = min(self.budget, self.target * TARGET_GROWTH)
+            elif loss > 0 or queued:
+                if self.target > self.ceiling:
+                    # The probe past the ceiling was too much: back to the last rate without loss
+                    self.target = self.ceiling
+                    self.probes = -PROBE_WAIT
+                    self._fit_target()
+            else:
+                self.ceiling = max(self.ceiling, min(self.rate, self.target))
+                if self.target < self.ceiling * RECOVERED:
+                    self.target += (self.ceiling - self.target) * TARGET_RECOVERY
+                else:
+                    self.probes += 1
+                    if self.probes > 0:
+                        growth = min(TARGET_PROBE, 1 + (TARGET_GROWTH - 1) * 2 ** (self.probes - 1))
+                        self.target = max(self.target, self.ceiling) * growth
+                if self.target >= self.budget:
+                    self.target, self.ceiling = self.budget, None
+
+    def forget(self, reporter: str):
+        with self.lock:
+            self.reports.pop(reporter, None)
+            self.delay_floor.pop(reporter, None)
+
+    def on_frame(self, size: int, now: float = None):
+        """Account for one encoded frame and pick the settings for the next"""
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            if self.frame_bytes is None:
+                self.frame_bytes = size
+            else:
+                self.frame_bytes += (size - self.frame_bytes) * SIZE_SMOOTHING
+            if size > self.max_frame * FRAME_HEADROOM:
+                self._step_down()
+            elif now - self.last_change < QUALITY_HOLD:
+                return  # let the estimate catch up with the last change
+            elif self.rate > self.target:
+                self._step_down()
+            elif self.rate < self.target * UNDERUSE:
+                self._step_up(now)
+            else:
+                return
+            self.last_change = now
+
+    def oversize(self, size: int) -> bool:
+        """An encoded frame was over max_frame: shrink for a re-encode. False if nothing is left to shrink."""
+        with self.lock:
+            self.frame_bytes = max(self.frame_bytes or 0, size)
+            while size > self.max_frame * FRAME_HEADROOM:
+                level, quality = self.level, self.quality
+                self._step_down(frame_rate=False)
+                if (self.level, self.quality) == (level, quality):
+                    return False
+                # Predict the re-encoded size: JPEG bytes scale roughly with pixels and quality
+                (w0, h0), (w1, h1) = self.ladder[level], self.size
+                size *= (w1 * h1) / (w0 * h0) * self.quality / quality
+            return True
+
+    def _fit_target(self):
+        """Step down at once until the estimated rate fits the target, e.g. after a cut"""
+        while self.rate > self.target:
+            settings = (self.level, self.quality, self.fps)
+            self._step_down()
+            if (self.level, self.quality, self.fps) == settings:
+                return
+            # JPEG bytes scale roughly with quality; _set_level scales them with pixels
+            self.frame_bytes *= self.quality / settings[1]
+
+    def _step_down(self, frame_rate: bool = True):
+        floor = QUALITY_MIN if self.level == 0 else QUALITY_FLOOR
+        if self.quality > floor:
+            self.quality = max(floor, self.quality - QUALITY_STEP)
+        elif self.level > 0:
+            self._set_level(self.level - 1)
+        elif frame_rate and self.fps > self.fps_steps[0]:
+            self._set_fps(max(f for f in self.fps_steps if f < self.fps))
+
+    def _step_up(self, now: float):
+        hold = RECOVERY_HOLD if self.rate * 2 < self.target else ADAPT_HOLD
+        if now - self.last_step_up >= hold:
+            # Frame rate and resolution first, each only if the result would still fit
+            if self.fps < self.max_fps:
+                fps = min(min(f for f in self.fps_steps if f > self.fps), self.max_fps)
+                if self.rate * fps / self.fps < self.target:
+                    self.last_step_up = now
+                    self._set_fps(fps)
+                    return
+            elif self.level + 1 < len(self.ladder):
+                (w0, h0), (w1, h1) = self.size, self.ladder[self.level + 1]
+                if self.rate * (w1 * h1) / (w0 * h0) < self.target:
+                    self.last_step_up = now
+                    self._set_level(self.level + 1)
+                    return
+        if self.fps < self.max_fps and self.quality >= QUALITY_FLOOR:
+            return  # keep the headroom for the frame rate
+        self.quality = min(QUALITY_MAX, self.quality + QUALITY_STEP)
+
+    def _set_level(self, level: int):
+        (w0, h0), (w1, h1) = self.size, self.ladder[level]
+        if self.frame_bytes is not None:
+            self.frame_bytes *= (w1 * h1) / (w0 * h0)
+        self.level = level
+
+    def _set_fps(self, fps: float):
+        self.fps = fps
+
+
+def encode_frame(frame: np.ndarray, rate: RateController, now: float = None) -> bytes:
+    """
+    JPEG-encode a BGR frame at the controller's settings, re-encoding smaller
+    until it fits max_frame. None if even the smallest setting does not.
+    """
+    while True:
+        if frame.shape[1::-1] != rate.size:
+            frame = cv2.resize(frame, rate.size, interpolation=cv2.INTER_AREA)
+        success, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, rate.quality])
+        if not success:
+            return None
+        if rate.fits(len(encoded)):
+            rate.on_frame(len(encoded), now)
+            return encoded.tobytes()
+        if not rate.oversize(len(encoded)):
+            return None
+
+
+def choose_layer(layer_heights, tile_height: int, active_speaker: bool = False) -> int:
+    """
+    Simulcast layer for one tile: the smallest layer at least as tall as the
+    tile, one layer up for the active speaker. layer_heights is the top
+    resolution height of each layer, smallest first.
+    """
+    top = len(layer_heights) - 1
+    layer = next((i for i, height in enumerate(layer_heights) if height >= tile_height), top)
+    return min(layer + 1, top) if active_speaker else layer